@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+
+"""Measure the effect of the ``restrict`` and ``aligned`` attributes of
+dimension declarations on a vectorizable kernel, at a number of
+optimization levels.
+
+The translated sources are compiled with ``$CC`` (default ``gcc``) and
+run in a temporary directory. For each variant, the number of loops the
+compiler reports (via ``-fopt-info-vec-optimized``) as vectorized and as
+versioned, i.e. duplicated with a run time check for aliasing, and the
+fastest of several kernel runs are reported.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+from subprocess import check_call, check_output, STDOUT
+
+import cnd
+
+
+KERNEL_SOURCE = """
+void update(float *x, float *y, float *z, int n, float alpha)
+{
+  dimension x[n, n] %(attributes)s;
+  dimension y[n, n] %(attributes)s;
+  dimension z[n, n] %(attributes)s;
+
+  for (int i = 0; i < n; ++i)
+    for (int j = 0; j < n; ++j)
+      x[i, j] = alpha*x[i, j] + y[i, j]*z[i, j];
+}
+"""
+
+DRIVER_SOURCE = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+void update(float *x, float *y, float *z, int n, float alpha);
+
+int main(int argc, char **argv)
+{
+  int n = atoi(argv[1]), repeat = atoi(argv[2]);
+  dimension x[n, n];
+  dimension y[n, n];
+  dimension z[n, n];
+  CND_DECL_ALLOC_HEAP_ALIGNED(float, x, 64);
+  CND_DECL_ALLOC_HEAP_ALIGNED(float, y, 64);
+  CND_DECL_ALLOC_HEAP_ALIGNED(float, z, 64);
+  double best = -1;
+
+  for (int i = 0; i < n; ++i)
+    for (int j = 0; j < n; ++j)
+    {
+      x[i, j] = 0;
+      y[i, j] = (i % 7) * 0.25f;
+      z[i, j] = (j % 5) * 0.5f;
+    }
+
+  for (int r = 0; r < repeat; ++r)
+  {
+    struct timespec start, stop;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    update(x, y, z, n, 0.5f);
+    clock_gettime(CLOCK_MONOTONIC, &stop);
+
+    double elapsed = (stop.tv_sec - start.tv_sec)
+      + 1e-9*(stop.tv_nsec - start.tv_nsec);
+    if (best < 0 || elapsed < best)
+      best = elapsed;
+  }
+
+  printf("%g\\n", best);
+  return 0;
+}
+"""
+
+VARIANTS = [
+        ("none", ""),
+        ("restrict", "restrict"),
+        ("aligned", "aligned(64)"),
+        ("both", "restrict aligned(64)"),
+        ]
+
+
+def translate(src, filename):
+    src = "\n".join(cnd.PREAMBLE + ["# 1 \"%s\"" % filename]) + "\n" + src
+    src = cnd.preprocess_source(src, None, [])
+
+    parser = cnd.get_parser(cnd.GnuCndParser)
+    prefix, ast = cnd.parse_with_header_snapshot(parser, src, filename)
+    return prefix + cnd.GnuCGenerator().visit(ast)
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("-n", type="int", default=256,
+            help="array size along each axis")
+    parser.add_option("--opt", default="-O2,-O3,-O3 -march=native",
+            help="compiler options to try (comma-separated)")
+    parser.add_option("--repeat", type="int", default=200,
+            help="number of kernel runs")
+
+    options, args = parser.parse_args()
+
+    cc = os.environ.get("CC", "gcc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-array-attributes-")
+
+    try:
+        driver = os.path.join(tmpdir, "main.c")
+        with open(driver, "w") as outf:
+            outf.write(translate(DRIVER_SOURCE, "main.c"))
+
+        print("%-20s %-10s %10s %10s %10s %9s" % (
+            "options", "variant", "vectorized", "versioned", "time", "change"))
+
+        for opt in options.opt.split(","):
+            baseline = None
+
+            for name, attributes in VARIANTS:
+                source = os.path.join(tmpdir, "update-%s.c" % name)
+                executable = os.path.join(tmpdir, "update-%s" % name)
+
+                with open(source, "w") as outf:
+                    outf.write(translate(
+                        KERNEL_SOURCE % dict(attributes=attributes),
+                        "update.c"))
+
+                report = check_output([cc, "-std=gnu99", "-c",
+                    "-fopt-info-vec-optimized", "-o", os.devnull, source]
+                    + opt.split(), stderr=STDOUT)
+                nvectorized = report.count(b"loop vectorized")
+                nversioned = report.count(b"loop versioned")
+
+                check_call([cc, "-std=gnu99", "-o", executable, source, driver]
+                        + opt.split())
+
+                elapsed = float(check_output([
+                    executable, str(options.n), str(options.repeat)]))
+
+                if baseline is None:
+                    baseline = elapsed
+
+                print("%-20s %-10s %10d %10d %8.2fus %+8.1f%%" % (
+                    opt, name, nvectorized, nversioned, elapsed*1e6,
+                    (elapsed / baseline - 1)*100))
+                sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+
+"""Measure the run time overhead of bounds checking on the ``sgemm``
+example from the README, for each bounds checking mode (none, ``naive``
+and ``hoisted``) and a number of optimization levels.
+
+The translated sources are compiled with ``$CC`` (default ``gcc``) and
+run in a temporary directory. Each run multiplies two matrices several
+times, and the fastest multiplication is reported.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+from subprocess import check_call, check_output
+
+import cnd
+
+
+SGEMM_SOURCE = """
+void sgemm(float *a, float *b, float *c, int n)
+{
+  dimension "fortran" a[n, n];
+  dimension "fortran" b[n, n];
+  dimension c[n, n];
+
+  for (int i = 1; i <= n; ++i)
+    for (int j = 1; j <= n; ++j)
+    {
+      float tmp = 0;
+
+      for (int k = 1; k <= n; ++k)
+        tmp += a[i,k]*b[k,j];
+
+      c[i-1,j-1] = tmp;
+    }
+}
+"""
+
+DRIVER_SOURCE = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+void sgemm(float *a, float *b, float *c, int n);
+
+int main(int argc, char **argv)
+{
+  int n = atoi(argv[1]), repeat = atoi(argv[2]);
+  float *a = malloc(sizeof(float)*n*n);
+  float *b = malloc(sizeof(float)*n*n);
+  float *c = malloc(sizeof(float)*n*n);
+  double best = -1;
+
+  for (int i = 0; i < n*n; ++i)
+  {
+    a[i] = (i % 7) * 0.25f;
+    b[i] = (i % 5) * 0.5f;
+  }
+
+  for (int r = 0; r < repeat; ++r)
+  {
+    struct timespec start, stop;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    sgemm(a, b, c, n);
+    clock_gettime(CLOCK_MONOTONIC, &stop);
+
+    double elapsed = (stop.tv_sec - start.tv_sec)
+      + 1e-9*(stop.tv_nsec - start.tv_nsec);
+    if (best < 0 || elapsed < best)
+      best = elapsed;
+  }
+
+  printf("%g\\n", best);
+  return 0;
+}
+"""
+
+MODES = [None, "naive", "hoisted"]
+
+
+def translate(bounds_check):
+    parser = cnd.get_parser(cnd.GnuCndParser)
+    ast = parser.parse(SGEMM_SOURCE, filename="sgemm.c")
+
+    generator = cnd.GnuCGenerator()
+    generator.bounds_check = bounds_check
+    return generator.visit(ast)
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("-n", type="int", default=512,
+            help="matrix size")
+    parser.add_option("--opt", default="O0,O1,O2,O3",
+            help="optimization levels to try (comma-separated)")
+    parser.add_option("--repeat", type="int", default=5,
+            help="number of multiplications per run")
+
+    options, args = parser.parse_args()
+
+    cc = os.environ.get("CC", "gcc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-bounds-check-")
+
+    try:
+        driver = os.path.join(tmpdir, "main.c")
+        with open(driver, "w") as outf:
+            outf.write(DRIVER_SOURCE)
+
+        print("%-6s %-10s %10s %9s" % ("opt", "mode", "time", "overhead"))
+
+        for opt in options.opt.split(","):
+            baseline = None
+
+            for mode in MODES:
+                name = "sgemm-%s" % (mode or "none")
+                source = os.path.join(tmpdir, name + ".c")
+                executable = os.path.join(tmpdir, "%s-%s" % (name, opt))
+
+                with open(source, "w") as outf:
+                    outf.write(translate(mode))
+
+                check_call([cc, "-std=c99", "-D_POSIX_C_SOURCE=199309L",
+                    "-" + opt, "-o", executable, source, driver])
+
+                elapsed = float(check_output([
+                    executable, str(options.n), str(options.repeat)]))
+
+                if baseline is None:
+                    baseline = elapsed
+
+                print("%-6s %-10s %8.1fms %+8.1f%%" % (
+                    opt, mode or "none", elapsed*1e3,
+                    (elapsed / baseline - 1)*100))
+                sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
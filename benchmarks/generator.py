@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+
+"""Time code generation for synthetic sources with many dimensioned arrays
+and deeply nested blocks.
+
+Usage: python benchmarks/generator.py [NARRAYS,...] [DEPTH,...]
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import sys
+from time import time
+
+import cnd
+
+
+def make_source(narrays, depth, nblocks=2000):
+    lines = ["void f(int n, int m, int i, int j, int k, %s)" % ", ".join(
+        "float *a%d" % iarray for iarray in range(narrays)), "{"]
+
+    for iarray in range(narrays):
+        if iarray % 3 == 0:
+            lines.append("dimension a%d[n, m];" % iarray)
+        elif iarray % 3 == 1:
+            lines.append("dimension \"fortran\" a%d[n, 2:m, 3];" % iarray)
+        else:
+            lines.append("dimension a%d[1:n+1:2];" % iarray)
+
+    lines.extend(["{"] * depth)
+
+    for iblock in range(nblocks):
+        iarray = iblock % narrays
+        if iarray % 3 == 0:
+            idx = "i, j+%d" % (iblock % 5)
+        elif iarray % 3 == 1:
+            idx = "i+1, j, k"
+        else:
+            idx = "i+%d" % (iblock % 7)
+
+        lines.append("{ a%d[%s] += 1; }" % (iarray, idx))
+
+    lines.extend(["}"] * depth)
+    lines.append("}")
+
+    return "\n".join(lines)
+
+
+def main():
+    narrays_list = [10, 100, 500]
+    depths = [1, 10, 50]
+    if len(sys.argv) > 1:
+        narrays_list = [int(s) for s in sys.argv[1].split(",")]
+    if len(sys.argv) > 2:
+        depths = [int(s) for s in sys.argv[2].split(",")]
+
+    parser = cnd.GnuCndParser()
+
+    print("%8s %6s %12s %12s" % ("arrays", "depth", "simplified", "plain"))
+    for narrays in narrays_list:
+        for depth in depths:
+            ast = parser.parse(make_source(narrays, depth), filename="bench.c")
+
+            timings = []
+            for simplify in [True, False]:
+                best = None
+                for i in range(3):
+                    generator = cnd.GnuCGenerator()
+                    generator.simplify_index_expressions = simplify
+
+                    start = time()
+                    generator.visit(ast)
+                    elapsed = time() - start
+
+                    if best is None or elapsed < best:
+                        best = elapsed
+
+                timings.append(best)
+
+            print("%8d %6d %10.1fms %10.1fms" % (
+                narrays, depth, timings[0]*1e3, timings[1]*1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#! /usr/bin/env python
+
+"""Measure the effect of hoisting axis strides into locals (see
+:attr:`cnd.CndGeneratorMixin.hoist_strides`) on the ``sgemm`` example from
+the README, at a number of optimization levels.
+
+Two versions of the kernel are translated: ``sgemm``, as in the README, and
+``sgemm_shape``, which takes the matrix size from a structure passed by
+pointer. In the latter, unless the compiler assumes strict aliasing (as
+GCC does from ``-O2`` on), each store to ``c`` might change the size, so it
+must be reloaded, and the strides recomputed, for every access that is not
+hoisted.
+
+The translated sources are compiled with ``$CC`` (default ``gcc``) and run
+in a temporary directory. Reported are the number of instructions the
+compiler generates for the kernels and the fastest of several
+multiplications (over a number of runs of the executables, alternating
+between the variants).
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+from subprocess import check_call, check_output
+
+import cnd
+
+
+SGEMM_SOURCE = """
+struct shape { int n; };
+
+void sgemm(float *a, float *b, float *c, int n)
+{
+  dimension "fortran" a[n, n];
+  dimension "fortran" b[n, n];
+  dimension c[n, n];
+
+  for (int i = 1; i <= n; ++i)
+    for (int j = 1; j <= n; ++j)
+    {
+      float tmp = 0;
+
+      for (int k = 1; k <= n; ++k)
+        tmp += a[i,k]*b[k,j];
+
+      c[i-1,j-1] = tmp;
+    }
+}
+
+void sgemm_shape(float *a, float *b, float *c, struct shape *s)
+{
+  dimension "fortran" a[s->n, s->n];
+  dimension "fortran" b[s->n, s->n];
+  dimension c[s->n, s->n];
+
+  for (int i = 1; i <= s->n; ++i)
+    for (int j = 1; j <= s->n; ++j)
+    {
+      float tmp = 0;
+
+      for (int k = 1; k <= s->n; ++k)
+        tmp += a[i,k]*b[k,j];
+
+      c[i-1,j-1] = tmp;
+    }
+}
+"""
+
+DRIVER_SOURCE = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+struct shape { int n; };
+
+void sgemm(float *a, float *b, float *c, int n);
+void sgemm_shape(float *a, float *b, float *c, struct shape *s);
+
+static double now(void)
+{
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + 1e-9*t.tv_nsec;
+}
+
+int main(int argc, char **argv)
+{
+  int n = atoi(argv[1]), repeat = atoi(argv[2]);
+  struct shape s = { n };
+  float *a = malloc(sizeof(float)*n*n);
+  float *b = malloc(sizeof(float)*n*n);
+  float *c = malloc(sizeof(float)*n*n);
+  double best_sgemm = -1, best_shape = -1, checksum = 0;
+
+  for (int i = 0; i < n*n; ++i)
+  {
+    a[i] = (i % 7) * 0.25f;
+    b[i] = (i % 5) * 0.5f;
+  }
+
+  for (int r = 0; r < repeat; ++r)
+  {
+    double start = now();
+    sgemm(a, b, c, n);
+    double elapsed = now() - start;
+    if (best_sgemm < 0 || elapsed < best_sgemm)
+      best_sgemm = elapsed;
+
+    start = now();
+    sgemm_shape(a, b, c, &s);
+    elapsed = now() - start;
+    if (best_shape < 0 || elapsed < best_shape)
+      best_shape = elapsed;
+  }
+
+  for (int i = 0; i < n*n; ++i)
+    checksum += (i % 3) * c[i];
+
+  printf("%g %g %.10g\\n", best_sgemm, best_shape, checksum);
+  return 0;
+}
+"""
+
+
+def translate(hoist_strides):
+    parser = cnd.get_parser(cnd.GnuCndParser)
+    ast = parser.parse(SGEMM_SOURCE, filename="sgemm.c")
+
+    generator = cnd.GnuCGenerator()
+    generator.hoist_strides = hoist_strides
+    return generator.visit(ast)
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("-n", type="int", default=384,
+            help="matrix size")
+    parser.add_option("--opt", default="-O1,-O2",
+            help="compiler options to try (comma-separated)")
+    parser.add_option("--repeat", type="int", default=3,
+            help="number of multiplications per executable run")
+    parser.add_option("--runs", type="int", default=3,
+            help="number of runs of each executable")
+
+    options, args = parser.parse_args()
+
+    cc = os.environ.get("CC", "gcc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-hoisted-strides-")
+
+    try:
+        driver = os.path.join(tmpdir, "main.c")
+        with open(driver, "w") as outf:
+            outf.write(DRIVER_SOURCE)
+
+        print("%-7s %-7s %6s %11s %9s %11s %9s %14s" % (
+            "options", "hoisted", "insns", "sgemm", "change",
+            "shape", "change", "checksum"))
+
+        for opt in options.opt.split(","):
+            variants = [False, True]
+            executables = []
+            instruction_counts = []
+
+            for hoist_strides in variants:
+                name = "sgemm-%d" % hoist_strides
+                source = os.path.join(tmpdir, "%s.c" % name)
+                assembly = os.path.join(tmpdir, "%s.s" % name)
+                executable = os.path.join(tmpdir, name)
+
+                with open(source, "w") as outf:
+                    outf.write(translate(hoist_strides))
+
+                check_call([cc, "-std=gnu99", "-S", "-o", assembly, source]
+                        + opt.split())
+                with open(assembly) as inf:
+                    instruction_counts.append(
+                            len(re.findall(r"^\t[a-z]", inf.read(), re.M)))
+
+                check_call([cc, "-std=gnu99", "-o", executable, source,
+                    driver] + opt.split())
+                executables.append(executable)
+
+            best = [[None, None] for hoist_strides in variants]
+            checksums = [None for hoist_strides in variants]
+            for run in range(options.runs):
+                for i, executable in enumerate(executables):
+                    t_sgemm, t_shape, checksums[i] = check_output([
+                        executable, str(options.n), str(options.repeat)]
+                        ).split()
+
+                    for j, elapsed in enumerate([t_sgemm, t_shape]):
+                        elapsed = float(elapsed)
+                        if best[i][j] is None or elapsed < best[i][j]:
+                            best[i][j] = elapsed
+
+            baseline = best[0]
+            for hoist_strides, ninstructions, (t_sgemm, t_shape), \
+                    checksum in zip(
+                            variants, instruction_counts, best, checksums):
+                print("%-7s %-7s %6d %9.2fms %+8.1f%% %9.2fms "
+                        "%+8.1f%% %14s" % (
+                            opt, hoist_strides and "yes" or "no",
+                            ninstructions,
+                            t_sgemm*1e3, (t_sgemm / baseline[0] - 1)*100,
+                            t_shape*1e3, (t_shape / baseline[1] - 1)*100,
+                            checksum.decode()))
+            sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#! /usr/bin/env python
+
+"""Compare the index types (and the use of ``mad24``) that
+:func:`cnd.transform_cl` can be asked to compute array offsets in, on
+reductions of a rank-3 array along its fastest-varying and its
+slowest-varying axis, at a number of optimization levels.
+
+Lacking an OpenCL implementation to run them on, the translated kernels are
+compiled as C, with ``__kernel`` and ``__global`` defined away,
+``get_global_id`` standing for a loop over the work items in the driver,
+and ``mad24`` and ``mul24`` standing for plain ``int`` arithmetic. So the
+timings reflect the width of the index arithmetic on the host CPU, not the
+performance of any OpenCL device, where 64-bit arithmetic tends to be
+considerably more expensive.
+
+The sources are compiled with ``$CC`` (default ``gcc``) and run in a
+temporary directory. Reported are the number of instructions the compiler
+generates for the kernels, the fastest of several runs of each kernel
+(over a number of runs of the executables, alternating between the
+variants) and a checksum of the results (which must not depend on the
+index type).
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+from subprocess import check_call, check_output
+
+import cnd
+
+
+SOURCE = """
+__kernel void reduce_rows(__global double *a, __global double *rows,
+    int n0, int n1, int n2)
+{
+  dimension a[n0, n1, n2];
+  dimension rows[n0, n1];
+  CND_INDEX_TYPE i = get_global_id(0);
+
+  CND_FOR_AXIS(j, a, 1)
+  {
+    double s = 0;
+    CND_FOR_AXIS(k, a, 2)
+      s += a[i, j, k];
+    rows[i, j] = s;
+  }
+}
+
+__kernel void reduce_columns(__global double *a, __global double *columns,
+    int n0, int n1, int n2)
+{
+  dimension a[n0, n1, n2];
+  dimension columns[n1, n2];
+  CND_INDEX_TYPE j = get_global_id(0);
+
+  CND_FOR_AXIS(k, a, 2)
+  {
+    double s = 0;
+    CND_FOR_AXIS(i, a, 0)
+      s += a[i, j, k];
+    columns[j, k] = s;
+  }
+}
+"""
+
+# makes translated OpenCL code compile as C
+OPENCL_AS_C_PRELUDE = """
+#include <stddef.h>
+#define __kernel
+#define __global
+extern long cnd_work_item;
+#define get_global_id(dim) cnd_work_item
+#define mad24(a, b, c) ((a)*(b) + (c))
+#define mul24(a, b) ((a)*(b))
+"""
+
+DRIVER_SOURCE = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+void reduce_rows(double *a, double *rows, int n0, int n1, int n2);
+void reduce_columns(double *a, double *columns, int n0, int n1, int n2);
+
+long cnd_work_item;
+#define RUN(kernel, nitems, args) \\
+  for (cnd_work_item = 0; cnd_work_item < (nitems); ++cnd_work_item) \\
+    kernel args
+
+static double now(void)
+{
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + 1e-9*t.tv_nsec;
+}
+
+int main(int argc, char **argv)
+{
+  int n0 = atoi(argv[1]), n1 = atoi(argv[2]), n2 = atoi(argv[3]);
+  int repeat = atoi(argv[4]);
+  double *a = malloc(sizeof(double)*n0*n1*n2);
+  double *rows = malloc(sizeof(double)*n0*n1);
+  double *columns = malloc(sizeof(double)*n1*n2);
+  double best_rows = -1, best_columns = -1, checksum = 0;
+
+  for (long i = 0; i < (long) n0*n1*n2; ++i)
+    a[i] = (i % 7) * 0.25;
+
+  for (int r = 0; r < repeat; ++r)
+  {
+    double start = now();
+    RUN(reduce_rows, n0, (a, rows, n0, n1, n2));
+    double elapsed = now() - start;
+    if (best_rows < 0 || elapsed < best_rows)
+      best_rows = elapsed;
+
+    start = now();
+    RUN(reduce_columns, n1, (a, columns, n0, n1, n2));
+    elapsed = now() - start;
+    if (best_columns < 0 || elapsed < best_columns)
+      best_columns = elapsed;
+  }
+
+  for (int i = 0; i < n0*n1; ++i)
+    checksum += (i % 3) * rows[i];
+  for (int i = 0; i < n1*n2; ++i)
+    checksum += (i % 5) * columns[i];
+
+  printf("%g %g %.10g\\n", best_rows, best_columns, checksum);
+  return 0;
+}
+"""
+
+# (name, index type, use_mad24)
+VARIANTS = [
+        ("default", None, False),
+        ("long", "long", False),
+        ("size_t", "size_t", False),
+        ("int", "int", False),
+        ("unsigned", "unsigned", False),
+        ("int+mad24", "int", True),
+        ]
+
+
+def translate(src, index_type, use_mad24):
+    src = "\n".join(cnd.PREAMBLE + ["# 1 \"kernels.cl\""]) + "\n" + src
+
+    # also the type of the loop variables of CND_FOR_AXIS
+    src = cnd.preprocess_source(src, None,
+            ["-DCND_INDEX_TYPE=%s" % (index_type or "size_t")])
+
+    return cnd.transform_cl(src, "kernels.cl", use_cache=False,
+            index_type=index_type, use_mad24=use_mad24)
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--shape", default="64,128,128",
+            help="array shape (comma-separated)")
+    parser.add_option("--opt", default="-O1,-O3",
+            help="compiler options to try (comma-separated)")
+    parser.add_option("--repeat", type="int", default=20,
+            help="number of runs of each kernel per executable run")
+    parser.add_option("--runs", type="int", default=3,
+            help="number of runs of each executable")
+
+    options, args = parser.parse_args()
+
+    cc = os.environ.get("CC", "gcc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-index-types-")
+
+    try:
+        driver = os.path.join(tmpdir, "main.c")
+        with open(driver, "w") as outf:
+            outf.write(DRIVER_SOURCE)
+
+        print("%-7s %-10s %6s %11s %9s %11s %9s %14s" % (
+            "options", "index type", "insns", "rows", "change",
+            "columns", "change", "checksum"))
+
+        for opt in options.opt.split(","):
+            executables = []
+            instruction_counts = []
+
+            for i, (name, index_type, use_mad24) in enumerate(VARIANTS):
+                source = os.path.join(tmpdir, "kernels%d.c" % i)
+                assembly = os.path.join(tmpdir, "kernels%d.s" % i)
+                executable = os.path.join(tmpdir, "kernels%d" % i)
+
+                with open(source, "w") as outf:
+                    outf.write(OPENCL_AS_C_PRELUDE)
+                    outf.write(translate(SOURCE, index_type, use_mad24))
+
+                check_call([cc, "-std=gnu99", "-S", "-o", assembly, source]
+                        + opt.split())
+                with open(assembly) as inf:
+                    instruction_counts.append(
+                            len(re.findall(r"^\t[a-z]", inf.read(), re.M)))
+
+                check_call([cc, "-std=gnu99", "-o", executable, source,
+                    driver] + opt.split())
+                executables.append(executable)
+
+            best = [[None, None] for variant in VARIANTS]
+            checksums = [None for variant in VARIANTS]
+            for run in range(options.runs):
+                for i, executable in enumerate(executables):
+                    t_rows, t_columns, checksums[i] = check_output(
+                            [executable] + options.shape.split(",")
+                            + [str(options.repeat)]).split()
+
+                    for j, elapsed in enumerate([t_rows, t_columns]):
+                        elapsed = float(elapsed)
+                        if best[i][j] is None or elapsed < best[i][j]:
+                            best[i][j] = elapsed
+
+            baseline = best[0]
+            for (name, index_type, use_mad24), ninstructions, \
+                    (t_rows, t_columns), checksum in zip(
+                            VARIANTS, instruction_counts, best, checksums):
+                print("%-7s %-10s %6d %9.2fms %+8.1f%% %9.2fms "
+                        "%+8.1f%% %14s" % (
+                            opt, name, ninstructions,
+                            t_rows*1e3, (t_rows / baseline[0] - 1)*100,
+                            t_columns*1e3, (t_columns / baseline[1] - 1)*100,
+                            checksum.decode()))
+            sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+
+"""Check that code generation scales linearly with the size of compound
+statements, on synthetic sources (see :mod:`synthetic`) whose function
+body is a single loop holding all statements.
+
+For each number of statements, the time taken to generate code into a
+string (:meth:`cnd.GnuCGenerator.visit`) and to write it to a file
+(:meth:`cnd.GnuCGenerator.write_file_ast`) is reported, also per statement
+and relative to the time per statement for the smallest size, which stays
+close to 1 if generation takes linear time. Parsing is done beforehand and
+not timed.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+from time import time
+
+import cnd
+from synthetic import make_source
+
+
+def parse(nstatements):
+    filename = "large_blocks.c"
+
+    src = make_source(nstatements, depth=1, block_size=None)
+    src = cnd.insert_parens_in_brackets(filename, src)
+    src = "\n".join(cnd.PREAMBLE + ["# 1 \"%s\"" % filename]) + "\n" + src
+    src = cnd.preprocess_source(src, None, [])
+
+    parser = cnd.get_parser(cnd.GnuCndParser)
+    return parser.parse(src, filename=filename)
+
+
+def time_best(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time()
+        func()
+        elapsed = time() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--statements", default="2500,5000,10000,20000,40000",
+            help="numbers of statements to try (comma-separated)")
+    parser.add_option("--repeat", type="int", default=3,
+            help="number of runs of each measurement")
+
+    options, args = parser.parse_args()
+
+    print("%10s %10s %10s %8s %10s %10s %8s" % (
+        "statements", "visit", "per stmt", "scaling",
+        "write", "per stmt", "scaling"))
+
+    baseline = None
+
+    for nstatements in [int(n) for n in options.statements.split(",")]:
+        ast = parse(nstatements)
+
+        def visit():
+            cnd.GnuCGenerator().visit(ast)
+
+        def write():
+            with open(os.devnull, "w") as outf:
+                cnd.GnuCGenerator().write_file_ast(ast, outf)
+
+        per_statement = [
+                time_best(func, options.repeat) / nstatements
+                for func in [visit, write]]
+
+        if baseline is None:
+            baseline = per_statement
+
+        print("%10d %9.3fs %8.1fus %8.2f %9.3fs %8.1fus %8.2f" % (
+            nstatements,
+            per_statement[0]*nstatements, per_statement[0]*1e6,
+            per_statement[0] / baseline[0],
+            per_statement[1]*nstatements, per_statement[1]*1e6,
+            per_statement[1] / baseline[1]))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
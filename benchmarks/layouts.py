@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+
+"""Compare array layouts (see the README) on a matrix transpose and a
+five-point stencil in two dimensions, for a number of array sizes.
+
+The translated sources are compiled with ``$CC`` (default ``gcc``) and
+run in a temporary directory. Each run applies each kernel several times,
+and the fastest application is reported, along with a checksum of the
+results (which must not depend on the layout).
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+from subprocess import check_call, check_output
+
+import cnd
+
+
+SOURCE = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+void transpose(double *a, double *b, int n)
+{
+  dimension %(layout)s a[n, n];
+  dimension %(layout)s b[n, n];
+
+  for (int i = 0; i < n; ++i)
+    for (int j = 0; j < n; ++j)
+      b[j, i] = a[i, j];
+}
+
+void stencil(double *u, double *v, int n)
+{
+  dimension %(layout)s u[n, n];
+  dimension %(layout)s v[n, n];
+
+  for (int i = 1; i < n-1; ++i)
+    for (int j = 1; j < n-1; ++j)
+      v[i, j] = 0.25*(u[i-1, j] + u[i+1, j] + u[i, j-1] + u[i, j+1])
+        - u[i, j];
+}
+
+static double now(void)
+{
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + 1e-9*t.tv_nsec;
+}
+
+int main(int argc, char **argv)
+{
+  int n = atoi(argv[1]), repeat = atoi(argv[2]);
+  dimension %(layout)s a[n, n];
+  dimension %(layout)s b[n, n];
+  CND_DECL_ALLOC_HEAP(double, a);
+  CND_DECL_ALLOC_HEAP(double, b);
+  double best_transpose = -1, best_stencil = -1, checksum = 0;
+
+  for (int i = 0; i < n; ++i)
+    for (int j = 0; j < n; ++j)
+    {
+      a[i, j] = (i %% 7) * 0.25 + (j %% 5) * 0.5;
+      b[i, j] = 0;
+    }
+
+  for (int r = 0; r < repeat; ++r)
+  {
+    double start = now();
+    transpose(a, b, n);
+    double elapsed = now() - start;
+    if (best_transpose < 0 || elapsed < best_transpose)
+      best_transpose = elapsed;
+
+    start = now();
+    stencil(a, b, n);
+    elapsed = now() - start;
+    if (best_stencil < 0 || elapsed < best_stencil)
+      best_stencil = elapsed;
+  }
+
+  for (int i = 0; i < n; ++i)
+    for (int j = 0; j < n; ++j)
+      checksum += (i + 2*j) * b[i, j];
+
+  printf("%%g %%g %%.10g\\n", best_transpose, best_stencil, checksum);
+  return 0;
+}
+"""
+
+LAYOUTS = ["c", "tiled(8, 8)", "tiled(16, 16)", "tiled(32, 32)", "morton"]
+
+
+def translate(src, filename):
+    src = "\n".join(cnd.PREAMBLE + ["# 1 \"%s\"" % filename]) + "\n" + src
+    src = cnd.preprocess_source(src, None, [])
+
+    parser = cnd.get_parser(cnd.GnuCndParser)
+    prefix, ast = cnd.parse_with_header_snapshot(parser, src, filename)
+    return prefix + cnd.GnuCGenerator().visit(ast)
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--sizes", default="1000,1024,2048",
+            help="array sizes along each axis to try (comma-separated)")
+    parser.add_option("--opt", default="-O3",
+            help="compiler options (space-separated)")
+    parser.add_option("--repeat", type="int", default=10,
+            help="number of runs of each kernel")
+
+    options, args = parser.parse_args()
+
+    cc = os.environ.get("CC", "gcc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-layouts-")
+
+    try:
+        executables = []
+        for i, layout in enumerate(LAYOUTS):
+            source = os.path.join(tmpdir, "layout%d.c" % i)
+            executable = os.path.join(tmpdir, "layout%d" % i)
+
+            with open(source, "w") as outf:
+                outf.write(translate(
+                    SOURCE % dict(layout='"%s"' % layout), "layouts.c"))
+
+            check_call([cc, "-std=gnu99", "-o", executable, source]
+                    + options.opt.split())
+            executables.append(executable)
+
+        print("%6s %-14s %11s %9s %11s %9s %14s" % (
+            "n", "layout", "transpose", "change", "stencil", "change",
+            "checksum"))
+
+        for n in [int(n) for n in options.sizes.split(",")]:
+            baseline = None
+
+            for layout, executable in zip(LAYOUTS, executables):
+                t_transpose, t_stencil, checksum = check_output([
+                    executable, str(n), str(options.repeat)]).split()
+                t_transpose = float(t_transpose)
+                t_stencil = float(t_stencil)
+
+                if baseline is None:
+                    baseline = t_transpose, t_stencil
+
+                print("%6d %-14s %9.2fms %+8.1f%% %9.2fms %+8.1f%% %14s" % (
+                    n, layout,
+                    t_transpose*1e3, (t_transpose / baseline[0] - 1)*100,
+                    t_stencil*1e3, (t_stencil / baseline[1] - 1)*100,
+                    checksum.decode()))
+                sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+"""Compare the size of the generated code, and the time the C compiler
+takes to compile it, for each granularity of ``#line`` directives (see
+:attr:`cnd.CndGeneratorMixin.line_directives`), on synthetic sources (see
+:mod:`synthetic`).
+
+The generated sources are compiled with ``$CC`` (default ``gcc``), by
+default with ``-O0``, where lexing and parsing make up the largest share of
+the compiler's time. (Use ``--cflags=-fsyntax-only`` to measure nothing
+else.) The fastest of several compiler runs is reported.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+from subprocess import check_call
+from time import time
+
+import cnd
+from synthetic import make_source
+
+
+def translate(src, granularity):
+    parser = cnd.get_parser(cnd.GnuCndParser)
+    ast = parser.parse(src, filename="synthetic.c")
+
+    generator = cnd.GnuCGenerator()
+    generator.line_directives = cnd.get_line_directives_setting(granularity)
+    return generator.visit(ast)
+
+
+def time_compile(cc, cflags, source, repeat):
+    best = None
+    for i in range(repeat):
+        start = time()
+        check_call([cc, "-std=c99", "-c", "-o", os.devnull, source] + cflags)
+        elapsed = time() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--functions", default="10,40",
+            help="function counts to try (comma-separated)")
+    parser.add_option("--statements", type="int", default=400,
+            help="statements per function")
+    parser.add_option("--repeat", type="int", default=3,
+            help="number of compiler runs, the fastest of which is reported")
+    parser.add_option("--cflags", default="-O0",
+            help="compiler options (space-separated)")
+
+    options, args = parser.parse_args()
+
+    cc = os.environ.get("CC", "gcc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-line-directives-")
+
+    try:
+        print("%9s %-10s %10s %10s %10s" % (
+            "functions", "directives", "size KB", "#lines", "cc time"))
+
+        for nfunctions in [int(n) for n in options.functions.split(",")]:
+            src = make_source(options.statements, nfunctions=nfunctions)
+            src = "\n".join(cnd.PREAMBLE + ["# 1 \"synthetic.c\""]) + "\n" + src
+            src = cnd.preprocess_source(src, None, [])
+
+            for granularity in cnd.LINE_DIRECTIVE_GRANULARITIES:
+                gen_src = translate(src, granularity)
+
+                source = os.path.join(tmpdir, "%s.c" % granularity)
+                with open(source, "w") as outf:
+                    outf.write(gen_src)
+
+                print("%9d %-10s %10.1f %10d %9.2fs" % (
+                    nfunctions, granularity, len(gen_src) / 1024,
+                    gen_src.count("\n# "),
+                    time_compile(cc, options.cflags.split(), source,
+                        options.repeat)))
+                sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
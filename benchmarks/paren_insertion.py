@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+
+"""Measure the throughput, in MB/s, of :func:`cnd.insert_parens_in_brackets`
+and of the character-by-character implementation it replaced (kept below
+as :func:`insert_parens_in_brackets_reference`), on:
+
+* ``synthetic``: a synthetic source (see :mod:`synthetic`)
+* ``comments``: the same, with a block comment and a line comment
+  containing brackets and apostrophes after every statement
+* ``sgemm``: the ``sgemm`` example from the README
+* ``allheaders``: ``examples/allheaders.c`` after preprocessing (skipped if
+  the preprocessor fails)
+
+Each input is repeated until it is at least ``--size`` MB long. The last
+column tells whether both implementations produce the same output. They
+are expected to differ on ``synthetic`` and ``comments``, whose comments
+contain brackets, which the reference implementation rewrites (and on
+``comments``, apostrophes, which confuse it).
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+from time import time
+
+import cnd
+from synthetic import make_source
+
+
+def insert_parens_in_brackets_reference(filename, s):
+    lines = s.split("\n")
+
+    new_lines = []
+    li = 0
+    in_string = None
+
+    while li < len(lines):
+        line = lines[li]
+        li += 1
+
+        if line.lstrip().startswith("#"):
+            while True:
+                new_lines.append(line)
+
+                if li >= len(lines) or not line.endswith("\\"):
+                    break
+
+                line = lines[li]
+                li += 1
+
+            continue
+
+        new_line = []
+
+        i = 0
+
+        while i < len(line):
+            c = line[i]
+
+            if c == "[" and not in_string:
+                new_line.append("[(")
+                i += 1
+            elif c == "]" and not in_string:
+                new_line.append(")]")
+                i += 1
+            elif c in "'\"" and not in_string:
+                new_line.append(c)
+                i += 1
+                in_string = c
+            elif c in "'\"" and in_string == c:
+                new_line.append(c)
+                i += 1
+                in_string = None
+            elif c == "\\" and in_string:
+                new_line.append(c)
+                i += 1
+                if i < len(line):
+                    new_line.append(line[i])
+                    i += 1
+            else:
+                new_line.append(c)
+                i += 1
+
+        new_lines.append("".join(new_line))
+
+    return "\n".join(new_lines)
+
+
+SGEMM_SOURCE = """
+void sgemm(float *a, float *b, float *c, int n)
+{
+  dimension "fortran" a[n, n];
+  dimension "fortran" b[n, n];
+  dimension c[n, n];
+
+  for (int i = 1; i <= n; ++i)
+    for (int j = 1; j <= n; ++j)
+    {
+      float tmp = 0;
+
+      for (int k = 1; k <= n; ++k)
+        tmp += a[i,k]*b[k,j];
+
+      c[i-1,j-1] = tmp;
+    }
+}
+"""
+
+
+def add_comments(src):
+    return "".join(
+            line + " /* see a[i, j] (it's b[j, i] transposed) */"
+            " // don't touch c[0]\n"
+            if line.rstrip().endswith(";") else line + "\n"
+            for line in src.split("\n"))
+
+
+def get_inputs():
+    synthetic = make_source(nstatements=2000)
+
+    inputs = [
+            ("synthetic", synthetic),
+            ("comments", add_comments(synthetic)),
+            ("sgemm", SGEMM_SOURCE),
+            ]
+
+    allheaders = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            os.pardir, "examples", "allheaders.c")
+    try:
+        with open(allheaders) as inf:
+            src = inf.read()
+        inputs.append(("allheaders", cnd.preprocess_source(src, None, [])))
+    except Exception as e:
+        print("skipping allheaders: %s" % e, file=sys.stderr)
+
+    return inputs
+
+
+def measure(func, src, repeat):
+    best = None
+    for i in range(repeat):
+        start = time()
+        result = func("bench.c", src)
+        elapsed = time() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return len(src) / best / 1e6, result
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--size", type="float", default=4,
+            help="minimum input size in MB")
+    parser.add_option("--repeat", type="int", default=3,
+            help="number of runs of each implementation")
+
+    options, args = parser.parse_args()
+
+    print("%-12s %8s %12s %12s %8s %5s" % (
+        "input", "size", "reference", "current", "speedup", "same"))
+
+    for name, src in get_inputs():
+        src = src * int(-(-options.size * 1e6 // len(src)))
+
+        old_throughput, old_result = measure(
+                insert_parens_in_brackets_reference, src, options.repeat)
+        new_throughput, new_result = measure(
+                cnd.insert_parens_in_brackets, src, options.repeat)
+
+        print("%-12s %6.1fMB %7.1f MB/s %7.1f MB/s %7.1fx %5s" % (
+            name, len(src) / 1e6, old_throughput, new_throughput,
+            new_throughput / old_throughput,
+            old_result == new_result and "yes" or "no"))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+
+"""Measure the rate at which :func:`cnd.transform_cl` translates the
+``sgemm`` example from the README, with the per-thread parsers handed out
+by :func:`cnd.get_parser` ("reused") and with a parser constructed anew
+for every call, as :func:`cnd.transform_cl` used to do ("fresh"), in a
+number of threads.
+
+The translation cache is bypassed. The parser tables are taken from the
+on-disk table cache (see :func:`cnd.build_yacc_parser`) in both cases, so
+"fresh" only pays for constructing the lexer and parser objects.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import threading
+from time import time
+
+import cnd
+
+
+SGEMM_SOURCE = """
+__kernel void sgemm(__global float *a, __global float *b, __global float *c,
+    int n)
+{
+  dimension "fortran" a[n, n];
+  dimension "fortran" b[n, n];
+  dimension c[n, n];
+
+  int i = get_global_id(0) + 1;
+  int j = get_global_id(1) + 1;
+
+  float tmp = 0;
+
+  for (int k = 1; k <= n; ++k)
+    tmp += a[i,k]*b[k,j];
+
+  c[i-1,j-1] = tmp;
+}
+"""
+
+
+def translate_reused():
+    return cnd.transform_cl(SGEMM_SOURCE, "sgemm.cl", use_cache=False)
+
+
+def translate_fresh():
+    parser = cnd.OpenCLCndParser()
+    ast = parser.parse(SGEMM_SOURCE, filename="sgemm.cl")
+
+    generator = cnd.OpenCLCGenerator()
+    generator.line_directives = None
+    return generator.visit(ast)
+
+
+def measure(translate, nthreads, ncalls):
+    """Return the number of calls to *translate* per second, made by
+    *nthreads* threads making *ncalls* calls each.
+    """
+    results = []
+
+    def run():
+        for i in range(ncalls):
+            results.append(translate())
+
+    threads = [threading.Thread(target=run) for i in range(nthreads)]
+
+    start = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - start
+
+    assert len(set(results)) == 1
+    return nthreads * ncalls / elapsed
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--threads", default="1,4",
+            help="numbers of threads to try (comma-separated)")
+    parser.add_option("--calls", type="int", default=200,
+            help="number of calls per thread")
+
+    options, args = parser.parse_args()
+
+    # build (or load) the parser tables outside the timed region
+    translate_fresh()
+    translate_reused()
+
+    print("%7s %12s %12s %9s" % ("threads", "fresh", "reused", "change"))
+
+    for nthreads in [int(n) for n in options.threads.split(",")]:
+        fresh = measure(translate_fresh, nthreads, options.calls)
+        reused = measure(translate_reused, nthreads, options.calls)
+
+        print("%7d %8.0f/s %10.0f/s %+8.1f%%" % (
+            nthreads, fresh, reused, (reused / fresh - 1)*100))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+
+"""Time each phase of the CnD translator on synthetic sources (see
+:mod:`synthetic`) and report throughput and peak memory.
+
+Phases measured (parser construction is excluded):
+
+* ``parens``: :func:`cnd.insert_parens_in_brackets`
+* ``cpp``: :func:`cnd.preprocess_source`
+* ``parse``: :meth:`cnd.GnuCndParser.parse`
+* ``generate``: :meth:`cnd.GnuCGenerator.visit`
+* ``transform_cl``: :func:`cnd.transform_cl`, uncached, on the
+  preprocessed OpenCL version of the source
+
+Throughput is given in MB of input to the phase per second. Peak memory is
+the peak size of the Python heap during the phase, as traced by
+:mod:`tracemalloc`, in a separate untimed run.
+
+Use ``--save FILE`` to record the results as a baseline, and ``--compare
+FILE`` to flag phases that got slower than the baseline by more than
+``--threshold`` (default 20%). The exit status is 1 if any regression was
+found.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import sys
+from time import time
+
+import cnd
+from synthetic import make_source
+
+
+PHASES = ["parens", "cpp", "parse", "generate", "transform_cl"]
+
+
+def get_cases(options):
+    """Return a list of ``(name, make_source kwargs)`` tuples."""
+    cases = []
+
+    def add_case(nstatements, narrays, rank, depth):
+        name = "stmts=%d,arrays=%d,rank=%d,depth=%d" % (
+                nstatements, narrays, rank, depth)
+        case = (name, dict(nstatements=nstatements, narrays=narrays,
+            rank=rank, depth=depth))
+        if case not in cases:
+            cases.append(case)
+
+    for nstatements in options.statements:
+        add_case(nstatements, options.arrays[0], options.rank[0],
+                options.depth[0])
+    for narrays in options.arrays:
+        add_case(options.statements[0], narrays, options.rank[0],
+                options.depth[0])
+    for rank in options.rank:
+        add_case(options.statements[0], options.arrays[0], rank,
+                options.depth[0])
+    for depth in options.depth:
+        add_case(options.statements[0], options.arrays[0], options.rank[0],
+                depth)
+
+    return cases
+
+
+def run_phases(source_args, measure):
+    """Run all phases on the source described by *source_args*. *measure*
+    is called as ``measure(phase, input_size, func)`` and must return the
+    result of calling *func*.
+    """
+    filename = "synthetic.c"
+
+    src = make_source(**source_args)
+    src = measure("parens", len(src),
+            lambda: cnd.insert_parens_in_brackets(filename, src))
+
+    src = "\n".join(cnd.PREAMBLE + ["# 1 \"%s\"" % filename]) + "\n" + src
+    src = measure("cpp", len(src),
+            lambda: cnd.preprocess_source(src, None, []))
+
+    parser = cnd.get_parser(cnd.GnuCndParser)
+    ast = measure("parse", len(src),
+            lambda: parser.parse(src, filename=filename))
+
+    generator = cnd.GnuCGenerator()
+    measure("generate", len(src), lambda: generator.visit(ast))
+
+    cl_src = cnd.preprocess_source(
+            make_source(opencl=True, **source_args), None, ["-P"])
+    cnd.get_parser(cnd.OpenCLCndParser)
+    measure("transform_cl", len(cl_src),
+            lambda: cnd.transform_cl(cl_src, use_cache=False))
+
+
+def time_case(source_args, repeat):
+    results = {}
+
+    for i in range(repeat):
+        def measure(phase, input_size, func):
+            start = time()
+            result = func()
+            elapsed = time() - start
+
+            phase_result = results.setdefault(phase, {})
+            if phase_result.get("time", elapsed) >= elapsed:
+                phase_result["time"] = elapsed
+                phase_result["throughput"] = input_size / elapsed / 1e6
+
+            return result
+
+        run_phases(source_args, measure)
+
+    try:
+        import tracemalloc
+    except ImportError:
+        return results
+
+    def measure(phase, input_size, func):
+        tracemalloc.start()
+        try:
+            result = func()
+            results[phase]["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return result
+
+    run_phases(source_args, measure)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison of *results* against *baseline* and return the
+    number of regressions.
+    """
+    nregressions = 0
+
+    print()
+    print("%-44s %-13s %9s %9s %8s" % (
+        "case", "phase", "baseline", "now", "change"))
+
+    for case_name, case_results in sorted(results.items()):
+        for phase in PHASES:
+            try:
+                old_time = baseline[case_name][phase]["time"]
+            except KeyError:
+                continue
+
+            new_time = case_results[phase]["time"]
+            change = new_time / old_time - 1
+
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                nregressions += 1
+
+            print("%-44s %-13s %8.1fms %8.1fms %+7.1f%%%s" % (
+                case_name, phase, old_time*1e3, new_time*1e3, change*100, flag))
+
+    return nregressions
+
+
+def main():
+    from optparse import OptionParser
+
+    def int_list(s):
+        return [int(x) for x in s.split(",")]
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--statements", default="500,2000,8000",
+            help="statement counts to try (comma-separated), the first of "
+            "which is used when varying other parameters")
+    parser.add_option("--arrays", default="20,200",
+            help="array counts to try (comma-separated)")
+    parser.add_option("--rank", default="2,1,4",
+            help="array ranks to try (comma-separated)")
+    parser.add_option("--depth", default="2,8",
+            help="loop nesting depths to try (comma-separated)")
+    parser.add_option("--repeat", type="int", default=3,
+            help="number of timed runs, the fastest of which is reported")
+    parser.add_option("--save", metavar="FILE",
+            help="save results as JSON to FILE")
+    parser.add_option("--compare", metavar="FILE",
+            help="compare results to baseline JSON in FILE")
+    parser.add_option("--threshold", type="float", default=0.2,
+            help="relative slowdown reported as a regression")
+
+    options, args = parser.parse_args()
+    for name in ["statements", "arrays", "rank", "depth"]:
+        setattr(options, name, int_list(getattr(options, name)))
+
+    import json
+
+    # exclude parser construction
+    cnd.get_parser(cnd.GnuCndParser)
+    cnd.get_parser(cnd.OpenCLCndParser)
+
+    print("%-44s %-13s %9s %9s %9s" % (
+        "case", "phase", "time", "MB/s", "peak MB"))
+
+    results = {}
+    for case_name, source_args in get_cases(options):
+        case_results = results[case_name] = time_case(source_args, options.repeat)
+
+        for phase in PHASES:
+            phase_result = case_results[phase]
+            peak_memory = phase_result.get("peak_memory")
+            if peak_memory is None:
+                peak_memory = "-"
+            else:
+                peak_memory = "%9.1f" % (peak_memory / 1024**2)
+
+            print("%-44s %-13s %7.1fms %9.2f %9s" % (
+                case_name, phase, phase_result["time"]*1e3,
+                phase_result["throughput"], peak_memory))
+
+    if options.save:
+        outf = open(options.save, "w")
+        try:
+            json.dump(results, outf, indent=2, sort_keys=True)
+        finally:
+            outf.close()
+
+    if options.compare:
+        inf = open(options.compare)
+        try:
+            baseline = json.load(inf)
+        finally:
+            inf.close()
+
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+
+"""Compare the peak memory use of translating large synthetic sources (see
+:mod:`synthetic`) with and without streaming (see
+:func:`cnd.stream_translation`), as the number of functions in the source
+grows.
+
+Each translation runs in a fresh process, which reports its peak resident
+set size. Sources are preprocessed ahead of time, so that the numbers
+cover reading, parsing and code generation only.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+from subprocess import check_output
+from time import time
+
+import cnd
+from synthetic import make_source
+
+
+TRANSLATE_SCRIPT = """
+import sys
+import cnd
+in_file, out_file, stream = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+outf = open(out_file, "w")
+cnd.translate_file(in_file, outf=outf, stream=stream)
+outf.close()
+print(cnd.get_peak_rss())
+"""
+
+
+def measure(in_file, out_file, stream):
+    """Return a tuple *(wall time, peak RSS)* of translating *in_file*."""
+    start = time()
+    peak_rss = int(check_output([sys.executable, "-c", TRANSLATE_SCRIPT,
+        in_file, out_file, "1" if stream else "0"]))
+    return time() - start, peak_rss
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--functions", default="10,40,160,640",
+            help="function counts to try (comma-separated)")
+    parser.add_option("--statements", type="int", default=100,
+            help="statements per function")
+
+    options, args = parser.parse_args()
+
+    # build parser tables ahead of time
+    cnd.get_parser(cnd.GnuCndParser)
+
+    tmpdir = tempfile.mkdtemp(prefix="cnd-streaming-")
+    try:
+        print("%10s %9s %11s %11s %9s %9s" % (
+            "functions", "input MB", "RSS MB", "stream MB", "time", "stream"))
+
+        for nfunctions in [int(x) for x in options.functions.split(",")]:
+            in_file = os.path.join(tmpdir, "synthetic.c")
+            src = cnd.preprocess_source(
+                    make_source(options.statements, nfunctions=nfunctions),
+                    None, ["-P"])
+            with open(in_file, "w") as outf:
+                outf.write(src)
+
+            results = []
+            outputs = []
+            for stream in [False, True]:
+                out_file = os.path.join(tmpdir, "out-%d.c" % stream)
+                results.append(measure(in_file, out_file, stream))
+                with open(out_file) as inf:
+                    outputs.append(inf.read())
+
+            assert outputs[0] == outputs[1]
+
+            print("%10d %9.1f %11.1f %11.1f %8.2fs %8.2fs" % (
+                nfunctions, len(src) / 1024**2,
+                results[0][1] / 1024**2, results[1][1] / 1024**2,
+                results[0][0], results[1][0]))
+            sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+
+"""Measure the effect of strength reduction (see
+:attr:`cnd.CndGeneratorMixin.strength_reduce`) on reductions of a rank-3
+array along its fastest-varying and its slowest-varying axis, written with
+``CND_FOR_AXIS``, at a number of optimization levels.
+
+Both the GNU C and the OpenCL versions of the kernels are translated.
+Lacking an OpenCL implementation to run them on, the OpenCL versions are
+compiled as C, with ``__kernel`` and ``__global`` defined away and
+``get_global_id`` standing for a loop over the work items in the driver.
+So the timings reflect the index arithmetic in the translated OpenCL code,
+not the performance of any OpenCL device.
+
+The sources are compiled with ``$CC`` (default ``gcc``) and run in a
+temporary directory. Reported are the number of instructions the compiler
+generates for the kernels, the fastest of several runs of each kernel
+(over a number of runs of the executables, alternating between the
+variants) and a checksum of the results (which must not depend on the
+translation).
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+from subprocess import check_call, check_output
+
+import cnd
+
+
+GNU_SOURCE = """
+void reduce_rows(double *a, double *rows, int n0, int n1, int n2)
+{
+  dimension a[n0, n1, n2];
+  dimension rows[n0, n1];
+
+  CND_FOR_AXIS(i, a, 0)
+    CND_FOR_AXIS(j, a, 1)
+    {
+      double s = 0;
+      CND_FOR_AXIS(k, a, 2)
+        s += a[i, j, k];
+      rows[i, j] = s;
+    }
+}
+
+void reduce_columns(double *a, double *columns, int n0, int n1, int n2)
+{
+  dimension a[n0, n1, n2];
+  dimension columns[n1, n2];
+
+  CND_FOR_AXIS(j, a, 1)
+    CND_FOR_AXIS(k, a, 2)
+    {
+      double s = 0;
+      CND_FOR_AXIS(i, a, 0)
+        s += a[i, j, k];
+      columns[j, k] = s;
+    }
+}
+"""
+
+OPENCL_SOURCE = """
+__kernel void reduce_rows(__global double *a, __global double *rows,
+    int n0, int n1, int n2)
+{
+  dimension a[n0, n1, n2];
+  dimension rows[n0, n1];
+  long i = get_global_id(0);
+
+  CND_FOR_AXIS(j, a, 1)
+  {
+    double s = 0;
+    CND_FOR_AXIS(k, a, 2)
+      s += a[i, j, k];
+    rows[i, j] = s;
+  }
+}
+
+__kernel void reduce_columns(__global double *a, __global double *columns,
+    int n0, int n1, int n2)
+{
+  dimension a[n0, n1, n2];
+  dimension columns[n1, n2];
+  long j = get_global_id(0);
+
+  CND_FOR_AXIS(k, a, 2)
+  {
+    double s = 0;
+    CND_FOR_AXIS(i, a, 0)
+      s += a[i, j, k];
+    columns[j, k] = s;
+  }
+}
+"""
+
+# makes translated OpenCL code compile as C
+OPENCL_AS_C_PRELUDE = """
+#define __kernel
+#define __global
+extern long cnd_work_item;
+#define get_global_id(dim) cnd_work_item
+"""
+
+DRIVER_SOURCE = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+void reduce_rows(double *a, double *rows, int n0, int n1, int n2);
+void reduce_columns(double *a, double *columns, int n0, int n1, int n2);
+
+#ifdef WORK_ITEMS
+long cnd_work_item;
+#define RUN(kernel, nitems, args) \\
+  for (cnd_work_item = 0; cnd_work_item < (nitems); ++cnd_work_item) \\
+    kernel args
+#else
+#define RUN(kernel, nitems, args) kernel args
+#endif
+
+static double now(void)
+{
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + 1e-9*t.tv_nsec;
+}
+
+int main(int argc, char **argv)
+{
+  int n0 = atoi(argv[1]), n1 = atoi(argv[2]), n2 = atoi(argv[3]);
+  int repeat = atoi(argv[4]);
+  double *a = malloc(sizeof(double)*n0*n1*n2);
+  double *rows = malloc(sizeof(double)*n0*n1);
+  double *columns = malloc(sizeof(double)*n1*n2);
+  double best_rows = -1, best_columns = -1, checksum = 0;
+
+  for (long i = 0; i < (long) n0*n1*n2; ++i)
+    a[i] = (i % 7) * 0.25;
+
+  for (int r = 0; r < repeat; ++r)
+  {
+    double start = now();
+    RUN(reduce_rows, n0, (a, rows, n0, n1, n2));
+    double elapsed = now() - start;
+    if (best_rows < 0 || elapsed < best_rows)
+      best_rows = elapsed;
+
+    start = now();
+    RUN(reduce_columns, n1, (a, columns, n0, n1, n2));
+    elapsed = now() - start;
+    if (best_columns < 0 || elapsed < best_columns)
+      best_columns = elapsed;
+  }
+
+  for (int i = 0; i < n0*n1; ++i)
+    checksum += (i % 3) * rows[i];
+  for (int i = 0; i < n1*n2; ++i)
+    checksum += (i % 5) * columns[i];
+
+  printf("%g %g %.10g\\n", best_rows, best_columns, checksum);
+  return 0;
+}
+"""
+
+
+def translate(src, parser_class, generator_class, strength_reduce):
+    src = "\n".join(cnd.PREAMBLE + ["# 1 \"kernels.c\""]) + "\n" + src
+    src = cnd.preprocess_source(src, None, [])
+
+    parser = cnd.get_parser(parser_class)
+    ast = parser.parse(src, filename="kernels.c")
+
+    generator = generator_class()
+    generator.strength_reduce = strength_reduce
+    return generator.visit(ast)
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("--shape", default="64,128,128",
+            help="array shape (comma-separated)")
+    parser.add_option("--opt", default="-O0,-O1,-O2,-O3",
+            help="compiler options to try (comma-separated)")
+    parser.add_option("--repeat", type="int", default=20,
+            help="number of runs of each kernel per executable run")
+    parser.add_option("--runs", type="int", default=3,
+            help="number of runs of each executable")
+
+    options, args = parser.parse_args()
+
+    cc = os.environ.get("CC", "gcc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-strength-reduction-")
+
+    try:
+        driver = os.path.join(tmpdir, "main.c")
+        with open(driver, "w") as outf:
+            outf.write(DRIVER_SOURCE)
+
+        print("%-6s %-7s %-8s %6s %11s %9s %11s %9s %14s" % (
+            "lang", "options", "reduced", "insns", "rows", "change",
+            "columns", "change", "checksum"))
+
+        for lang, src, parser_class, generator_class, prelude, defines in [
+                ("gnu", GNU_SOURCE, cnd.GnuCndParser, cnd.GnuCGenerator,
+                    "", []),
+                ("opencl", OPENCL_SOURCE, cnd.OpenCLCndParser,
+                    cnd.OpenCLCGenerator, OPENCL_AS_C_PRELUDE,
+                    ["-DWORK_ITEMS"]),
+                ]:
+            for opt in options.opt.split(","):
+                variants = [False, True]
+                executables = []
+                instruction_counts = []
+
+                for strength_reduce in variants:
+                    name = "%s-%d" % (lang, strength_reduce)
+                    source = os.path.join(tmpdir, "%s.c" % name)
+                    assembly = os.path.join(tmpdir, "%s.s" % name)
+                    executable = os.path.join(tmpdir, name)
+
+                    with open(source, "w") as outf:
+                        outf.write(prelude)
+                        outf.write(translate(src, parser_class,
+                            generator_class, strength_reduce))
+
+                    check_call([cc, "-std=gnu99", "-S", "-o", assembly, source]
+                            + opt.split())
+                    with open(assembly) as inf:
+                        instruction_counts.append(
+                                len(re.findall(r"^\t[a-z]", inf.read(), re.M)))
+
+                    check_call([cc, "-std=gnu99", "-o", executable, source,
+                        driver] + defines + opt.split())
+                    executables.append(executable)
+
+                best = [[None, None] for strength_reduce in variants]
+                checksums = [None for strength_reduce in variants]
+                for run in range(options.runs):
+                    for i, executable in enumerate(executables):
+                        t_rows, t_columns, checksums[i] = check_output(
+                                [executable] + options.shape.split(",")
+                                + [str(options.repeat)]).split()
+
+                        for j, elapsed in enumerate([t_rows, t_columns]):
+                            elapsed = float(elapsed)
+                            if best[i][j] is None or elapsed < best[i][j]:
+                                best[i][j] = elapsed
+
+                baseline = best[0]
+                for strength_reduce, ninstructions, (t_rows, t_columns), \
+                        checksum in zip(
+                                variants, instruction_counts, best, checksums):
+                    print("%-6s %-7s %-8s %6d %9.2fms %+8.1f%% %9.2fms "
+                            "%+8.1f%% %14s" % (
+                                lang, opt, strength_reduce and "yes" or "no",
+                                ninstructions,
+                                t_rows*1e3, (t_rows / baseline[0] - 1)*100,
+                                t_columns*1e3,
+                                (t_columns / baseline[1] - 1)*100,
+                                checksum.decode()))
+                sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Generator for synthetic CnD sources, for use in benchmarks."""
+
+from __future__ import division
+from __future__ import print_function
+
+import sys
+
+
+LAYOUTS = ["", "\"fortran\" ", "\"col-major\" "]
+
+
+def make_source(nstatements, narrays=20, rank=2, depth=2, opencl=False,
+        nfunctions=1, block_size=50):
+    """Return the text of a CnD source file containing one function with
+    *narrays* dimensioned arrays of rank *rank*, and *nstatements*
+    statements accessing them, nested *depth* loops deep, in blocks of at
+    most *block_size* statements (or all in one block, if *block_size* is
+    *None*).
+
+    If *opencl* is *True*, the function is an OpenCL kernel. If *nfunctions*
+    is greater than one, the file contains that many copies of the
+    function, with distinct names.
+    """
+    if nfunctions > 1:
+        return "".join(
+                make_source(nstatements, narrays, rank, depth, opencl,
+                    block_size=block_size).replace(
+                    " f(", " f%d(" % ifunction, 1)
+                for ifunction in range(nfunctions))
+
+    axis_names = ["n%d" % axis for axis in range(rank)]
+    index_names = ["i%d" % level for level in range(max(depth, rank))]
+
+    if opencl:
+        header = "__kernel void f(%s, %s)" % (
+                ", ".join("int %s" % name for name in axis_names),
+                ", ".join("__global float *a%d" % iarray
+                    for iarray in range(narrays)))
+    else:
+        header = "void f(%s, %s)" % (
+                ", ".join("int %s" % name for name in axis_names),
+                ", ".join("float *a%d" % iarray for iarray in range(narrays)))
+
+    lines = [
+            "/* synthetic benchmark source: %d statements, %d arrays, "
+            "rank %d, depth %d */" % (nstatements, narrays, rank, depth),
+            header,
+            "{",
+            ]
+
+    for iarray in range(narrays):
+        dims = []
+        for axis, name in enumerate(axis_names):
+            if (iarray + axis) % 3 == 0:
+                dims.append(name)
+            elif (iarray + axis) % 3 == 1:
+                dims.append("1:%s" % name)
+            else:
+                dims.append("0:%s-1" % name)
+
+        lines.append("  dimension %sa%d[%s];" % (
+            LAYOUTS[iarray % len(LAYOUTS)], iarray, ", ".join(dims)))
+
+    # spread the statements evenly over the innermost loops
+    if block_size is None:
+        nloops = 1
+    else:
+        nloops = 1 + nstatements // block_size
+    per_loop = -(-nstatements // nloops)
+
+    istatement = 0
+    for iloop in range(nloops):
+        indent = "  "
+        for level in range(depth):
+            lines.append("%sfor (int %s = 2; %s < %s - 2; ++%s)" % (
+                indent, index_names[level], index_names[level],
+                axis_names[level % rank], index_names[level]))
+            lines.append("%s{" % indent)
+            indent += "  "
+
+        for i in range(min(per_loop, nstatements - istatement)):
+            iarray = istatement % narrays
+            other = (istatement * 7 + 3) % narrays
+
+            indices = []
+            other_indices = []
+            for axis in range(rank):
+                index = index_names[(axis + istatement) % depth] if depth else "1"
+                indices.append(index)
+                other_indices.append(
+                        "%s%+d" % (index, (istatement + axis) % 3 - 1))
+
+            if istatement % 10 == 0:
+                lines.append("%s// update a%d [entry %d]" % (
+                    indent, iarray, istatement))
+
+            lines.append("%sa%d[%s] = 0.5f*a%d[%s] + nitemsof(a%d);" % (
+                indent, iarray, ", ".join(indices),
+                other, ", ".join(other_indices), iarray))
+
+            istatement += 1
+
+        for level in range(depth):
+            indent = indent[:-2]
+            lines.append("%s}" % indent)
+
+    lines.append("}")
+
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    sys.stdout.write(make_source(*args))
@@ -12,8 +12,10 @@ if sys.version_info < (2, 5):
 
 try:
     import pycparser.ply as ply  # noqa
+    import pycparser.ply.yacc  # noqa
 except ImportError:
     import ply  # noqa
+    import ply.yacc  # noqa
 
 from pycparserext.ext_c_lexer import (
         add_lexer_keywords,
@@ -24,6 +26,7 @@ from pycparser import c_ast
 from pycparserext.ext_c_parser import (
         GnuCParser as GnuCParserBase,
         OpenCLCParser as OpenCLCParserBase,
+        PreprocessorLine,
         )
 
 from pycparserext.ext_c_generator import (
@@ -32,6 +35,8 @@ from pycparserext.ext_c_generator import (
         )
 
 import sys
+import threading
+from collections import OrderedDict
 
 
 import cnd.version
@@ -47,8 +52,23 @@ CND_HELPERS = """
 #define CND_DECL_ALLOC_STACK(type, name) \
   type name[nitemsof(name)];
 
+#define CND_ALLOC_HEAP_ALIGNED(type, name, alignment) \
+  name = posix_memalign((void **) &name, alignment, \
+      nitemsof(name)*sizeof(type)) ? 0 : name;
+
+#define CND_DECL_ALLOC_HEAP_ALIGNED(type, name, alignment) \
+  type *name; \
+  CND_ALLOC_HEAP_ALIGNED(type, name, alignment)
+
+#define CND_DECL_ALLOC_STACK_ALIGNED(type, name, alignment) \
+  __attribute__((aligned(alignment))) type name[nitemsof(name)];
+
+#ifndef CND_INDEX_TYPE
+#define CND_INDEX_TYPE long
+#endif
+
 #define CND_FOR_AXIS(it_var, name, ax_index) \
-  for (long it_var = lboundof(name, ax_index); \
+  for (CND_INDEX_TYPE it_var = lboundof(name, ax_index); \
             it_var < puboundof(name, ax_index); ++it_var)
 
 #define CND_VERSION_MAJOR %(major_ver)d
@@ -72,6 +92,10 @@ class OpenCLCndLexer(OpenCLCLexerBase):
 
 cnd_keywords = ("dimension",)
 
+CND_QUERY_FUNCTIONS = (
+        "rankof", "nitemsof",
+        "lboundof", "uboundof", "puboundof", "ldimof", "strideof")
+
 add_lexer_keywords(GnuCndLexer, cnd_keywords)
 add_lexer_keywords(OpenCLCndLexer, cnd_keywords)
 
@@ -80,63 +104,128 @@ add_lexer_keywords(OpenCLCndLexer, cnd_keywords)
 
 # {{{ parenthesis insertion
 
-def insert_parens_in_brackets(filename, s):
-    lines = s.split("\n")
+_PAREN_INSERTION_RE = None
+_STRING_LITERAL_RE = None
+_CHAR_CONSTANT_RE = None
+_LOGICAL_LINE_RE = None
 
-    new_lines = []
-    li = 0
-    in_string = None
 
-    while li < len(lines):
-        line = lines[li]
-        li += 1
+def _compile_paren_insertion_regexes():
+    import re
 
-        if line.lstrip().startswith("#"):
-            while True:
-                new_lines.append(line)
+    global _PAREN_INSERTION_RE
+    global _STRING_LITERAL_RE
+    global _CHAR_CONSTANT_RE
+    global _LOGICAL_LINE_RE
 
-                if li >= len(lines) or not line.endswith("\\"):
-                    break
+    # starts of constructs within which brackets are left alone
+    _PAREN_INSERTION_RE = re.compile(r"""["'/#]""")
 
-                line = lines[li]
-                li += 1
+    # An unterminated literal ends at the end of the line.
+    _STRING_LITERAL_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"?', re.DOTALL)
+    _CHAR_CONSTANT_RE = re.compile(r"'(?:[^'\\\n]|\\.)*'?", re.DOTALL)
 
-            continue
+    # up to (excluding) the next newline not preceded by a backslash
+    _LOGICAL_LINE_RE = re.compile(r"(?:[^\n\\]|\\.)*", re.DOTALL)
 
-        new_line = []
-
-        i = 0
-
-        while i < len(line):
-            c = line[i]
-
-            if c == "[" and not in_string:
-                new_line.append("[(")
-                i += 1
-            elif c == "]" and not in_string:
-                new_line.append(")]")
-                i += 1
-            elif c in "'\"" and not in_string:
-                new_line.append(c)
-                i += 1
-                in_string = c
-            elif c in "'\"" and in_string == c:
-                new_line.append(c)
-                i += 1
-                in_string = None
-            elif c == "\\" and in_string:
-                new_line.append(c)
-                i += 1
-                if i < len(line):
-                    new_line.append(line[i])
-                    i += 1
+
+def insert_parens_in_brackets(filename, s):
+    """Return *s* with each ``[`` replaced by ``[(`` and each ``]`` by
+    ``)]``, except within string and character literals, comments and
+    preprocessor lines.
+    """
+    if _PAREN_INSERTION_RE is None:
+        _compile_paren_insertion_regexes()
+
+    search = _PAREN_INSERTION_RE.search
+
+    result = []
+    pos = 0
+
+    while True:
+        match = search(s, pos)
+        if match is None:
+            start = end = len(s)
+        else:
+            start = match.start()
+            token = match.group()
+
+            if token == '"':
+                end = _STRING_LITERAL_RE.match(s, start).end()
+            elif token == "'":
+                end = _CHAR_CONSTANT_RE.match(s, start).end()
+            elif token == "/":
+                if s.startswith("/*", start):
+                    end = s.find("*/", start + 2)
+                    if end < 0:
+                        end = len(s)
+                    else:
+                        end += 2
+                elif s.startswith("//", start):
+                    end = _LOGICAL_LINE_RE.match(s, start).end()
+                else:
+                    # division
+                    end = start + 1
             else:
-                new_line.append(c)
-                i += 1
+                line_start = s.rfind("\n", 0, start) + 1
+                if s[line_start:start].strip(" \t"):
+                    # not a preprocessor line
+                    end = start + 1
+                else:
+                    # may be continued by a trailing backslash
+                    end = _LOGICAL_LINE_RE.match(s, start).end()
+
+        # rewrite code up to start, copy the rest verbatim
+        result.append(s[pos:start].replace("[", "[(").replace("]", ")]"))
+        result.append(s[start:end])
+
+        if match is None:
+            break
+
+        pos = end
+
+    return "".join(result)
+
+# }}}
 
-        new_lines.append("".join(new_line))
 
-    return "\n".join(new_lines)
+# {{{ detection of CnD constructs
+
+_CND_IDENTIFIERS = cnd_keywords + CND_QUERY_FUNCTIONS
+
+_CND_CONSTRUCT_RE = None
+
+
+def needs_translation(src):
+    """Return *True* if the preprocessed source *src* contains CnD
+    constructs, i.e. ``dimension`` declarations or calls to dimension query
+    functions. If not, *src* is plain C and need not be translated.
+
+    Occurrences within string and character literals, comments and
+    preprocessor lines are not counted.
+    """
+    # cheap check first: most sources contain none of the names at all
+    if not any(ident in src for ident in _CND_IDENTIFIERS):
+        return False
+
+    global _CND_CONSTRUCT_RE
+    if _CND_CONSTRUCT_RE is None:
+        import re
+        _CND_CONSTRUCT_RE = re.compile(r"""
+            "(?:[^"\\\n]|\\.)*"               # string literal
+            | '(?:[^'\\\n]|\\.)*'             # character constant
+            | /\*.*?\*/                       # comment
+            | //[^\n]*                        # comment
+            | ^[ \t]*\#(?:\\\n|[^\n])*        # preprocessor line
+            | (?P<identifier>\b(?:%s)\b)
+            """ % "|".join(_CND_IDENTIFIERS),
+            re.MULTILINE | re.DOTALL | re.VERBOSE)
+
+    for match in _CND_CONSTRUCT_RE.finditer(src):
+        if match.group("identifier") is not None:
+            return True
+
+    return False
 
 # }}}
 
@@ -144,6 +233,8 @@ def insert_parens_in_brackets(filename, s):
 # {{{ AST helper objects
 
 class SingleDim(object):
+    __slots__ = ["start", "end", "stride", "leading_dim"]
+
     def __init__(self, layout, start, end, stride, leading_dim):
         self.end = end
         self.stride = stride
@@ -183,18 +274,546 @@ class SingleDim(object):
 
 
 class DimensionDecl(c_ast.Node):
-    def __init__(self, name, layout, dims, coord):
+    """
+    .. attribute:: alignment
+
+        *None*, or an expression giving the alignment (in bytes) of the
+        array's first entry that the generated code may assume.
+
+    .. attribute:: restrict
+
+        Whether accesses to the array may be assumed not to alias accesses
+        through any other pointer, as with a ``restrict``-qualified pointer.
+
+    .. attribute:: tile_sizes
+
+        For the ``"tiled"`` layout, a list of the (integer) tile lengths
+        along each axis, otherwise *None*.
+    """
+
+    def __init__(self, name, layout, dims, coord, alignment=None,
+            restrict=False, tile_sizes=None):
         self.name = name
 
         self.layout = layout
         self.dims = dims
+        self.tile_sizes = tile_sizes
 
         self.coord = coord
 
+        self.alignment = alignment
+        self.restrict = restrict
+
     def children(self):
         return ()
 
-    attr_names = ("name", "layout", "dims")
+    attr_names = ("name", "layout", "dims", "restrict", "tile_sizes")
+
+
+_TILED_LAYOUT_RE = None
+
+
+def _parse_tile_sizes(layout):
+    """Return the list of tile sizes given by a layout of the form
+    ``tiled(16, 16)``, or *None* if *layout* is not of that form.
+    """
+    global _TILED_LAYOUT_RE
+    if _TILED_LAYOUT_RE is None:
+        import re
+        _TILED_LAYOUT_RE = re.compile(
+                r"^\s*tiled\s*\(\s*([0-9]+(?:\s*,\s*[0-9]+)*)\s*\)\s*$")
+
+    match = _TILED_LAYOUT_RE.match(layout)
+    if match is None:
+        return None
+
+    tile_sizes = [int(size) for size in match.group(1).split(",")]
+    if 0 in tile_sizes:
+        return None
+
+    return tile_sizes
+
+# }}}
+
+
+# {{{ caching
+
+def get_cache_dir(kind):
+    """Return the directory in which cached data of type *kind* is kept,
+    creating it if necessary. Returns *None* if on-disk caching is disabled
+    or the directory cannot be created.
+
+    The cache root defaults to the user's cache directory and may be
+    overridden by setting the environment variable :envvar:`CND_CACHE_DIR`.
+    Setting that variable to an empty string disables on-disk caching.
+    """
+    import os
+    from os.path import join, expanduser, isdir
+
+    cache_root = os.environ.get("CND_CACHE_DIR")
+    if cache_root is None:
+        if sys.platform.startswith("darwin"):
+            cache_root = expanduser("~/Library/Caches")
+        elif sys.platform.startswith("win"):
+            cache_root = os.environ.get("LOCALAPPDATA", expanduser("~"))
+        else:
+            cache_root = os.environ.get("XDG_CACHE_HOME", expanduser("~/.cache"))
+
+        cache_root = join(cache_root, "cnd")
+
+    if not cache_root:
+        return None
+
+    cache_dir = join(cache_root, kind)
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        if not isdir(cache_dir):
+            return None
+
+    return cache_dir
+
+
+def get_grammar_hash(parser, start):
+    """Return a hash identifying the grammar of *parser* (including all
+    rules, tokens and precedences), the version of CnD and the PLY table
+    format.
+    """
+    from hashlib import sha256
+    checksum = sha256()
+
+    def update(s):
+        checksum.update(str(s).encode("utf-8"))
+
+    update(cnd.version.VERSION_TEXT)
+    update(ply.yacc.__tabversion__)
+    update(start)
+    update(parser.tokens)
+    update(getattr(parser, "precedence", ()))
+
+    for name in sorted(dir(parser)):
+        if name.startswith("p_"):
+            update(name)
+            update(getattr(parser, name).__doc__)
+
+    return checksum.hexdigest()
+
+
+def build_yacc_parser(parser, start, debug=False):
+    """Build the LALR parser for the grammar described by the ``p_*`` methods
+    of *parser*. Generated tables are kept in the on-disk cache (see
+    :func:`get_cache_dir`), so that they only need to be built once per
+    grammar.
+    """
+    import os
+    from os.path import join, exists
+
+    cache_dir = None
+    if not debug:
+        cache_dir = get_cache_dir("tables")
+
+    if cache_dir is None:
+        return ply.yacc.yacc(module=parser, start=start, debug=debug,
+                write_tables=False)
+
+    table_file = join(cache_dir, "%s-%s.pickle" % (
+        type(parser).__name__, get_grammar_hash(parser, start)))
+
+    if exists(table_file):
+        return ply.yacc.yacc(module=parser, start=start, debug=False,
+                picklefile=table_file)
+
+    # Tables are written to a private file and moved into place once
+    # complete, so that concurrent readers never see a partial file.
+    from tempfile import mkstemp
+    try:
+        handle, temp_file = mkstemp(dir=cache_dir, suffix=".tmp")
+    except OSError:
+        return ply.yacc.yacc(module=parser, start=start, debug=False,
+                write_tables=False)
+
+    os.close(handle)
+    try:
+        result = ply.yacc.yacc(module=parser, start=start, debug=False,
+                picklefile=temp_file)
+        try:
+            os.rename(temp_file, table_file)
+        except OSError:
+            # another process won the race (on Windows, rename fails if the
+            # target exists)
+            pass
+    finally:
+        if exists(temp_file):
+            os.unlink(temp_file)
+
+    return result
+
+
+_TRANSLATOR_FINGERPRINT = None
+
+
+def get_translator_fingerprint():
+    """Return a hash of the CnD version and source code, for use in keys of
+    caches of translation results. Unlike the version alone, this also
+    changes when the translator is modified without a version change.
+
+    As the output also depends on how pycparser and pycparserext parse and
+    generate code, the pycparser version and the source code of the
+    pycparserext modules in use (which do not carry a version) are
+    included as well.
+    """
+    global _TRANSLATOR_FINGERPRINT
+
+    if _TRANSLATOR_FINGERPRINT is None:
+        from hashlib import sha256
+        import pycparser
+        import pycparserext.ext_c_generator
+        import pycparserext.ext_c_lexer
+        import pycparserext.ext_c_parser
+
+        checksum = sha256(cnd.version.VERSION_TEXT.encode("utf-8"))
+        checksum.update(("pycparser %s" % pycparser.__version__)
+                .encode("utf-8"))
+
+        for module in [
+                sys.modules[__name__],
+                pycparserext.ext_c_lexer,
+                pycparserext.ext_c_parser,
+                pycparserext.ext_c_generator,
+                ]:
+            source_file = module.__file__
+            if source_file.endswith((".pyc", ".pyo")):
+                source_file = source_file[:-1]
+
+            try:
+                inf = open(source_file, "rb")
+                try:
+                    checksum.update(inf.read())
+                finally:
+                    inf.close()
+            except IOError:
+                pass
+
+        _TRANSLATOR_FINGERPRINT = checksum.hexdigest()
+
+    return _TRANSLATOR_FINGERPRINT
+
+
+def write_file_atomically(path, data):
+    """Write the byte string *data* to *path* such that concurrent readers
+    see either the complete file or no file at all.
+    """
+    import os
+    from os.path import dirname, exists
+    from tempfile import mkstemp
+
+    handle, temp_path = mkstemp(dir=dirname(path) or ".", suffix=".tmp")
+    try:
+        try:
+            os.write(handle, data)
+        finally:
+            os.close(handle)
+
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # on Windows, rename fails if the target exists
+            if not exists(path):
+                raise
+    finally:
+        if exists(temp_path):
+            os.unlink(temp_path)
+
+
+class TranslationCache(object):
+    """A content-addressed cache of translation results.
+
+    Up to *max_memory_entries* recently used results are kept in memory. If
+    *disk_dir* is given, results are also stored in that directory, and
+    the least recently used files are evicted once their total size exceeds
+    *max_disk_bytes*. The disk tier may be shared among concurrent
+    processes. Unless *record_disk_stats* is *False*, it also keeps
+    statistics on its use, see :meth:`get_disk_stats`.
+
+    All methods may be called from multiple threads.
+
+    .. attribute:: hits
+    .. attribute:: disk_hits
+    .. attribute:: misses
+    .. attribute:: evictions
+    .. attribute:: disk_evictions
+    """
+
+    def __init__(self, max_memory_entries=256, disk_dir=None,
+            max_disk_bytes=256*1024**2, record_disk_stats=True):
+        if disk_dir is not None:
+            import os
+            from os.path import isdir
+            if not isdir(disk_dir):
+                os.makedirs(disk_dir)
+
+        self.max_memory_entries = max_memory_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.records_disk_stats = record_disk_stats
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        # estimate of the size of the disk tier, computed on first write
+        self.disk_bytes = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """Return a hash key for *parts*, each of which is converted to a
+        string.
+        """
+        from hashlib import sha256
+        checksum = sha256()
+        for part in parts:
+            part = str(part).encode("utf-8")
+            checksum.update(str(len(part)).encode("utf-8"))
+            checksum.update(b":")
+            checksum.update(part)
+
+        return checksum.hexdigest()
+
+    def get_stats(self):
+        """Return a :class:`dict` of hit, miss and eviction counts."""
+        with self.lock:
+            return dict(
+                    hits=self.hits,
+                    disk_hits=self.disk_hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    disk_evictions=self.disk_evictions,
+                    memory_entries=len(self.memory))
+
+    def clear(self):
+        """Drop all in-memory entries and reset the counters. The disk tier
+        is left untouched.
+        """
+        with self.lock:
+            self.memory.clear()
+            self.hits = self.disk_hits = self.misses = 0
+            self.evictions = self.disk_evictions = 0
+
+    def _disk_path(self, key):
+        from os.path import join
+        return join(self.disk_dir, key + ".c")
+
+    # {{{ persistent statistics of the disk tier
+
+    # Counts (such as disk hits, misses and disk evictions) are appended to a
+    # file in the disk tier as lines of the form "name=count", so that
+    # statistics can be aggregated across processes. Small appends to a file
+    # opened with O_APPEND do not interleave.
+
+    def _stats_path(self):
+        from os.path import join
+        return join(self.disk_dir, "stats")
+
+    def record_disk_stats(self, **counts):
+        """Add *counts* to the persistent statistics of the disk tier, see
+        :meth:`get_disk_stats`.
+        """
+        if not self.records_disk_stats:
+            return
+
+        import os
+        line = " ".join("%s=%d" % (name, count)
+                for name, count in sorted(counts.items())) + "\n"
+        try:
+            fd = os.open(self._stats_path(),
+                    os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode("ascii"))
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def get_disk_stats(self):
+        """Return a :class:`dict` of counts recorded by all processes that
+        have used the disk tier. These include *disk_hits*, *misses* and
+        *disk_evictions*, along with the current number of *files* and their
+        size in *bytes*.
+        """
+        totals = dict(disk_hits=0, misses=0, disk_evictions=0)
+        try:
+            inf = open(self._stats_path(), "rb")
+            try:
+                stats_data = inf.read().decode("ascii")
+            finally:
+                inf.close()
+        except IOError:
+            stats_data = ""
+
+        for line in stats_data.split("\n"):
+            try:
+                counts = [field.split("=") for field in line.split()]
+                counts = [(name, int(count)) for name, count in counts]
+            except ValueError:
+                # partial line
+                continue
+
+            for name, count in counts:
+                totals[name] = totals.get(name, 0) + count
+
+        if len(stats_data) > 1024**2:
+            # Compact. Counts recorded concurrently may be lost, which is
+            # tolerable for statistics.
+            write_file_atomically(self._stats_path(),
+                    (" ".join("%s=%d" % (name, count)
+                        for name, count in sorted(totals.items()))
+                        + "\n").encode("ascii"))
+
+        result = totals.copy()
+        result["files"] = 0
+        result["bytes"] = 0
+        for _, size, _ in self._get_disk_entries():
+            result["files"] += 1
+            result["bytes"] += size
+
+        return result
+
+    def zero_disk_stats(self):
+        """Reset the statistics returned by :meth:`get_disk_stats`."""
+        import os
+        try:
+            os.unlink(self._stats_path())
+        except OSError:
+            pass
+
+    # }}}
+
+    def get(self, key):
+        """Return the result stored for *key*, or *None*."""
+        with self.lock:
+            try:
+                result = self.memory.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.memory[key] = result
+                self.hits += 1
+                return result
+
+        result = None
+        if self.disk_dir is not None:
+            import os
+            path = self._disk_path(key)
+            try:
+                inf = open(path, "rb")
+                try:
+                    result = inf.read().decode("utf-8")
+                finally:
+                    inf.close()
+
+                # record use for LRU eviction
+                os.utime(path, None)
+            except (IOError, OSError):
+                pass
+
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._store_in_memory(key, result)
+
+        if self.disk_dir is not None:
+            if result is None:
+                self.record_disk_stats(misses=1)
+            else:
+                self.record_disk_stats(disk_hits=1)
+
+        return result
+
+    def _store_in_memory(self, key, value):
+        self.memory[key] = value
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key, value):
+        """Store the string *value* under *key*."""
+        with self.lock:
+            self._store_in_memory(key, value)
+
+        if self.disk_dir is not None:
+            data = value.encode("utf-8")
+            try:
+                write_file_atomically(self._disk_path(key), data)
+            except (IOError, OSError):
+                return
+
+            if self.disk_bytes is None:
+                self.evict_from_disk()
+            else:
+                self.disk_bytes += len(data)
+                if self.disk_bytes > self.max_disk_bytes:
+                    self.evict_from_disk()
+
+    def _get_disk_entries(self):
+        """Return a list of tuples *(mtime, size, path)* for the entries of
+        the disk tier.
+        """
+        import os
+        from os.path import join
+
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".c"):
+                continue
+
+            path = join(self.disk_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((st.st_mtime, st.st_size, path))
+
+        return entries
+
+    def evict_from_disk(self):
+        """Remove the least recently used files from the disk tier until
+        its size is below *max_disk_bytes*.
+        """
+        import os
+
+        entries = self._get_disk_entries()
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+
+        evictions = 0
+        for _, size, path in entries:
+            if total_bytes <= self.max_disk_bytes:
+                break
+
+            try:
+                os.unlink(path)
+            except OSError:
+                # removed by someone else
+                pass
+            else:
+                evictions += 1
+
+            total_bytes -= size
+
+        with self.lock:
+            self.disk_bytes = total_bytes
+            self.disk_evictions += evictions
+
+        if evictions:
+            self.record_disk_stats(disk_evictions=evictions)
 
 # }}}
 
@@ -202,6 +821,73 @@ class DimensionDecl(c_ast.Node):
 # {{{ parsers
 
 class CndParserBase(object):
+    # mirrors pycparserext.ext_c_parser.CParserBase.__init__, except that
+    # parser tables are cached
+    def __init__(self, yacc_debug=False):
+        self.clex = self.lexer_class(
+                error_func=self._lex_error_func,
+                on_lbrace_func=self._lex_on_lbrace_func,
+                on_rbrace_func=self._lex_on_rbrace_func,
+                type_lookup_func=self._lex_type_lookup_func)
+
+        self.clex.build()
+        self.tokens = self.clex.tokens
+
+        for rule in self.OPT_RULES:
+            self._create_opt_rule(rule)
+
+        if hasattr(self, "p_translation_unit_or_empty"):
+            self.ext_start_symbol = "translation_unit_or_empty"
+        else:
+            self.ext_start_symbol = "translation_unit"
+
+        self.cparser = build_yacc_parser(
+                self, self.ext_start_symbol, debug=yacc_debug)
+
+    # {{{ streaming
+
+    # If not *None*, called with the list of nodes for each top-level
+    # declaration as soon as it has been parsed, which is then not added to
+    # the resulting FileAST.
+    external_declaration_handler = None
+
+    def parse_streaming(self, text, filename, handler,
+            initial_type_symbols=set()):
+        """Parse *text*, calling *handler* with a list of
+        :class:`pycparser.c_ast.Node` instances for each top-level
+        declaration (see :attr:`external_declaration_handler`), instead of
+        returning a :class:`pycparser.c_ast.FileAST`.
+        """
+        self.external_declaration_handler = handler
+        try:
+            self.parse(text, filename=filename,
+                    initial_type_symbols=initial_type_symbols)
+        finally:
+            del self.external_declaration_handler
+
+    # overrides pycparser, must have same docstring
+    def p_translation_unit_1(self, p):
+        """ translation_unit    : external_declaration
+        """
+        if self.external_declaration_handler is not None:
+            if p[1] is not None:
+                self.external_declaration_handler(p[1])
+            p[0] = []
+        else:
+            p[0] = p[1]
+
+    # overrides pycparser, must have same docstring
+    def p_translation_unit_2(self, p):
+        """ translation_unit    : translation_unit external_declaration
+        """
+        if p[2] is not None:
+            if self.external_declaration_handler is not None:
+                self.external_declaration_handler(p[2])
+            else:
+                p[1].extend(p[2])
+        p[0] = p[1]
+
+    # }}}
 
     # {{{ hack around [()]
 
@@ -242,22 +928,76 @@ class CndParserBase(object):
         p[0] = p[1]
 
     def p_dimension_decl(self, p):
-        """ dimension_decl : DIMENSION dim_layout_opt ID LBRACKET lparen_opt dim_spec_mult rparen_opt RBRACKET
+        """ dimension_decl : DIMENSION dim_layout_opt ID dim_shape dim_attr_list_opt
         """
         coord = self._coord(p.lineno(1))
         layout = p[2]
         if layout is not None:
             layout = layout[1:-1]
 
+        rank = len(p[4])
+        tile_sizes = None
+
         if layout is None:
             layout = "c"
         elif layout in ["c", "col-major", "row-major", "fortran"]:
             pass
+        elif layout in ["morton", "z-order"]:
+            layout = "morton"
+            if rank not in [2, 3]:
+                raise RuntimeError("array layout 'morton' requires "
+                        "rank 2 or 3, not %d" % rank)
         else:
-            raise RuntimeError("invalid  array layout '%s'" % layout)
+            tile_sizes = _parse_tile_sizes(layout)
+            if tile_sizes is None:
+                raise RuntimeError("invalid  array layout '%s'" % layout)
+            if len(tile_sizes) != rank:
+                raise RuntimeError("array layout '%s' has %d tile sizes, "
+                        "needs %d" % (layout, len(tile_sizes), rank))
+
+            layout = "tiled"
+
+        attrs = dict(p[5] or [])
 
         p[0] = DimensionDecl(p[3], layout, [
-            SingleDim(layout, *args) for args in p[6]], coord)
+            SingleDim(layout, *args) for args in p[4]], coord,
+            alignment=attrs.get("aligned"),
+            restrict="restrict" in attrs,
+            tile_sizes=tile_sizes)
+
+    def p_dim_shape(self, p):
+        """ dim_shape : LBRACKET lparen_opt dim_spec_mult rparen_opt RBRACKET
+        """
+        p[0] = p[3]
+
+    def p_dim_attr_list_opt(self, p):
+        """ dim_attr_list_opt : dim_attr_list
+                              | empty
+        """
+        p[0] = p[1]
+
+    def p_dim_attr_list(self, p):
+        """ dim_attr_list : dim_attr
+                          | dim_attr_list dim_attr
+        """
+        if len(p) == 2:
+            p[0] = [p[1]]
+        else:
+            p[1].append(p[2])
+            p[0] = p[1]
+
+    def p_dim_attr_restrict(self, p):
+        """ dim_attr : RESTRICT
+        """
+        p[0] = ("restrict", True)
+
+    def p_dim_attr_with_arg(self, p):
+        """ dim_attr : ID LPAREN constant_expression RPAREN
+        """
+        if p[1] != "aligned":
+            raise RuntimeError("invalid array attribute '%s'" % p[1])
+
+        p[0] = (p[1], p[3])
 
     def p_lparen_opt(self, p):
         """ lparen_opt : LPAREN
@@ -322,6 +1062,29 @@ class GnuCndParser(CndParserBase, GnuCParserBase):
 class OpenCLCndParser(CndParserBase, OpenCLCParserBase):
     lexer_class = OpenCLCndLexer
 
+
+_THREAD_LOCAL_PARSERS = threading.local()
+
+
+def get_parser(parser_class):
+    """Return an instance of *parser_class* that is private to the calling
+    thread, constructing it on first use.
+
+    Parsers are reusable, as :meth:`parse` resets all lexer and scope state.
+    PLY parsers keep their parse stacks in instance attributes, so they must
+    not be used by multiple threads at once.
+    """
+    try:
+        parsers = _THREAD_LOCAL_PARSERS.parsers
+    except AttributeError:
+        parsers = _THREAD_LOCAL_PARSERS.parsers = {}
+
+    try:
+        return parsers[parser_class]
+    except KeyError:
+        parser = parsers[parser_class] = parser_class()
+        return parser
+
 # }}}
 
 
@@ -329,389 +1092,3487 @@ class SyntaxError(RuntimeError):
     pass
 
 
-# {{{ generators
+# {{{ index expression simplification
 
-class CndGeneratorMixin(object):
-    def __init__(self):
-        self.dim_decl_stack = [{}]
-        self.generate_line_directives = True
+class _TooManyTerms(Exception):
+    pass
 
-    def visit_DimensionDecl(self, n):
-        decl_stack = self.dim_decl_stack[-1]
-        if n.name in decl_stack:
-            raise SyntaxError("may not redimension array '%s' at %s"
-                    % (n.name, n.coord))
-        decl_stack[n.name] = n
-        return ""
 
-    # overrides base to treat dim_decl_stack
-    def visit_Compound(self, n):
-        s = self._make_indent() + '{\n'
-        self.indent_level += 2
+def _get_int_literal_value(node):
+    """Return the value of *node* if it is an integer constant without a
+    suffix, else *None*.
+    """
+    if not (isinstance(node, c_ast.Constant) and node.type == "int"):
+        return None
+
+    value = node.value
+    if isinstance(value, int):
+        return value
+    if value.isdigit() and (value == "0" or not value.startswith("0")):
+        return int(value)
+    if value[:2] in ["0x", "0X"]:
+        try:
+            return int(value[2:], 16)
+        except ValueError:
+            return None
 
-        dim_decls = self.dim_decl_stack[-1].copy()
-        self.dim_decl_stack.append(dim_decls)
+    return None
 
-        if n.block_items:  # may be None
-            for stmt in n.block_items:
-                if self.generate_line_directives:
-                    s += "# %d \"%s\"\n" % (
-                        stmt.coord.line, stmt.coord.file)
 
-                s += ''.join(self._generate_stmt(stmt))
+def _may_have_side_effects(node):
+    if isinstance(node, c_ast.FuncCall):
+        if not (isinstance(node.name, c_ast.ID)
+                and (node.name.name in CND_QUERY_FUNCTIONS
+                    or node.name.name in _MORTON_SPREAD_FUNCTIONS.values())):
+            return True
+    elif isinstance(node, c_ast.Assignment):
+        return True
+    elif isinstance(node, c_ast.UnaryOp) and node.op in [
+            "++", "--", "p++", "p--"]:
+        return True
 
-        self.dim_decl_stack.pop()
+    for _, child in node.children():
+        if _may_have_side_effects(child):
+            return True
 
-        self.indent_level -= 2
-        s += self._make_indent() + '}\n'
-        return s
+    return False
 
-    def generate_array_ref(self, dim_decl, name, indices, coord):
-        if len(indices) != len(dim_decl.dims):
-            raise SyntaxError("invalid number of indices in "
-                    "array reference to '%s' at %s (given: %d, needed: %d)"
-                    % (name, coord, len(indices), len(dim_decl.dims)))
 
-        axis_numbers = list(range(len(indices)))
+def _count_nodes(node):
+    return 1 + sum(_count_nodes(child) for _, child in node.children())
 
-        is_col_major = dim_decl.layout in ["fortran", "col-major"]
-        if is_col_major:
-            dim_it = list(zip(indices[::-1], dim_decl.dims[::-1], axis_numbers[::-1]))
-        else:
-            dim_it = list(zip(indices, dim_decl.dims, axis_numbers))
 
-        access = None
-        for idx, dim, axis in dim_it:
-            if access is not None:
-                if dim.leading_dim is None:
-                    raise SyntaxError("missing information on length of "
-                            "axis %d of array '%s', declared at %s"
-                            % (axis, name, dim_decl.coord))
-                access = c_ast.BinaryOp("*", access, dim.leading_dim)
+class _IndexPolynomialBuilder(object):
+    """Turns integer expressions built from ``+``, ``-`` and ``*`` into
+    polynomials, represented as ordered mappings from monomials to integer
+    coefficients. A monomial is a sorted tuple of factor numbers, where
+    factors are any other subexpressions, identified by their name (for
+    identifiers) or their generated code.
 
-            if dim.stride is not None:
-                idx = c_ast.BinaryOp("*", idx, dim.stride)
+    If *distribute* is *False*, products of sums are not multiplied out.
+    Instead, the sums become factors themselves.
+    """
 
-            if dim.start is not None:
+    def __init__(self, distribute, max_terms=64):
+        self.distribute = distribute
+        self.max_terms = max_terms
+
+        self.factor_nodes = []
+        self.factor_numbers = {}
+        self.key_generator = GnuCGeneratorBase()
+
+        # whether a product of two sums was encountered
+        self.had_product_of_sums = False
+
+    def new_polynomial(self, terms=()):
+        result = OrderedDict()
+        for monomial, coeff in terms:
+            result[monomial] = result.get(monomial, 0) + coeff
+            if not result[monomial]:
+                del result[monomial]
+        return result
+
+    def get_factor(self, node, key=None):
+        if key is not None:
+            pass
+        elif isinstance(node, c_ast.ID):
+            key = node.name
+        else:
+            key = self.key_generator.visit(node)
+
+        try:
+            number = self.factor_numbers[key]
+        except KeyError:
+            number = self.factor_numbers[key] = len(self.factor_nodes)
+            self.factor_nodes.append(node)
+
+        return self.new_polynomial([((number,), 1)])
+
+    def add(self, a, b, b_factor=1):
+        return self.new_polynomial(list(a.items()) + [
+            (monomial, b_factor*coeff) for monomial, coeff in b.items()])
+
+    def multiply(self, a, b):
+        def is_monomial(p):
+            return len(p) <= 1
+
+        if is_monomial(a) or is_monomial(b):
+            pass
+        elif self.distribute:
+            self.had_product_of_sums = True
+        else:
+            a = self.get_factor(self.to_ast(a), key=tuple(a.items()))
+            b = self.get_factor(self.to_ast(b), key=tuple(b.items()))
+
+        if len(a) * len(b) > self.max_terms:
+            raise _TooManyTerms()
+
+        return self.new_polynomial([
+            (tuple(sorted(mono_a + mono_b)), coeff_a*coeff_b)
+            for mono_a, coeff_a in a.items()
+            for mono_b, coeff_b in b.items()])
+
+    def __call__(self, node):
+        value = _get_int_literal_value(node)
+        if value is not None:
+            return self.new_polynomial([((), value)])
+
+        if isinstance(node, c_ast.BinaryOp):
+            if node.op == "+":
+                return self.add(self(node.left), self(node.right))
+            elif node.op == "-":
+                return self.add(self(node.left), self(node.right), -1)
+            elif node.op == "*":
+                return self.multiply(self(node.left), self(node.right))
+
+        elif isinstance(node, c_ast.UnaryOp):
+            if node.op == "+":
+                return self(node.expr)
+            elif node.op == "-":
+                return self.add(self.new_polynomial(), self(node.expr), -1)
+
+        return self.get_factor(node)
+
+    def to_ast(self, polynomial):
+        terms = [(monomial, coeff)
+                for monomial, coeff in polynomial.items()
+                if monomial]
+
+        # positive terms first, so that start offsets tend to end up together
+        terms.sort(key=lambda term: term[1] < 0)
+
+        constant = polynomial.get((), 0)
+        if constant:
+            terms.append(((), constant))
+
+        result = None
+        for monomial, coeff in terms:
+            term = None
+            if abs(coeff) != 1 or not monomial:
+                term = c_ast.Constant("int", str(abs(coeff)))
+
+            for number in monomial:
+                factor = self.factor_nodes[number]
+                if term is None:
+                    term = factor
+                else:
+                    term = c_ast.BinaryOp("*", term, factor)
+
+            if result is None:
+                if coeff < 0:
+                    result = c_ast.UnaryOp("-", term)
+                else:
+                    result = term
+            else:
+                result = c_ast.BinaryOp("+" if coeff > 0 else "-", result, term)
+
+        if result is None:
+            result = c_ast.Constant("int", "0")
+
+        return result
+
+
+def simplify_index_expression(expr):
+    """Return an expression equivalent to the integer expression *expr* with
+    constants folded, terms combined (so that e.g. ``(n - 1) + 1`` becomes
+    ``n``) and multiplications by one dropped. Products of sums are
+    multiplied out if that results in a smaller expression. Expressions that
+    may have side effects are returned unchanged.
+
+    Note that multiplying out (as in ``(k - 1)*n`` to ``k*n - n``) may
+    produce intermediate results larger than those of *expr*, which may
+    overflow in C where *expr* would not have.
+    """
+    if _may_have_side_effects(expr):
+        return expr
+
+    candidates = []
+    for distribute in [True, False]:
+        builder = _IndexPolynomialBuilder(distribute)
+        try:
+            candidates.append(builder.to_ast(builder(expr)))
+        except _TooManyTerms:
+            pass
+        else:
+            if not builder.had_product_of_sums:
+                # not distributing would give the same result
+                break
+
+    candidates.append(expr)
+
+    # min() keeps the first of several equally small candidates
+    return min(candidates, key=_count_nodes)
+
+# }}}
+
+
+# {{{ bounds checking
+
+# Declaring printf and exit (compatibly with <stdio.h> and <stdlib.h>)
+# rather than including their headers keeps the prelude from clashing with
+# the already preprocessed source that follows.
+BOUNDS_CHECK_PRELUDE = """
+#ifdef __GNUC__
+#define CND_UNLIKELY(cond) __builtin_expect(!!(cond), 0)
+#define CND_BOUNDS_CHECK_FAILED_ATTRIBUTES \\
+  __attribute__((unused, noinline, cold, noreturn))
+#else
+#define CND_UNLIKELY(cond) (cond)
+#define CND_BOUNDS_CHECK_FAILED_ATTRIBUTES
+#endif
+
+int printf(const char *format, ...);
+void exit(int status);
+
+static void CND_BOUNDS_CHECK_FAILED_ATTRIBUTES
+cnd_bounds_check_failed(const char *location, const char *array, int axis,
+    long index, const char *bounds)
+{
+  printf("%s: index %ld on axis %d of array '%s' "
+      "is out of bounds %s\\n", location, index, axis, array, bounds);
+  exit(1);
+}
+"""
+
+
+def _make_c_string_literal(s):
+    return '"%s"' % s.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _get_modified_names(node):
+    """Return a tuple ``(names, has_indirect_writes)`` of the set of names
+    that are assigned, incremented, decremented, have their address taken
+    or are declared within *node*, and whether *node* contains function
+    calls (other than to :data:`CND_QUERY_FUNCTIONS`) or stores through
+    pointers, which may modify variables not among *names*.
+    """
+    result = set()
+    has_indirect_writes = False
+
+    def add_lvalue(lvalue):
+        # Return whether *lvalue* may refer to memory other than that of
+        # the variable it names.
+        indirect = False
+        while isinstance(lvalue, (c_ast.ArrayRef, c_ast.StructRef)):
+            if isinstance(lvalue, c_ast.ArrayRef) or lvalue.type == "->":
+                indirect = True
+            lvalue = lvalue.name
+
+        if isinstance(lvalue, c_ast.ID):
+            result.add(lvalue.name)
+            return indirect
+        else:
+            return True
+
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, c_ast.Assignment):
+            if add_lvalue(node.lvalue):
+                has_indirect_writes = True
+        elif isinstance(node, c_ast.UnaryOp) and node.op in [
+                "++", "--", "p++", "p--"]:
+            if add_lvalue(node.expr):
+                has_indirect_writes = True
+        elif isinstance(node, c_ast.UnaryOp) and node.op == "&":
+            add_lvalue(node.expr)
+        elif isinstance(node, c_ast.FuncCall):
+            if not (isinstance(node.name, c_ast.ID)
+                    and node.name.name in CND_QUERY_FUNCTIONS):
+                has_indirect_writes = True
+        elif isinstance(node, c_ast.Decl) and node.name is not None:
+            result.add(node.name)
+
+        stack.extend(child for _, child in node.children())
+
+    return result, has_indirect_writes
+
+
+def _get_loop_local_names(func_def):
+    """Return a dictionary mapping the ``for`` statements within the
+    :class:`pycparser.c_ast.FuncDef` *func_def* to the sets of names that,
+    within them, refer to parameters or automatic variables of the
+    function whose address is never taken. These can only be modified by
+    name, not by called functions or through pointers.
+    """
+    address_taken = set()
+
+    stack = [func_def.body]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, c_ast.FuncDef):
+            # nested functions may modify any variable in scope
+            return {}
+        elif isinstance(node, c_ast.UnaryOp) and node.op == "&":
+            lvalue = node.expr
+            while isinstance(lvalue, (c_ast.ArrayRef, c_ast.StructRef)):
+                lvalue = lvalue.name
+            if isinstance(lvalue, c_ast.ID):
+                address_taken.add(lvalue.name)
+
+        stack.extend(child for _, child in node.children())
+
+    result = {}
+
+    def declare(scope, decl):
+        if (isinstance(decl.type, c_ast.FuncDecl)
+                or "static" in decl.storage or "extern" in decl.storage
+                or decl.name in address_taken):
+            # may shadow a local of the same name
+            scope.discard(decl.name)
+        else:
+            scope.add(decl.name)
+
+    def visit(node, scope):
+        if isinstance(node, (c_ast.Typedef, c_ast.Typename,
+                c_ast.Struct, c_ast.Union, c_ast.Enum)):
+            return
+
+        elif isinstance(node, c_ast.Compound):
+            scope = set(scope)
+
+        elif isinstance(node, c_ast.Decl):
+            if node.name is not None:
+                declare(scope, node)
+            if node.init is not None:
+                visit(node.init, scope)
+            return
+
+        elif isinstance(node, c_ast.For):
+            scope = set(scope)
+            if isinstance(node.init, c_ast.DeclList):
+                for decl in node.init.decls:
+                    declare(scope, decl)
+            result[node] = frozenset(scope)
+
+        for _, child in node.children():
+            visit(child, scope)
+
+    scope = set()
+    args = func_def.decl.type.args
+    if args is not None:
+        for param in args.params:
+            if isinstance(param, c_ast.Decl) and param.name is not None:
+                declare(scope, param)
+
+    visit(func_def.body, scope)
+    return result
+
+
+def _has_loop_exits(node, in_loop=False, in_switch=False):
+    """Return *True* if *node*, the body of a loop, may leave an iteration
+    of that loop early or be entered other than at its beginning.
+    """
+    if isinstance(node, (c_ast.Return, c_ast.Goto, c_ast.Label)):
+        return True
+    elif isinstance(node, c_ast.Break) and not (in_loop or in_switch):
+        return True
+    elif isinstance(node, c_ast.Continue) and not in_loop:
+        return True
+    elif isinstance(node, (c_ast.For, c_ast.While, c_ast.DoWhile)):
+        in_loop = True
+    elif isinstance(node, c_ast.Switch):
+        in_switch = True
+
+    for _, child in node.children():
+        if _has_loop_exits(child, in_loop, in_switch):
+            return True
+
+    return False
+
+
+def _is_loop_invariant(node, modified_names, unmodified_names=None):
+    """Return *True* if *node* is an expression without side effects that
+    does not read memory or any of the variables *modified_names*. If
+    *unmodified_names* is not *None*, variables not among it are assumed to
+    be modified as well.
+    """
+    if isinstance(node, c_ast.ID):
+        return (node.name not in modified_names
+                and (unmodified_names is None
+                    or node.name in unmodified_names))
+    elif isinstance(node, c_ast.Constant):
+        return True
+    elif isinstance(node, c_ast.BinaryOp):
+        return (_is_loop_invariant(node.left, modified_names,
+                    unmodified_names)
+                and _is_loop_invariant(node.right, modified_names,
+                    unmodified_names))
+    elif isinstance(node, c_ast.UnaryOp):
+        if node.op == "sizeof":
+            return True
+        return (node.op in ["+", "-", "~", "!"]
+                and _is_loop_invariant(node.expr, modified_names,
+                    unmodified_names))
+    elif isinstance(node, c_ast.Cast):
+        return _is_loop_invariant(node.expr, modified_names,
+                unmodified_names)
+    elif isinstance(node, c_ast.TernaryOp):
+        return all(
+                _is_loop_invariant(child, modified_names, unmodified_names)
+                for child in [node.cond, node.iftrue, node.iffalse])
+    elif isinstance(node, c_ast.FuncCall):
+        return (isinstance(node.name, c_ast.ID)
+                and node.name.name in CND_QUERY_FUNCTIONS)
+    else:
+        return False
+
+
+class _CountedLoop(object):
+    """A ``for`` loop that counts a variable up by one from a lower bound
+    to a loop-invariant upper bound and whose body runs to completion in
+    every iteration.
+
+    .. attribute:: hoisted_checks
+
+        A list of bounds checks (as code) to be performed before the loop
+        is entered, on the condition that its body is executed at least
+        once.
+
+    .. attribute:: running_offsets
+
+        A mapping from the generated code of array offsets that advance by
+        a loop-invariant step in each iteration to tuples ``(var_name,
+        offset, step)``, where *var_name* is the local that keeps track of
+        the offset, and *offset* and *step* are expressions.
+    """
+
+    def __init__(self, var, lower, upper, upper_inclusive, modified_names,
+            unmodified_names=None):
+        self.var = var
+        self.lower = lower
+        self.upper = upper
+        self.upper_inclusive = upper_inclusive
+        self.modified_names = modified_names
+        self.unmodified_names = unmodified_names
+
+        self.hoisted_checks = []
+        self.running_offsets = OrderedDict()
+
+    @classmethod
+    def from_for(cls, n, local_names=frozenset()):
+        """Return a :class:`_CountedLoop` for the
+        :class:`pycparser.c_ast.For` *n*, or *None* if it is not such a
+        loop. *local_names* are names of variables that cannot be modified
+        other than by name (see :func:`_get_loop_local_names`), the only
+        ones considered loop-invariant if the loop body calls functions or
+        stores through pointers.
+        """
+        init = n.init
+        if (isinstance(init, c_ast.DeclList) and len(init.decls) == 1
+                and isinstance(init.decls[0].init, c_ast.Node)
+                and not isinstance(init.decls[0].init, c_ast.InitList)):
+            var = init.decls[0].name
+            lower = init.decls[0].init
+        elif (isinstance(init, c_ast.Assignment) and init.op == "="
+                and isinstance(init.lvalue, c_ast.ID)):
+            var = init.lvalue.name
+            lower = init.rvalue
+        else:
+            return None
+
+        cond = n.cond
+        if not isinstance(cond, c_ast.BinaryOp):
+            return None
+        if (cond.op in ["<", "<="]
+                and isinstance(cond.left, c_ast.ID) and cond.left.name == var):
+            upper = cond.right
+            upper_inclusive = cond.op == "<="
+        elif (cond.op in [">", ">="]
+                and isinstance(cond.right, c_ast.ID) and cond.right.name == var):
+            upper = cond.left
+            upper_inclusive = cond.op == ">="
+        else:
+            return None
+
+        step = n.next
+        if isinstance(step, c_ast.UnaryOp) and step.op in ["++", "p++"]:
+            stepped = step.expr
+        elif (isinstance(step, c_ast.Assignment) and step.op == "+="
+                and _get_int_literal_value(step.rvalue) == 1):
+            stepped = step.lvalue
+        else:
+            return None
+        if not (isinstance(stepped, c_ast.ID) and stepped.name == var):
+            return None
+
+        modified_names, has_indirect_writes = _get_modified_names(n.stmt)
+        if var in modified_names:
+            return None
+        modified_names.add(var)
+
+        loop = cls(var, lower, upper, upper_inclusive, modified_names,
+                local_names if has_indirect_writes else None)
+
+        if (_may_have_side_effects(lower)
+                or not loop.is_invariant(upper)
+                or _has_loop_exits(n.stmt)):
+            return None
+
+        return loop
+
+    def is_invariant(self, expr):
+        """Return *True* if *expr* is known to have the same value in every
+        iteration of the loop.
+        """
+        return _is_loop_invariant(
+                expr, self.modified_names, self.unmodified_names)
+
+    @property
+    def last(self):
+        """An expression for the value of the loop variable in the last
+        iteration.
+        """
+        if self.upper_inclusive:
+            return self.upper
+        else:
+            return c_ast.BinaryOp("-", self.upper, c_ast.Constant("int", "1"))
+
+    def get_affine_polynomial(self, expr):
+        """If *expr* is an affine function of the loop variable with
+        loop-invariant coefficients, return a tuple ``(builder, polynomial,
+        var_number)`` of the :class:`_IndexPolynomialBuilder` used, the
+        polynomial it made of *expr*, and the factor number of the loop
+        variable (*None* if *expr* does not depend on it). Otherwise,
+        return *None*.
+        """
+        if _may_have_side_effects(expr):
+            return None
+
+        builder = _IndexPolynomialBuilder(distribute=True)
+        try:
+            polynomial = builder(expr)
+        except _TooManyTerms:
+            return None
+
+        var_number = builder.factor_numbers.get(self.var)
+        for monomial in polynomial:
+            if monomial.count(var_number) > 1:
+                return None
+
+        for number, factor in enumerate(builder.factor_nodes):
+            if number != var_number and not self.is_invariant(factor):
+                return None
+
+        return builder, polynomial, var_number
+
+    def get_affine_parts(self, expr):
+        """If *expr* is an affine function of the loop variable with
+        loop-invariant coefficients that depends on the loop variable,
+        return a tuple ``(offset, step, constant)``, where *constant* is
+        the integer constant term of *expr*, *offset* is an expression for
+        the rest, and *step* is an expression for the amount by which
+        *expr* grows in each iteration. Otherwise, return *None*.
+        """
+        affine = self.get_affine_polynomial(expr)
+        if affine is None:
+            return None
+
+        builder, polynomial, var_number = affine
+        if var_number is None:
+            return None
+
+        step = builder.new_polynomial(
+                (tuple(number for number in monomial if number != var_number),
+                    coeff)
+                for monomial, coeff in polynomial.items()
+                if var_number in monomial)
+
+        constant = polynomial.pop((), 0)
+
+        return (
+                simplify_index_expression(builder.to_ast(polynomial)),
+                simplify_index_expression(builder.to_ast(step)),
+                constant)
+
+    def get_extreme_values(self, expr):
+        """If *expr* is an affine function of the loop variable with
+        loop-invariant coefficients, return a list of expressions for
+        its values in the first and the last iteration (or just one
+        expression if it does not depend on the loop variable). Otherwise,
+        return *None*.
+        """
+        affine = self.get_affine_polynomial(expr)
+        if affine is None:
+            return None
+
+        builder, polynomial, var_number = affine
+        if var_number is None:
+            return [expr]
+
+        result = []
+        for value in [self.lower, self.last]:
+            builder.factor_nodes[var_number] = value
+            result.append(simplify_index_expression(builder.to_ast(polynomial)))
+
+        return result
+
+# }}}
+
+
+# {{{ array layouts
+
+# names of the helper functions spreading out the bits of an index for the
+# "morton" layout, by rank
+_MORTON_SPREAD_FUNCTIONS = {
+        2: "cnd_morton_spread2",
+        3: "cnd_morton_spread3",
+        }
+
+# bodies of the functions in _MORTON_SPREAD_FUNCTIONS, operating on a 64-bit
+# unsigned integer *x*, with %(suffix)s standing for the suffix of literals of
+# its type
+_MORTON_SPREAD_BODIES = {
+        2: """
+  x &= 0xffffffff%(suffix)s;
+  x = (x | (x << 16)) & 0x0000ffff0000ffff%(suffix)s;
+  x = (x | (x << 8)) & 0x00ff00ff00ff00ff%(suffix)s;
+  x = (x | (x << 4)) & 0x0f0f0f0f0f0f0f0f%(suffix)s;
+  x = (x | (x << 2)) & 0x3333333333333333%(suffix)s;
+  x = (x | (x << 1)) & 0x5555555555555555%(suffix)s;
+  return x;
+""",
+        3: """
+  x &= 0x1fffff%(suffix)s;
+  x = (x | (x << 32)) & 0x001f00000000ffff%(suffix)s;
+  x = (x | (x << 16)) & 0x001f0000ff0000ff%(suffix)s;
+  x = (x | (x << 8)) & 0x100f00f00f00f00f%(suffix)s;
+  x = (x | (x << 4)) & 0x10c30c30c30c30c3%(suffix)s;
+  x = (x | (x << 2)) & 0x1249249249249249%(suffix)s;
+  return x;
+""",
+        }
+
+
+def _build_morton_offset(local_indices):
+    """Return the offset of the entry at the zero-based *local_indices* of
+    a ``"morton"`` array, whose bits are those of the indices, interleaved
+    with the slowest-varying axis' in the most significant position.
+    """
+    rank = len(local_indices)
+    spread = c_ast.ID(_MORTON_SPREAD_FUNCTIONS[rank])
+
+    result = None
+    for axis, idx in enumerate(local_indices):
+        term = c_ast.FuncCall(spread, c_ast.ExprList([idx]))
+
+        shift = rank - 1 - axis
+        if shift:
+            term = c_ast.BinaryOp("*",
+                    c_ast.Constant("int", str(2**shift)), term)
+
+        if result is None:
+            result = term
+        else:
+            result = c_ast.BinaryOp("+", result, term)
+
+    return result
+
+# }}}
+
+
+# {{{ generators
+
+class _DimensionScope(object):
+    """Maps array names to the :class:`DimensionDecl` in effect for them.
+    Scopes are chained to their enclosing scope, so that opening a new
+    scope does not copy the enclosing scope's declarations.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.decls = {}
+
+    def get(self, name, default=None):
+        scope = self
+        while scope is not None:
+            try:
+                return scope.decls[name]
+            except KeyError:
+                scope = scope.parent
+
+        return default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+
+class _IndexTemplate(object):
+    """The index computation for array references to a
+    :class:`DimensionDecl`, compiled once per declaration.
+
+    .. attribute:: results
+
+        A mapping from the tuple of generated code for the indices of an
+        array reference to the generated code for its subscript.
+
+    .. attribute:: code_parts
+
+        The generated code of the unsimplified subscript, split at the
+        places where the indices are filled in, or *None* if not yet
+        generated.
+    """
+
+    def __init__(self, dim_decl, hoisted_strides=None):
+        self.dim_decl = dim_decl
+        self.hoisted_strides = hoisted_strides
+
+        self.results = {}
+        self.code_parts = None
+
+        axes = list(range(len(dim_decl.dims)))
+        if dim_decl.layout in ["fortran", "col-major"]:
+            axes.reverse()
+
+        # from slowest-varying to fastest-varying
+        self.axes = axes
+
+    def build_access(self, indices, simplify=None):
+        """Return the subscript for the array reference with *indices*.
+        *simplify*, if given, is applied to those parts of the subscript
+        that :func:`simplify_index_expression` would not look into.
+        """
+        layout = self.dim_decl.layout
+        if layout == "tiled":
+            return self.build_tiled_access(indices, simplify)
+        elif layout == "morton":
+            return _build_morton_offset(
+                    self.get_local_indices(indices, simplify))
+
+        dim_decl = self.dim_decl
+        strides = self.hoisted_strides
+
+        if strides is None:
+            axes = self.axes
+        else:
+            # strides are known, so axis order does not matter
+            axes = range(len(indices))
+
+        access = None
+        for axis in axes:
+            idx = indices[axis]
+            dim = dim_decl.dims[axis]
+
+            if access is not None and strides is None:
+                if dim.leading_dim is None:
+                    raise SyntaxError("missing information on length of "
+                            "axis %d of array '%s', declared at %s"
+                            % (axis, dim_decl.name, dim_decl.coord))
+                access = c_ast.BinaryOp("*", access, dim.leading_dim)
+
+            if dim.stride is not None:
+                idx = c_ast.BinaryOp("*", idx, dim.stride)
+
+            if dim.start is not None:
                 idx = c_ast.BinaryOp("-", idx, dim.start)
 
+            if strides is not None and axis in strides:
+                idx = c_ast.BinaryOp("*", idx, strides[axis])
+
             if access is not None:
                 access = c_ast.BinaryOp("+", access, idx)
             else:
                 access = idx
 
-        return "%s[%s]" % (name, self.visit(access))
+        return access
 
-    def visit_ArrayRef(self, n):
-        if isinstance(n.name, c_ast.ID):
-            if isinstance(n.name, c_ast.ID):
-                dim_decl = self.dim_decl_stack[-1].get(n.name.name)
+    def get_local_indices(self, indices, simplify=None):
+        """Return the zero-based positions along each axis given by
+        *indices*.
+        """
+        result = []
+        for idx, dim in zip(indices, self.dim_decl.dims):
+            if dim.stride is not None:
+                idx = c_ast.BinaryOp("*", idx, dim.stride)
+
+            if dim.start is not None:
+                idx = c_ast.BinaryOp("-", idx, dim.start)
+
+            if simplify is not None:
+                idx = simplify(idx)
+
+            result.append(idx)
+
+        return result
+
+    def get_tile_counts(self, simplify=None):
+        """Return the number of tiles along each axis of a ``"tiled"``
+        array, or *None* for axes of unknown length.
+        """
+        dim_decl = self.dim_decl
+
+        result = []
+        for dim, tile_size in zip(dim_decl.dims, dim_decl.tile_sizes):
+            if dim.leading_dim is None:
+                result.append(None)
+            elif tile_size == 1:
+                result.append(dim.leading_dim)
             else:
-                dim_decl = None
+                count = c_ast.BinaryOp("/",
+                        c_ast.BinaryOp("+", dim.leading_dim,
+                            c_ast.Constant("int", str(tile_size - 1))),
+                        c_ast.Constant("int", str(tile_size)))
 
-            if isinstance(n.subscript, c_ast.ExprList):
-                indices = n.subscript.exprs
+                if simplify is not None:
+                    count.left = simplify(count.left)
+
+                result.append(count)
+
+        return result
+
+    def build_tiled_access(self, indices, simplify=None):
+        # Tiles are stored in row-major order, as are the entries within
+        # each tile.
+        dim_decl = self.dim_decl
+        tile_counts = self.get_tile_counts(simplify)
+
+        tile = None
+        within_tile = None
+        tile_volume = 1
+
+        for axis, idx in enumerate(self.get_local_indices(indices, simplify)):
+            tile_size = dim_decl.tile_sizes[axis]
+            tile_size_node = c_ast.Constant("int", str(tile_size))
+
+            if tile_size == 1:
+                tile_idx = idx
+                idx_within_tile = None
             else:
-                indices = (n.subscript,)
+                # Within bounds, the index is not negative, and dividing it
+                # as an unsigned number takes no more than a shift or a mask
+                # for power-of-two tile sizes.
+                unsigned_tile_size = c_ast.Constant(
+                        "unsigned long", "%dUL" % tile_size)
+                tile_idx = c_ast.BinaryOp("/", idx, unsigned_tile_size)
+                idx_within_tile = c_ast.BinaryOp("%", idx, unsigned_tile_size)
+
+            if tile is None:
+                tile = tile_idx
+            else:
+                if tile_counts[axis] is None:
+                    raise SyntaxError("missing information on length of "
+                            "axis %d of array '%s', declared at %s"
+                            % (axis, dim_decl.name, dim_decl.coord))
+                tile = c_ast.BinaryOp("+",
+                        c_ast.BinaryOp("*", tile, tile_counts[axis]),
+                        tile_idx)
+
+            if within_tile is not None and tile_size != 1:
+                within_tile = c_ast.BinaryOp("*", within_tile, tile_size_node)
+            if idx_within_tile is not None:
+                if within_tile is None:
+                    within_tile = idx_within_tile
+                else:
+                    within_tile = c_ast.BinaryOp("+",
+                            within_tile, idx_within_tile)
 
-            if dim_decl is not None:
-                return self.generate_array_ref(
-                        dim_decl, n.name.name, indices, n.coord)
+            tile_volume *= tile_size
 
-        return self.generator_base_class.visit_ArrayRef(self, c_ast.ArrayRef(
-            n.name, n.subscript, n.coord))
+        access = c_ast.BinaryOp("*", tile,
+                c_ast.Constant("int", str(tile_volume)))
+        if within_tile is not None:
+            access = c_ast.BinaryOp("+", access, within_tile)
 
-    def visit_FuncCall(self, n):
-        if isinstance(n.name, c_ast.ID) and isinstance(n.args, c_ast.ExprList):
-            name = n.name.name
-            args = n.args.exprs
+        return access
 
-            def check_arg_count(needed):
-                if len(args) != needed:
-                    raise SyntaxError("%s takes exactly %d argument(s), "
-                            "%d given at %s"
-                            % (name, needed, len(args), n.coord))
+    def get_storage_size(self, simplify=None):
+        """Return the number of entries to be allocated for the array, or
+        *None* if unknown.
+        """
+        dim_decl = self.dim_decl
+        layout = dim_decl.layout
+
+        if layout == "morton":
+            if any(dim.leading_dim is None for dim in dim_decl.dims):
+                return None
+
+            last_indices = [
+                    c_ast.BinaryOp("-", dim.leading_dim, c_ast.Constant("int", "1"))
+                    for dim in dim_decl.dims]
+            if simplify is not None:
+                last_indices = [simplify(idx) for idx in last_indices]
+
+            return c_ast.BinaryOp("+",
+                    _build_morton_offset(last_indices),
+                    c_ast.Constant("int", "1"))
+
+        if layout == "tiled":
+            lengths = [
+                    c_ast.BinaryOp("*", count, c_ast.Constant("int", str(size)))
+                    if count is not None and size != 1 else count
+                    for count, size in zip(
+                        self.get_tile_counts(simplify), dim_decl.tile_sizes)]
+        else:
+            lengths = [dim.leading_dim for dim in dim_decl.dims]
 
-            def get_dim_decl():
-                if not isinstance(args[0], c_ast.ID):
-                    raise SyntaxError("may not call '%s' "
-                            "on undimensioned expression '%s' at %s"
-                            % (name, args[0], n.coord))
+        result = None
+        for length in lengths:
+            if length is None:
+                return None
 
-                dim_decl = self.dim_decl_stack[-1].get(args[0].name)
+            if result is None:
+                result = length
+            else:
+                result = c_ast.BinaryOp("*", result, length)
 
-                if dim_decl is None:
-                    raise SyntaxError("no dimension statement found for '%s' at %s"
-                            % (args[0].name, n.coord))
+        return result
 
-                return dim_decl
+    def fill_in(self, generator, indices, index_codes):
+        parts = self.code_parts
+        if len(parts) == 3 and not parts[0] and not parts[2]:
+            # the index is the whole subscript
+            return index_codes[0]
 
-            def is_an_int(s):
-                try:
-                    int(s)
-                except TypeError:
-                    return False
-                else:
-                    return True
+        result = parts[:]
+        for i in range(1, len(parts), 2):
+            axis = int(parts[i])
+            code = index_codes[axis]
+            if not generator._is_simple_node(indices[axis]):
+                code = "(%s)" % code
+            result[i] = code
 
-            if name == "rankof":
-                check_arg_count(1)
-                dim_decl = get_dim_decl()
-                return str(len(dim_decl.dims))
+        return "".join(result)
 
-            if name == "nitemsof":
-                check_arg_count(1)
-                dim_decl = get_dim_decl()
-                result = None
-                for i, axis in enumerate(dim_decl.dims):
-                    if axis.leading_dim is None:
-                        raise SyntaxError("no length information for axis %d "
-                                "of %s at %s" % (i, args[0].name, n.coord))
 
-                    if result is None:
-                        result = axis.leading_dim
-                    else:
-                        result = c_ast.BinaryOp("*", result, axis.leading_dim)
+_LINE_DIRECTIVE_RE = None
 
-                return self.visit(result)
+# values of the ``--line-directives`` option, see
+# :attr:`CndGeneratorMixin.line_directives`
+LINE_DIRECTIVE_GRANULARITIES = ["off", "function", "minimal", "statement"]
 
-            elif name in ["lboundof", "uboundof", "puboundof", "ldimof", "strideof"]:
-                check_arg_count(2)
-                dim_decl = get_dim_decl()
+# largest number of blank lines emitted instead of a line directive
+_MAX_LINE_DIRECTIVE_SKIP = 8
 
-                if not (isinstance(args[1], c_ast.Constant) and
-                        is_an_int(args[1].value)):
-                    raise SyntaxError("second argument of '%s' "
-                            "at %s is not a constant integer"
-                            % (name, n.coord))
 
-                axis = int(args[1].value)
+def get_line_directives_setting(granularity):
+    """Return the value of :attr:`CndGeneratorMixin.line_directives` for
+    *granularity*, one of :data:`LINE_DIRECTIVE_GRANULARITIES`.
+    """
+    if granularity == "off":
+        return None
+    else:
+        return granularity
 
-                if name == "lboundof":
-                    result = dim_decl.dims[axis].start
-                elif name == "uboundof":
-                    result = dim_decl.dims[axis].end
-                elif name == "puboundof":
-                    if dim_decl.layout in ["c", "row-major", "col-major"]:
-                        result = dim_decl.dims[axis].end
-                    elif dim_decl.layout == "fortran":
-                        result = c_ast.BinaryOp("+",
-                                dim_decl.dims[axis].end, c_ast.Constant("int", 1))
-                    else:
-                        raise SyntaxError(
-                                "invalid array layout '%s'" % dim_decl.layout)
 
-                elif name == "ldimof":
-                    result = dim_decl.dims[axis].leading_dim
-                elif name == "strideof":
-                    result = dim_decl.dims[axis].leading_dim
-                else:
-                    raise SyntaxError("invalid dim query '%s'" % name)
+# values of :attr:`CndGeneratorMixin.index_type` other than *None*
+INDEX_TYPES = ["int", "unsigned", "long", "size_t"]
+
+# index types for which OpenCL has ``mad24`` and ``mul24``
+_INT24_INDEX_TYPES = ["int", "unsigned"]
+
+
+def _make_cast(type_name, expr):
+    return c_ast.Cast(
+            c_ast.Typename([], c_ast.TypeDecl(
+                None, [], c_ast.IdentifierType([type_name]))),
+            expr)
+
+
+class CndGeneratorMixin(object):
+    def __init__(self):
+        self.dim_decl_stack = [_DimensionScope()]
+        self.simplify_index_expressions = True
+
+        # One of *None* (no line directives), ``"function"`` (one before
+        # each top-level declaration, so that lines within it are not
+        # mapped to their source lines), ``"statement"`` (one before each
+        # top-level declaration and each statement in a compound statement)
+        # or ``"minimal"`` (as ``"statement"``, but only where the mapping
+        # of output lines to source lines would otherwise be wrong). Setting
+        # :attr:`generate_line_directives` to *False* turns them off, too.
+        self.line_directives = "minimal"
+        self.generate_line_directives = True
+
+        # the source location of the next output line, as (file, line)
+        self.output_location = None
+
+        # If set, dimension declarations within functions emit ``const
+        # long`` (or :attr:`index_type`) locals holding the axis strides,
+        # which array references then use instead of recomputing them.
+        self.hoist_strides = False
+        self.hoisted_strides = {}
+
+        # dimension declarations in the outermost block of the current
+        # function that dimension one of its pointer parameters, the only
+        # ones that may carry attributes, see :meth:`visit_FuncDef`
+        self.parameter_dim_decls = set()
+
+        self.index_templates = {}
+
+        # ranks of "morton" arrays whose helper functions are needed by the
+        # current top-level declaration, and those already emitted
+        self.needed_morton_ranks = set()
+        self.emitted_morton_ranks = set()
+
+        # One of *None*, ``"naive"`` (check every array access where it
+        # happens) or ``"hoisted"`` (check accesses in counted loops once,
+        # before the loop, where possible).
+        self.bounds_check = None
+        self.counted_loops = []
+        self.conditional_depth = 0
+
+        # maps ``for`` statements of the current top-level declaration to
+        # names of locals that only change by name, see
+        # :func:`_get_loop_local_names`
+        self.loop_local_names = {}
+
+        # If set, array offsets that advance by a loop-invariant step in
+        # each iteration of a counted loop (such as one made by
+        # CND_FOR_AXIS) are kept track of in locals that are incremented
+        # along with the loop variable, see :meth:`get_running_offset`.
+        self.strength_reduce = False
+        self.running_offset_count = 0
+
+        # One of *None* (leave the type of index arithmetic to the usual
+        # arithmetic conversions) or one of :data:`INDEX_TYPES`, to which
+        # the operands of index arithmetic are then converted, see
+        # :meth:`convert_index_arithmetic`. If :attr:`use_mad24` is set
+        # as well, products in index arithmetic are computed by ``mad24``
+        # and ``mul24``, which requires an index type of ``int`` or
+        # ``unsigned`` and all operands to fit in 24 bits.
+        self.index_type = None
+        self.use_mad24 = False
+
+        # names of the locals declared with :attr:`index_type` by the
+        # current top-level declaration, see :meth:`has_index_type`
+        self.index_typed_names = set()
+
+    def simplify(self, expr):
+        if self.simplify_index_expressions:
+            return simplify_index_expression(expr)
+        else:
+            return expr
+
+    def visit_DimensionDecl(self, n):
+        scope = self.dim_decl_stack[-1]
+        if n.name in scope:
+            raise SyntaxError("may not redimension array '%s' at %s"
+                    % (n.name, n.coord))
+
+        if len(self.dim_decl_stack) > 1 and scope is self.dim_decl_stack[-2]:
+            # first declaration in this block
+            scope = self.dim_decl_stack[-1] = _DimensionScope(scope)
+
+        scope.decls[n.name] = n
+
+        if ((n.alignment is not None or n.restrict)
+                and n not in self.parameter_dim_decls):
+            raise SyntaxError("attributes of array '%s' at %s are only "
+                    "supported if it is a pointer parameter of the function "
+                    "dimensioned in the function's outermost block"
+                    % (n.name, n.coord))
+
+        # no locals at file scope
+        if len(self.dim_decl_stack) == 1:
+            return ""
+
+        decls = []
+        if self.hoist_strides:
+            decls.append(self.hoist_axis_strides(n))
+        decls.append(self.assume_alignment(n))
+
+        return ("\n" + self._make_indent()).join(decl for decl in decls if decl)
+
+    def assume_alignment(self, dim_decl):
+        """Return a statement that lets the compiler assume the
+        :attr:`DimensionDecl.alignment` of the pointer parameter dimensioned
+        by *dim_decl*, or an empty string if no alignment is given.
+        """
+        if dim_decl.alignment is None:
+            return ""
+
+        # The parameter itself (rather than a local copy of it) is updated,
+        # so that later assignments to it are not lost.
+        return "%s = __builtin_assume_aligned(%s, %s);" % (
+                dim_decl.name, dim_decl.name, self.visit(dim_decl.alignment))
+
+    def hoist_axis_strides(self, dim_decl):
+        """Return declarations of ``const long`` (or :attr:`index_type`)
+        locals for the strides of all but the fastest-varying axis of
+        *dim_decl*, in units of array entries, and record them in
+        :attr:`hoisted_strides`. If some needed axis length is unknown,
+        nothing is hoisted.
+        """
+        if dim_decl.layout in ["tiled", "morton"]:
+            return ""
+
+        axes = list(range(len(dim_decl.dims)))
+        if dim_decl.layout in ["fortran", "col-major"]:
+            axes.reverse()
+
+        strides = {}
+        decls = []
+        stride = None
+
+        # from fastest-varying to slowest-varying
+        for faster_axis, axis in zip(axes[::-1], axes[-2::-1]):
+            leading_dim = dim_decl.dims[faster_axis].leading_dim
+            if leading_dim is None:
+                return ""
+
+            if stride is None:
+                stride = leading_dim
+            else:
+                stride = c_ast.BinaryOp("*", stride, leading_dim)
+
+            stride = self.simplify(stride)
+            if not isinstance(stride, c_ast.Constant):
+                var_name = "_cnd_%s_stride%d" % (dim_decl.name, axis)
+                decls.append("const %s %s = %s;" % (
+                    self.index_type or "long", var_name,
+                    self.visit(self.convert_index_arithmetic(stride))))
+                self.index_typed_names.add(var_name)
+                stride = c_ast.ID(var_name)
+
+            strides[axis] = stride
+
+        self.hoisted_strides[dim_decl] = strides
+        return ("\n" + self._make_indent()).join(decls)
+
+    restrict_qualifier = "__restrict__"
+
+    # overrides base to apply *restrict* attributes to parameters and to
+    # find the locals of the function that only change by name
+    def visit_FuncDef(self, n):
+        # Attributes are only supported for arrays that are pointer
+        # parameters of the function, dimensioned in its outermost block,
+        # where the parameter is known to hold the array from the
+        # declaration on. C compilers generally only make use of
+        # restrict-qualified parameters, not of restrict-qualified locals
+        # initialized from them. So *restrict* attributes turn into
+        # qualifiers of the parameters.
+        attribute_decls = dict(
+                (item.name, item) for item in n.body.block_items or []
+                if isinstance(item, DimensionDecl)
+                and (item.alignment is not None or item.restrict))
+
+        if attribute_decls and n.decl.type.args is not None:
+            for param in n.decl.type.args.params:
+                if (isinstance(param, c_ast.Decl)
+                        and param.name in attribute_decls
+                        and isinstance(param.type, c_ast.PtrDecl)):
+                    dim_decl = attribute_decls[param.name]
+                    if (dim_decl.restrict
+                            and self.restrict_qualifier not in param.type.quals):
+                        param.type.quals = (
+                                param.type.quals + [self.restrict_qualifier])
+                    self.parameter_dim_decls.add(dim_decl)
+
+        if self.bounds_check == "hoisted" or self.strength_reduce:
+            self.loop_local_names.update(_get_loop_local_names(n))
+
+        return self.generator_base_class.visit_FuncDef(self, n)
+
+    # overrides base to treat dim_decl_stack
+    def visit_Compound(self, n):
+        chunks = [self._make_indent() + '{\n']
+        self.indent_level += 2
+
+        # a new scope is only created once a dimension is declared
+        self.dim_decl_stack.append(self.dim_decl_stack[-1])
+
+        statement_line_directives = (
+                self.generate_line_directives
+                and self.line_directives in ["minimal", "statement"])
+
+        if n.block_items:  # may be None
+            for stmt in n.block_items:
+                if statement_line_directives:
+                    chunks.append(self.make_line_directive(stmt.coord))
+
+                chunks.append(self._generate_stmt(stmt))
+
+        self.dim_decl_stack.pop()
+
+        self.indent_level -= 2
+        chunks.append(self._make_indent() + '}\n')
+        return "".join(chunks)
+
+    # {{{ top-level emission
+
+    # top-level constructs not followed by a semicolon
+    no_semicolon_ext_types = (c_ast.FuncDef,)
+
+    def iter_file_ast(self, n, output_location=None):
+        """Generate code for the :class:`pycparser.c_ast.FileAST` *n*,
+        yielding the code for each top-level declaration as soon as it is
+        generated. See :meth:`get_prelude` for *output_location*.
+        """
+        yield self.get_prelude(output_location)
+
+        for ext in n.ext:
+            yield self.visit_external(ext)
+
+    def get_prelude(self, output_location=None):
+        """Return code to be emitted ahead of all top-level declarations.
+        *output_location* is the source location of the first line of that
+        code, as established by code emitted before it (such as a verbatim
+        header prefix, see :func:`get_location_after`), if known.
+        """
+        self.emitted_morton_ranks.clear()
+
+        if self.bounds_check:
+            prelude = BOUNDS_CHECK_PRELUDE
+        else:
+            prelude = ""
+
+        if output_location is not None:
+            location_file, location_line = output_location
+            output_location = (
+                    location_file, location_line + prelude.count("\n"))
+        self.output_location = output_location
+
+        return prelude
+
+    def visit_external(self, ext):
+        """Return code for the top-level declaration *ext*. The result is
+        assumed to be emitted right after that for the previous top-level
+        declaration (or the prelude, see :meth:`get_prelude`).
+        """
+        if isinstance(ext, self.no_semicolon_ext_types):
+            result = self.visit(ext)
+        else:
+            result = self.visit(ext) + ';\n'
+
+        helpers = self.get_morton_helpers()
+
+        if self.generate_line_directives and self.line_directives is not None:
+            if ext.coord is not None:
+                result = self.make_line_directive(ext.coord) + result
+
+            result = helpers + result
+
+            if self.line_directives == "minimal":
+                result = self.compact_line_directives(result)
+        else:
+            result = helpers + result
+
+        # Whatever is cached on dimension declarations local to *ext* is of
+        # no further use, and the cached results for file-scope ones are
+        # easily recomputed. Dropping it keeps memory use from growing with
+        # the size of the file.
+        self.index_templates.clear()
+        self.hoisted_strides.clear()
+        self.parameter_dim_decls.clear()
+        self.loop_local_names.clear()
+        self.index_typed_names.clear()
+        self.running_offset_count = 0
+
+        return result
+
+    # overrides base to avoid quadratic string concatenation
+    def visit_FileAST(self, n):
+        return "".join(self.iter_file_ast(n))
+
+    def write_file_ast(self, n, outf, output_location=None):
+        """Write code for the :class:`pycparser.c_ast.FileAST` *n* to the
+        file-like object *outf*, one top-level declaration at a time. See
+        :meth:`get_prelude` for *output_location*.
+        """
+        for chunk in self.iter_file_ast(n, output_location):
+            outf.write(chunk)
+
+    # }}}
+
+    def get_morton_helpers(self):
+        """Return definitions of the helper functions for ``"morton"``
+        arrays that the current top-level declaration needs and that have
+        not yet been emitted.
+        """
+        ranks = sorted(self.needed_morton_ranks - self.emitted_morton_ranks)
+        self.emitted_morton_ranks.update(ranks)
+        self.needed_morton_ranks.clear()
+
+        return "".join(self.make_morton_spread_function(rank) for rank in ranks)
+
+    def make_morton_spread_function(self, rank):
+        return ("\nstatic __inline__ unsigned long long "
+                "__attribute__((unused, const))\n"
+                "%s(unsigned long long x)\n{%s}\n" % (
+                    _MORTON_SPREAD_FUNCTIONS[rank],
+                    _MORTON_SPREAD_BODIES[rank] % dict(suffix="ULL")))
+
+    # }}}
+
+    # {{{ line directives
+
+    def make_line_directive(self, coord):
+        return "# %d \"%s\"\n" % (coord.line, coord.file)
+
+    def compact_line_directives(self, code):
+        """Remove those line directives from *code* that merely restate
+        the source location that the output line following them has
+        anyway (see :attr:`output_location`), and replace those that skip
+        ahead by a few lines in the same file by blank lines, as the C
+        preprocessor does.
+        """
+        global _LINE_DIRECTIVE_RE
+
+        if _LINE_DIRECTIVE_RE is None:
+            import re
+            _LINE_DIRECTIVE_RE = re.compile(
+                    r'^\# ([0-9]+) "((?:[^"\\\n]|\\.)*)"\n', re.MULTILINE)
+
+        chunks = []
+        location = self.output_location
+        chunk_start = 0
+
+        for match in _LINE_DIRECTIVE_RE.finditer(code):
+            chunks.append(code[chunk_start:match.start()])
+            line = int(match.group(1))
+            filename = match.group(2)
+
+            if location is not None:
+                location_file, location_line = location
+                location_line += code.count("\n", chunk_start, match.start())
+                skip = line - location_line
+
+                if location_file != filename or not (
+                        0 <= skip <= _MAX_LINE_DIRECTIVE_SKIP):
+                    chunks.append(match.group())
+                else:
+                    chunks.append("\n" * skip)
+            else:
+                chunks.append(match.group())
+
+            location = filename, line
+            chunk_start = match.end()
+
+        chunks.append(code[chunk_start:])
+
+        if location is not None:
+            location_file, location_line = location
+            location = (location_file,
+                    location_line + code.count("\n", chunk_start))
+        self.output_location = location
+
+        return "".join(chunks)
+
+    # }}}
+
+    def get_index_template(self, dim_decl):
+        try:
+            return self.index_templates[dim_decl]
+        except KeyError:
+            template = self.index_templates[dim_decl] = _IndexTemplate(
+                    dim_decl, self.hoisted_strides.get(dim_decl))
+            return template
+
+    def generate_array_ref(self, dim_decl, name, indices, coord):
+        if len(indices) != len(dim_decl.dims):
+            raise SyntaxError("invalid number of indices in "
+                    "array reference to '%s' at %s (given: %d, needed: %d)"
+                    % (name, coord, len(indices), len(dim_decl.dims)))
+
+        if dim_decl.layout == "tiled":
+            for idx in indices:
+                if _may_have_side_effects(idx):
+                    raise SyntaxError("index of array '%s' with tiled layout "
+                            "may not have side effects at %s" % (name, coord))
+        elif dim_decl.layout == "morton":
+            self.needed_morton_ranks.add(len(dim_decl.dims))
+
+        template = self.get_index_template(dim_decl)
+
+        index_codes = tuple(self.visit(idx) for idx in indices)
+        try:
+            result = template.results[index_codes]
+        except KeyError:
+            if self.simplify_index_expressions:
+                result = self.visit(self.convert_index_arithmetic(
+                    simplify_index_expression(template.build_access(
+                        indices, simplify=simplify_index_expression))))
+            else:
+                if template.code_parts is None:
+                    template.code_parts = self.visit(
+                            self.convert_index_arithmetic(
+                                template.build_access([
+                                    c_ast.ID("\0%d\0" % axis)
+                                    for axis in range(len(indices))]))
+                            ).split("\0")
+
+                result = template.fill_in(self, indices, index_codes)
+
+            template.results[index_codes] = result
+
+        if self.strength_reduce and self.counted_loops:
+            running_offset = self.get_running_offset(dim_decl, name, indices)
+            if running_offset is not None:
+                result = running_offset
+
+        if self.bounds_check:
+            checks = self.get_bounds_checks(
+                    dim_decl, name, indices, index_codes, coord)
+            if checks:
+                return "%s[(%s, %s)]" % (name, ", ".join(checks), result)
+
+        return "%s[%s]" % (name, result)
+
+    supports_mad24 = False
+
+    def convert_index_arithmetic(self, expr):
+        """Return the index expression *expr* with the operands of its
+        additions, subtractions and multiplications converted to
+        :attr:`index_type`, so that the arithmetic is carried out at that
+        width. Integer literals are left to the usual arithmetic
+        conversions. If :attr:`use_mad24` is set, products (and sums
+        with a product) are turned into calls to ``mul24`` (and
+        ``mad24``).
+        """
+        if self.index_type is None:
+            return expr
+
+        if self.use_mad24:
+            if not self.supports_mad24:
+                raise ValueError("mad24 is only available in OpenCL")
+            if self.index_type not in _INT24_INDEX_TYPES:
+                raise ValueError("mad24 requires an index type of %s, "
+                        "not '%s'" % (
+                            " or ".join(_INT24_INDEX_TYPES), self.index_type))
+
+        if isinstance(expr, c_ast.BinaryOp) and expr.op in ["+", "-", "*"]:
+            if self.use_mad24 and expr.op == "+":
+                for product, addend in [
+                        (expr.left, expr.right), (expr.right, expr.left)]:
+                    if (isinstance(product, c_ast.BinaryOp)
+                            and product.op == "*"):
+                        return self.make_int24_call("mad24", [
+                            product.left, product.right, addend])
+
+            elif self.use_mad24 and expr.op == "*":
+                return self.make_int24_call("mul24", [expr.left, expr.right])
+
+            return c_ast.BinaryOp(expr.op,
+                    self.convert_index_arithmetic(expr.left),
+                    self.convert_index_arithmetic(expr.right))
+
+        elif isinstance(expr, c_ast.UnaryOp) and expr.op in ["+", "-"]:
+            return c_ast.UnaryOp(expr.op,
+                    self.convert_index_arithmetic(expr.expr))
+
+        elif (_get_int_literal_value(expr) is not None
+                or self.has_index_type(expr)):
+            return expr
+
+        else:
+            return _make_cast(self.index_type, expr)
+
+    def has_index_type(self, expr):
+        """Return whether *expr* is known to be of :attr:`index_type`
+        already, as a cast to it or a local declared with it.
+        """
+        if isinstance(expr, c_ast.Cast):
+            type_decl = expr.to_type.type
+            return (isinstance(type_decl, c_ast.TypeDecl)
+                    and isinstance(type_decl.type, c_ast.IdentifierType)
+                    and type_decl.type.names == [self.index_type])
+
+        elif isinstance(expr, c_ast.ID):
+            return expr.name in self.index_typed_names
+
+        else:
+            return False
+
+    def make_int24_call(self, func_name, args):
+        args = [self.convert_index_arithmetic(arg) for arg in args]
+
+        # Literals, which are left as they are by convert_index_arithmetic,
+        # would make the call ambiguous for unsigned arguments. (Those that
+        # fit in an int are of that type already.)
+        def needs_cast(arg):
+            value = _get_int_literal_value(arg)
+            return value is not None and not (
+                    self.index_type == "int" and value < 2**31)
+
+        return c_ast.FuncCall(c_ast.ID(func_name), c_ast.ExprList([
+            _make_cast(self.index_type, arg) if needs_cast(arg) else arg
+            for arg in args]))
+
+    def get_running_offset(self, dim_decl, name, indices):
+        """If the offset of the array reference to *dim_decl* with *indices*
+        advances by a loop-invariant step in each iteration of the innermost
+        enclosing counted loop, return code for it in terms of a local
+        that keeps track of it, recorded in that loop's
+        :attr:`_CountedLoop.running_offsets`. References that differ only by
+        a constant share the local. Otherwise, return *None*.
+        """
+        loop = self.counted_loops[-1]
+        if loop.dim_scope.get(name) is not dim_decl:
+            return None
+
+        parts = loop.get_affine_parts(
+                self.get_index_template(dim_decl).build_access(
+                    indices, simplify=simplify_index_expression))
+        if parts is None:
+            return None
+
+        offset, step, constant = parts
+        offset_code = self.visit(offset)
+
+        try:
+            var_name = loop.running_offsets[offset_code][0]
+        except KeyError:
+            var_name = "_cnd_offset%d" % self.running_offset_count
+            self.running_offset_count += 1
+            self.index_typed_names.add(var_name)
+            loop.running_offsets[offset_code] = (var_name, offset, step)
+
+        if constant > 0:
+            return "%s + %d" % (var_name, constant)
+        elif constant < 0:
+            return "%s - %d" % (var_name, -constant)
+        else:
+            return var_name
+
+    # {{{ bounds checking
+
+    def get_bounds_checks(self, dim_decl, name, indices, index_codes, coord):
+        """Return a list of bounds checks (as code) for the array reference
+        to *dim_decl* with *indices* that need to be performed as part of
+        the array reference. Checks that are known to succeed are left out.
+        In ``"hoisted"`` mode, checks that can be
+        performed before the innermost enclosing counted loop are instead
+        added to its :attr:`_CountedLoop.hoisted_checks`.
+
+        Indices that may have side effects are not checked, as that would
+        evaluate them more than once.
+        """
+        loop = None
+        if (self.bounds_check == "hoisted" and self.counted_loops
+                and self.counted_loops[-1].conditional_depth
+                == self.conditional_depth):
+            loop = self.counted_loops[-1]
+            if loop.dim_scope.get(name) is not dim_decl:
+                loop = None
+
+        if coord is None:
+            location = "<unknown>"
+        else:
+            location = "%s:%d" % (coord.file, coord.line)
+
+        checks = []
+        for axis, (idx, idx_code) in enumerate(zip(indices, index_codes)):
+            if _may_have_side_effects(idx):
+                continue
+
+            dim = dim_decl.dims[axis]
+            lower = dim.start
+            if lower is None:
+                lower = c_ast.Constant("int", "0")
+            upper = dim.end
+
+            def make_check(idx, idx_code):
+                return self.make_bounds_check(location, name, axis,
+                        idx, idx_code, lower, upper, dim_decl.layout == "fortran")
+
+            extreme_values = None
+            if (loop is not None
+                    and loop.is_invariant(lower)
+                    and (upper is None or loop.is_invariant(upper))):
+                extreme_values = loop.get_extreme_values(idx)
+
+            if extreme_values is None:
+                check = make_check(idx, idx_code)
+                if check is not None:
+                    checks.append(check)
+            else:
+                # affine, so checking the extreme values suffices
+                for value in extreme_values:
+                    check = make_check(value, self.visit(value))
+                    if check is not None and check not in loop.hoisted_checks:
+                        loop.hoisted_checks.append(check)
+
+        return checks
+
+    def make_bounds_check(self, location, name, axis, idx, idx_code,
+            lower, upper, upper_inclusive):
+        """Return code that calls :c:func:`cnd_bounds_check_failed` unless
+        *idx* (with generated code *idx_code*) lies between *lower* and
+        *upper*, or *None* if that is known to be the case.
+        """
+        conditions = []
+
+        def add_condition(op, bound, bound_code):
+            idx_value = _get_int_literal_value(idx)
+            bound_value = _get_int_literal_value(bound)
+            if idx_value is not None and bound_value is not None:
+                if {
+                        ">=": idx_value >= bound_value,
+                        "<=": idx_value <= bound_value,
+                        "<": idx_value < bound_value,
+                        }[op]:
+                    return
+            elif op in [">=", "<="] and idx_code == bound_code:
+                # avoid warnings about comparisons that are always true
+                return
+
+            conditions.append("%s %s %s" % (
+                self.parenthesize(idx, idx_code), op,
+                self.parenthesize(bound, bound_code)))
+
+        lower = self.simplify(lower)
+        lower_code = self.visit(lower)
+        add_condition(">=", lower, lower_code)
+        bounds = "[%s, " % lower_code
+
+        if upper is None:
+            bounds += "...)"
+        else:
+            upper = self.simplify(upper)
+            upper_code = self.visit(upper)
+            if upper_inclusive:
+                add_condition("<=", upper, upper_code)
+                bounds += "%s]" % upper_code
+            else:
+                add_condition("<", upper, upper_code)
+                bounds += "%s)" % upper_code
+
+        if not conditions:
+            return None
+
+        condition = " && ".join(conditions)
+        idx_code = self.parenthesize(idx, idx_code)
+        return ("(CND_UNLIKELY(!(%s)) ? cnd_bounds_check_failed("
+                "%s, %s, %d, (long) %s, %s) : (void) 0)" % (
+                    condition, _make_c_string_literal(location),
+                    _make_c_string_literal(name), axis, idx_code,
+                    _make_c_string_literal(bounds)))
+
+    def parenthesize(self, node, code):
+        if self._is_simple_node(node):
+            return code
+        else:
+            return "(%s)" % code
+
+    def visit_conditionally(self, base_method, n):
+        """Generate code for *n* using *base_method*, noting that the
+        array references within it may not be executed.
+        """
+        if self.bounds_check != "hoisted":
+            return base_method(self, n)
+
+        self.conditional_depth += 1
+        try:
+            return base_method(self, n)
+        finally:
+            self.conditional_depth -= 1
+
+    def visit_If(self, n):
+        return self.visit_conditionally(self.generator_base_class.visit_If, n)
+
+    def visit_Switch(self, n):
+        return self.visit_conditionally(
+                self.generator_base_class.visit_Switch, n)
+
+    def visit_While(self, n):
+        return self.visit_conditionally(
+                self.generator_base_class.visit_While, n)
+
+    def visit_DoWhile(self, n):
+        return self.visit_conditionally(
+                self.generator_base_class.visit_DoWhile, n)
+
+    def visit_TernaryOp(self, n):
+        return self.visit_conditionally(
+                self.generator_base_class.visit_TernaryOp, n)
+
+    def visit_BinaryOp(self, n):
+        if n.op in ["&&", "||"]:
+            return self.visit_conditionally(
+                    self.generator_base_class.visit_BinaryOp, n)
+        else:
+            return self.generator_base_class.visit_BinaryOp(self, n)
+
+    def visit_For(self, n):
+        if self.bounds_check != "hoisted" and not self.strength_reduce:
+            return self.generator_base_class.visit_For(self, n)
+
+        loop = _CountedLoop.from_for(
+                n, self.loop_local_names.get(n, frozenset()))
+        if loop is None:
+            return self.visit_conditionally(
+                    self.generator_base_class.visit_For, n)
+
+        loop.conditional_depth = self.conditional_depth
+        loop.dim_scope = self.dim_decl_stack[-1]
+
+        guard = "%s %s %s" % (
+                self.parenthesize(loop.lower, self.visit(loop.lower)),
+                "<=" if loop.upper_inclusive else "<",
+                self.parenthesize(loop.upper, self.visit(loop.upper)))
+
+        init_code = self.visit(n.init)
+        cond_code = self.visit(n.cond)
+        next_code = self.visit(n.next)
+
+        self.counted_loops.append(loop)
+        try:
+            body = self._generate_stmt(n.stmt, add_indent=True)
+        finally:
+            self.counted_loops.pop()
+
+        indent = self._make_indent()
+        lines = ["{"]
+
+        if loop.hoisted_checks:
+            lines.extend(["%s  if (%s)" % (indent, guard), "%s  {" % indent])
+            lines.extend("%s    %s;" % (indent, check)
+                    for check in loop.hoisted_checks)
+            lines.append("%s  }" % indent)
+
+        if loop.running_offsets:
+            # The loop variable is initialized ahead of the loop, so that
+            # the offsets can be initialized from it.
+            lines.append("%s  %s;" % (indent, init_code))
+
+            next_codes = [next_code]
+            for var_name, offset, step in loop.running_offsets.values():
+                lines.append("%s  %s %s = %s;" % (
+                    indent, self.index_type or "long", var_name,
+                    self.visit(self.convert_index_arithmetic(offset))))
+                if _get_int_literal_value(step) == 1:
+                    next_codes.append("++%s" % var_name)
+                else:
+                    step = self.convert_index_arithmetic(step)
+                    next_codes.append("%s += %s" % (
+                        var_name, self.parenthesize(step, self.visit(step))))
+
+            s = "for (; %s; %s)\n" % (cond_code, ", ".join(next_codes)) + body
+        else:
+            # same as the base class
+            s = "for (%s; %s; %s)\n" % (init_code, cond_code, next_code) + body
+
+        if len(lines) == 1:
+            return s
+
+        lines.extend(line if not line or line.startswith("#") else "  " + line
+                for line in (indent + s.rstrip("\n")).split("\n"))
+        lines.append(indent + "}")
+        return "\n".join(lines)
+
+    # }}}
+
+    def visit_ArrayRef(self, n):
+        if isinstance(n.name, c_ast.ID):
+            if isinstance(n.name, c_ast.ID):
+                dim_decl = self.dim_decl_stack[-1].get(n.name.name)
+            else:
+                dim_decl = None
+
+            if isinstance(n.subscript, c_ast.ExprList):
+                indices = n.subscript.exprs
+            else:
+                indices = (n.subscript,)
+
+            if dim_decl is not None:
+                return self.generate_array_ref(
+                        dim_decl, n.name.name, indices, n.coord)
+
+        return self.generator_base_class.visit_ArrayRef(self, c_ast.ArrayRef(
+            n.name, n.subscript, n.coord))
+
+    def visit_FuncCall(self, n):
+        if isinstance(n.name, c_ast.ID) and isinstance(n.args, c_ast.ExprList):
+            name = n.name.name
+            args = n.args.exprs
+
+            def check_arg_count(needed):
+                if len(args) != needed:
+                    raise SyntaxError("%s takes exactly %d argument(s), "
+                            "%d given at %s"
+                            % (name, needed, len(args), n.coord))
+
+            def get_dim_decl():
+                if not isinstance(args[0], c_ast.ID):
+                    raise SyntaxError("may not call '%s' "
+                            "on undimensioned expression '%s' at %s"
+                            % (name, args[0], n.coord))
+
+                dim_decl = self.dim_decl_stack[-1].get(args[0].name)
+
+                if dim_decl is None:
+                    raise SyntaxError("no dimension statement found for '%s' at %s"
+                            % (args[0].name, n.coord))
+
+                return dim_decl
+
+            def is_an_int(s):
+                try:
+                    int(s)
+                except TypeError:
+                    return False
+                else:
+                    return True
+
+            if name == "rankof":
+                check_arg_count(1)
+                dim_decl = get_dim_decl()
+                return str(len(dim_decl.dims))
+
+            if name == "nitemsof":
+                check_arg_count(1)
+                dim_decl = get_dim_decl()
+                for i, axis in enumerate(dim_decl.dims):
+                    if axis.leading_dim is None:
+                        raise SyntaxError("no length information for axis %d "
+                                "of %s at %s" % (i, args[0].name, n.coord))
+
+                if dim_decl.layout == "morton":
+                    self.needed_morton_ranks.add(len(dim_decl.dims))
+
+                # includes the padding of tiled and morton layouts
+                result = self.simplify(
+                        self.get_index_template(dim_decl).get_storage_size(
+                            self.simplify))
+
+                if isinstance(result, c_ast.BinaryOp) and result.op != "*":
+                    # keep sums together within products, as in the
+                    # CND_*ALLOC* helpers
+                    return "(%s)" % self.visit(result)
+
+                return self.visit(result)
+
+            elif name in ["lboundof", "uboundof", "puboundof", "ldimof", "strideof"]:
+                check_arg_count(2)
+                dim_decl = get_dim_decl()
+
+                if not (isinstance(args[1], c_ast.Constant) and
+                        is_an_int(args[1].value)):
+                    raise SyntaxError("second argument of '%s' "
+                            "at %s is not a constant integer"
+                            % (name, n.coord))
+
+                axis = int(args[1].value)
+
+                if name == "lboundof":
+                    result = dim_decl.dims[axis].start
+                    if result is None:
+                        # the default for all but the "fortran" layout
+                        result = c_ast.Constant("int", "0")
+                elif name == "uboundof":
+                    result = dim_decl.dims[axis].end
+                elif name == "puboundof":
+                    if dim_decl.layout in [
+                            "c", "row-major", "col-major", "tiled", "morton"]:
+                        result = dim_decl.dims[axis].end
+                    elif dim_decl.layout == "fortran":
+                        result = c_ast.BinaryOp("+",
+                                dim_decl.dims[axis].end, c_ast.Constant("int", 1))
+                    else:
+                        raise SyntaxError(
+                                "invalid array layout '%s'" % dim_decl.layout)
+
+                elif name == "ldimof":
+                    result = dim_decl.dims[axis].leading_dim
+                elif name == "strideof":
+                    result = dim_decl.dims[axis].leading_dim
+                else:
+                    raise SyntaxError("invalid dim query '%s'" % name)
+
+                if result is None:
+                    raise SyntaxError("no value available for '%s' at %s" % (
+                        self.generator_base_class.visit_FuncCall(self, n), n.coord))
+
+                return self.visit(self.simplify(result))
+
+        return self.generator_base_class.visit_FuncCall(self, n)
+
+
+class GnuCGenerator(CndGeneratorMixin, GnuCGeneratorBase):
+    generator_base_class = GnuCGeneratorBase
+
+    def __init__(self):
+        GnuCGeneratorBase.__init__(self)
+        CndGeneratorMixin.__init__(self)
+
+
+class OpenCLCGenerator(CndGeneratorMixin, OpenCLCGeneratorBase):
+    generator_base_class = OpenCLCGeneratorBase
+
+    no_semicolon_ext_types = (c_ast.FuncDef, PreprocessorLine)
+
+    def __init__(self):
+        OpenCLCGeneratorBase.__init__(self)
+        CndGeneratorMixin.__init__(self)
+
+    restrict_qualifier = "restrict"
+
+    supports_mad24 = True
+
+    def make_morton_spread_function(self, rank):
+        return "\nulong %s(ulong x)\n{%s}\n" % (
+                _MORTON_SPREAD_FUNCTIONS[rank],
+                _MORTON_SPREAD_BODIES[rank] % dict(suffix="UL"))
+
+    def assume_alignment(self, dim_decl):
+        # OpenCL C has no __builtin_assume_aligned.
+        return ""
+
+# }}}
+
+
+# {{{ timing instrumentation
+
+def get_peak_rss(children=False):
+    """Return the peak resident set size of this process in bytes, or of
+    its terminated child processes if *children* is *True*, or *None* if
+    that is unknown.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    if children:
+        who = resource.RUSAGE_CHILDREN
+    else:
+        who = resource.RUSAGE_SELF
+
+    result = resource.getrusage(who).ru_maxrss
+    if not sys.platform.startswith("darwin"):
+        # in kilobytes
+        result *= 1024
+
+    return result
+
+
+def get_cpu_time():
+    """Return the user and system time used by this process and its
+    terminated child processes, in seconds.
+    """
+    try:
+        import resource
+    except ImportError:
+        import os
+        return sum(os.times()[:4])
+
+    result = 0
+    for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+        usage = resource.getrusage(who)
+        result += usage.ru_utime + usage.ru_stime
+
+    return result
+
+
+class _TimedPhase(object):
+    def __init__(self, timings, name, subprocess):
+        self.timings = timings
+        self.name = name
+        self.subprocess = subprocess
+
+    def __enter__(self):
+        from time import time
+        self.start_wall = time()
+        self.start_cpu = get_cpu_time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        from time import time
+        wall = time() - self.start_wall
+        cpu = get_cpu_time() - self.start_cpu
+
+        peak_rss = get_peak_rss()
+        if self.subprocess:
+            children_peak_rss = get_peak_rss(children=True)
+            if children_peak_rss is not None:
+                peak_rss = max(peak_rss, children_peak_rss)
+
+        self.timings.phases.append(dict(
+            name=self.name, wall=wall, cpu=cpu, peak_rss=peak_rss))
+
+
+class PhaseTimings(object):
+    """Wall time, CPU time and peak resident set size of the phases of
+    processing one input file.
+
+    .. attribute:: tool
+    .. attribute:: filename
+    .. attribute:: phases
+
+        A list of dictionaries with keys *name*, *wall*, *cpu* (in seconds,
+        CPU time includes that of child processes) and *peak_rss* (in
+        bytes, or *None* if unknown), in order of completion.
+
+    .. attribute:: counts
+
+        A dictionary of event counts, such as *passthrough* for a file
+        that :func:`run_as_compiler_frontend` compiled without translating
+        it.
+    """
+
+    enabled = True
+
+    def __init__(self, tool, filename):
+        self.tool = tool
+        self.filename = filename
+        self.phases = []
+        self.counts = {}
+
+    def phase(self, name, subprocess=False):
+        """Return a context manager that records the phase *name*. If
+        *subprocess* is *True*, the phase runs a child process, whose peak
+        resident set size should be considered.
+        """
+        return _TimedPhase(self, name, subprocess)
+
+    def count(self, name, increment=1):
+        """Add *increment* to the count of the event *name*."""
+        self.counts[name] = self.counts.get(name, 0) + increment
+
+    def as_dict(self):
+        import os
+        return dict(
+                tool=self.tool,
+                file=self.filename,
+                pid=os.getpid(),
+                phases=self.phases,
+                counts=self.counts)
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _NoPhaseTimings(object):
+    enabled = False
+
+    def phase(self, name, subprocess=False):
+        return _NoPhase()
+
+    def count(self, name, increment=1):
+        pass
+
+    def as_dict(self):
+        return None
+
+
+_TIMING_HOOKS = []
+
+
+def add_timing_hook(hook):
+    """Register *hook* to be called with a dictionary as returned by
+    :meth:`PhaseTimings.as_dict` for each file translated by
+    :func:`transform_cl`, :func:`run_standalone` and
+    :func:`run_as_compiler_frontend` (including files translated in worker
+    processes) in this process.
+    """
+    _TIMING_HOOKS.append(hook)
+
+
+def remove_timing_hook(hook):
+    _TIMING_HOOKS.remove(hook)
+
+
+def get_timing_settings():
+    """Return a tuple *(print_timings, timings_file)* as specified by the
+    environment variables :envvar:`CND_TIMINGS` (set to a nonzero value to
+    print timings to standard error) and :envvar:`CND_TIMINGS_FILE` (the
+    name of a file to which timings are appended as JSON, one line per
+    input file).
+    """
+    import os
+    return (os.environ.get("CND_TIMINGS", "0") not in ["", "0"],
+            os.environ.get("CND_TIMINGS_FILE") or None)
+
+
+def make_phase_timings(tool, filename):
+    """Return a :class:`PhaseTimings` instance if timings are requested
+    by :func:`get_timing_settings` or a hook is registered, or an object
+    with the same interface that records nothing otherwise.
+    """
+    print_timings, timings_file = get_timing_settings()
+    if print_timings or timings_file or _TIMING_HOOKS:
+        return PhaseTimings(tool, filename)
+    else:
+        return _NoPhaseTimings()
+
+
+def format_phase_timings(record):
+    if record["file"] is None:
+        lines = ["%s: timings:" % record["tool"]]
+    else:
+        lines = ["%s: timings for '%s':" % (record["tool"], record["file"])]
+
+    for phase in record["phases"]:
+        if phase["peak_rss"] is None:
+            peak_rss = "-"
+        else:
+            peak_rss = "%.1f MB" % (phase["peak_rss"] / 1024**2)
+
+        lines.append("  %-10s %9.1f ms wall %9.1f ms cpu %10s peak RSS" % (
+            phase["name"], phase["wall"]*1e3, phase["cpu"]*1e3, peak_rss))
+
+    for name, count in sorted(record.get("counts", {}).items()):
+        lines.append("  %-10s %9d" % (name, count))
+
+    return "\n".join(lines)
+
+
+def report_phase_timings(record, print_timings=None, timings_file=None):
+    """Pass *record*, as returned by :meth:`PhaseTimings.as_dict`, to the
+    registered hooks and write it out as requested by the arguments, which
+    default to the values given by :func:`get_timing_settings`.
+    """
+    if record is None:
+        return
+
+    for hook in _TIMING_HOOKS:
+        hook(record)
+
+    env_print_timings, env_timings_file = get_timing_settings()
+    if print_timings is None:
+        print_timings = env_print_timings
+    if timings_file is None:
+        timings_file = env_timings_file
+
+    if print_timings:
+        print(format_phase_timings(record), file=sys.stderr)
+
+    if timings_file:
+        import json
+        import os
+
+        # a single write in append mode, so that concurrent builds can
+        # share a file
+        fd = os.open(timings_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            os.write(fd, (json.dumps(record, sort_keys=True) + "\n")
+                    .encode("utf-8"))
+        finally:
+            os.close(fd)
+
+# }}}
+
+
+# {{{ run helpers
+
+class ExecError(RuntimeError):
+    pass
+
+
+def call_capture_output(cmdline, cwd=None, error_on_nonzero=True):
+    """
+    :returns: a tuple (return code, stdout_data, stderr_data).
+    """
+    from subprocess import Popen, PIPE
+    try:
+        popen = Popen(cmdline, cwd=cwd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdout_data, stderr_data = popen.communicate()
+        if error_on_nonzero and popen.returncode:
+            raise ExecError("status %d invoking '%s': %s"
+                    % (popen.returncode, " ".join(cmdline), stderr_data))
+        return popen.returncode, stdout_data, stderr_data
+    except OSError as e:
+        raise ExecError("error invoking '%s': %s"
+                % (" ".join(cmdline), e))
+
+
+class CompileError(RuntimeError):
+    def __init__(self, msg, command_line, stdout=None, stderr=None):
+        self.msg = msg
+        self.command_line = command_line
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __str__(self):
+        result = self.msg
+        if self.command_line:
+            try:
+                result += "\n[command: %s]" % (" ".join(self.command_line))
+            except Exception as e:
+                print(e)
+        if self.stdout:
+            result += "\n[stdout:\n%s]" % self.stdout
+        if self.stderr:
+            result += "\n[stderr:\n%s]" % self.stderr
+
+        return result
+
+
+def write_temp_file(contents, suffix):
+    from tempfile import mkstemp
+    handle, path = mkstemp(suffix=suffix)
+
+    import os
+
+    try:
+        outf = open(path, 'w')
+        try:
+            outf.write(contents)
+        finally:
+            outf.close()
+    finally:
+        os.close(handle)
+
+    return path
+
+
+def call_with_stdin(cmdline, stdin_data, chunk_size=2**16):
+    """Run *cmdline*, feeding it the (text) string *stdin_data*. Output is
+    read incrementally while input is being written, and decoded as it
+    arrives, so that only one full copy of it is kept.
+
+    :returns: a tuple (return code, stdout_data, stderr_data) of text strings.
+    """
+    from subprocess import Popen, PIPE
+    import codecs
+
+    try:
+        popen = Popen(cmdline, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    except OSError as e:
+        raise ExecError("error invoking '%s': %s"
+                % (" ".join(cmdline), e))
+
+    def feed_stdin():
+        try:
+            # encode piecewise to avoid a full copy of the input
+            for i in range(0, len(stdin_data), chunk_size):
+                chunk = stdin_data[i:i+chunk_size]
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode("utf-8")
+                popen.stdin.write(chunk)
+        except (IOError, OSError):
+            # process exited without reading all of its input
+            pass
+
+        try:
+            popen.stdin.close()
+        except (IOError, OSError):
+            pass
+
+    stderr_chunks = []
+
+    def drain_stderr():
+        stderr_chunks.append(popen.stderr.read())
+
+    helper_threads = [
+            threading.Thread(target=feed_stdin),
+            threading.Thread(target=drain_stderr),
+            ]
+    for thread in helper_threads:
+        thread.daemon = True
+        thread.start()
+
+    if str is bytes:
+        # Python 2: keep byte strings
+        decoder = None
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+
+    stdout_chunks = []
+    while True:
+        chunk = popen.stdout.read(chunk_size)
+        if not chunk:
+            break
+
+        if decoder is not None:
+            chunk = decoder.decode(chunk)
+        stdout_chunks.append(chunk)
+
+    if decoder is not None:
+        stdout_chunks.append(decoder.decode(b"", True))
+
+    for thread in helper_threads:
+        thread.join()
+    popen.stdout.close()
+    popen.stderr.close()
+    popen.wait()
+
+    stdout_data = "".join(stdout_chunks)
+    del stdout_chunks
+
+    stderr_data, = stderr_chunks
+    if decoder is not None:
+        stderr_data = stderr_data.decode("utf-8", "replace")
+
+    return popen.returncode, stdout_data, stderr_data
+
+
+# maps cpp command lines (as tuples) to whether they accept input on stdin
+_CPP_ACCEPTS_STDIN = {}
+
+
+def _cpp_accepts_stdin(cpp):
+    """Return whether the preprocessor command line *cpp* (a list) accepts
+    its input on standard input, by trying it on empty input once.
+    """
+    key = tuple(cpp)
+    try:
+        return _CPP_ACCEPTS_STDIN[key]
+    except KeyError:
+        result, stdout, stderr = call_with_stdin(cpp + ["-"], "")
+        accepts_stdin = _CPP_ACCEPTS_STDIN[key] = result == 0
+        return accepts_stdin
+
+
+def preprocess_source(source, cpp, options):
+    """Run the C preprocessor *cpp* (a command line given as a string,
+    defaulting to :envvar:`CND_CPP`, :envvar:`CPP` or the platform's
+    preprocessor) on *source* and return the output.
+
+    *source* is fed to the preprocessor on standard input. If that fails
+    because the preprocessor does not accept input on standard input (see
+    :func:`_cpp_accepts_stdin`), it is written to a temporary file instead,
+    as it is for this preprocessor from then on. In either case, the output
+    refers to *source* by the name ``<stdin>``.
+    """
+    import os
+    if cpp is None:
+        cpp = os.environ.get("CND_CPP")
+    if cpp is None:
+        cpp = os.environ.get("CPP")
+    if cpp is None:
+        import sys
+        if sys.platform.startswith("darwin"):
+            cpp = "gcc -E"
+        else:
+            cpp = "cpp"
+
+    cpp = cpp.split()
+
+    if _CPP_ACCEPTS_STDIN.get(tuple(cpp), True):
+        cmdline = cpp + options + ["-"]
+        result, stdout, stderr = call_with_stdin(cmdline, source)
+
+        if result == 0:
+            return stdout
+
+        del stdout
+
+        if _cpp_accepts_stdin(cpp):
+            raise CompileError("preprocessing failed", cmdline, stderr=stderr)
+
+    source_path = write_temp_file(source, ".c")
+    try:
+        cmdline = cpp + options + [source_path]
+
+        result, stdout, stderr = call_capture_output(cmdline, error_on_nonzero=False)
+
+        if result != 0:
+            if not isinstance(stderr, str):
+                stderr = stderr.decode("utf-8", "replace")
+
+            raise CompileError("preprocessing failed", cmdline, stderr=stderr)
+    finally:
+        os.unlink(source_path)
+
+    if not isinstance(stdout, str):
+        stdout = stdout.decode("utf-8")
+
+    # Keep the output independent of the temporary file name, e.g. so that
+    # it may be used as a cache key.
+    stdout = stdout.replace("\"%s\"" % source_path, "\"<stdin>\"")
+
+    return stdout
+
+
+PREAMBLE = [
+        CND_HELPERS,
+        "#define __extension__ /*empty*/",  # FIXME
+        ]
+
+
+def _read_source_file(filename, preprocess, cpp, cpp_options, timings):
+    with timings.phase("read"):
+        src = open(filename, "rt").read()
+        src = insert_parens_in_brackets(filename, src)
+
+    if preprocess:
+        extra_lines = PREAMBLE + [
+            "# 1 \"%s\"" % filename,
+            ]
+        src = "\n".join(extra_lines) + "\n" + src
+
+        with timings.phase("cpp", subprocess=True):
+            src = preprocess_source(src, cpp, cpp_options)
+
+    return src
+
+
+def translate_file(filename, preprocess=False, cpp=None, cpp_options=None,
+        generator_settings=None, outf=None, stream=False, timings=None):
+    """Read the CnD source file *filename* and return the generated C
+    source, as :program:`cnd` does.
+
+    :arg preprocess: if *True*, run the source through the C preprocessor
+        *cpp* with *cpp_options* first. Otherwise, the source is expected
+        to be preprocessed already.
+    :arg generator_settings: a dictionary of attributes to set on the
+        :class:`GnuCGenerator`, such as ``hoist_strides`` or
+        ``bounds_check``.
+    :arg outf: if given, a file-like object to which the generated source
+        is written as it is generated, in which case *None* is returned.
+    :arg stream: if *True*, parsing and code generation are interleaved
+        (see :func:`stream_translation`), which bounds memory use for large
+        files. Requires *outf*.
+    :arg timings: a :class:`PhaseTimings` instance to which the phases of
+        the translation are added.
+    """
+    if cpp_options is None:
+        cpp_options = []
+    if generator_settings is None:
+        generator_settings = {}
+    if timings is None:
+        timings = _NoPhaseTimings()
+
+    src = _read_source_file(filename, preprocess, cpp, cpp_options, timings)
+
+    with timings.phase("parser"):
+        parser = get_parser(GnuCndParser)
+
+    generator = GnuCGenerator()
+    for name, value in generator_settings.items():
+        setattr(generator, name, value)
+
+    if stream:
+        if outf is None:
+            raise ValueError("streaming translation requires outf")
+
+        # parse and generate
+        with timings.phase("stream"):
+            stream_translation(parser, generator, src, filename, outf)
+        return None
+
+    with timings.phase("parse"):
+        verbatim_prefix, ast = parse_with_header_snapshot(parser, src, filename)
+
+    with timings.phase("generate"):
+        location = get_location_after(verbatim_prefix)
+        if outf is not None:
+            outf.write(verbatim_prefix)
+            generator.write_file_ast(ast, outf, location)
+            return None
+        else:
+            return verbatim_prefix + "".join(
+                    generator.iter_file_ast(ast, location))
+
+
+def _write_translated_file(out_file, args, stream, timings):
+    """Translate as ``translate_file(*args)`` does, writing the result to
+    the file named *out_file*.
+
+    The result is first written to a temporary file next to *out_file*,
+    which then replaces it, so that other processes (such as a parallel
+    ``make``) never see *out_file* partially written. On failure, the
+    temporary file is removed, and *out_file* is left as it was.
+    """
+    import os
+    from binascii import hexlify
+
+    # Unlike with mkstemp, the file's permissions are subject to the umask,
+    # as for any other output file.
+    temp_path = "%s.%s.tmp" % (out_file, hexlify(os.urandom(6)).decode())
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+
+    success = False
+    try:
+        outf = os.fdopen(fd, "wt")
+        try:
+            if stream:
+                translate_file(*args, outf=outf, stream=True, timings=timings)
+            else:
+                outf.write(translate_file(*args, timings=timings))
+        finally:
+            outf.close()
+
+        try:
+            os.rename(temp_path, out_file)
+        except OSError:
+            # on Windows, rename fails if the target exists
+            if not os.path.exists(out_file):
+                raise
+            os.unlink(out_file)
+            os.rename(temp_path, out_file)
+
+        success = True
+    finally:
+        if not success:
+            os.unlink(temp_path)
+
+
+def _translate_file_noraise(job):
+    args, out_file, stream = job
+
+    timings = make_phase_timings("cnd", args[0])
+    try:
+        if out_file is None:
+            result = translate_file(*args, timings=timings), None
+        else:
+            _write_translated_file(out_file, args, stream, timings)
+            result = out_file, None
+    except Exception as e:
+        result = None, "%s: %s" % (type(e).__name__, e)
+
+    return result + (timings.as_dict(),)
+
+
+def translate_many(filenames, preprocess=False, cpp=None, cpp_options=None,
+        generator_settings=None, output_filenames=None, stream=False,
+        nworkers=None):
+    """Translate the CnD source files *filenames*, as :func:`translate_file`
+    does with the same arguments, in up to *nworkers* worker processes,
+    defaulting to :func:`get_worker_count`. Pass ``nworkers=1`` to
+    translate all files in the calling process.
+
+    If *output_filenames* is given, the generated source for each file is
+    written to the corresponding file in that list (which is removed again
+    on failure), streaming it if *stream* is *True*, instead of being
+    returned.
+
+    :returns: a list of tuples *(result, error_message, timings)*, in the
+        order of *filenames*, in which exactly one of the first two entries
+        is *None*. *result* is the generated source or the name of the file
+        it was written to. *timings* is as described for
+        :func:`translate_source_files`.
+    """
+    if output_filenames is None:
+        output_filenames = [None] * len(filenames)
+
+    return _run_translation_jobs(_translate_file_noraise, [
+        ((filename, preprocess, cpp, cpp_options, generator_settings),
+            out_file, stream)
+        for filename, out_file in zip(filenames, output_filenames)],
+        nworkers)
+
+
+def get_output_filename(in_file, output_dir=None, output_pattern=None):
+    """Return the name of the file to which :program:`cnd` writes the
+    translation of *in_file*.
+
+    If *output_pattern* is given, it is filled in with the ``%``
+    operator, with the keys ``dir`` (the directory of *in_file*), ``name``
+    (its file name), ``base`` (its file name without the extension) and
+    ``ext`` (the extension, including the dot). The result is then
+    placed in *output_dir*, if given. Otherwise, the path of *in_file*
+    (relative to the current directory) is placed in *output_dir*, or
+    just its file name, if it lies outside the current directory.
+    """
+    import os
+    from os.path import (
+            basename, dirname, join, splitext, normpath, relpath, isabs)
+
+    if output_pattern is not None:
+        name = basename(in_file)
+        base, ext = splitext(name)
+        result = output_pattern % dict(
+                dir=dirname(in_file) or ".",
+                name=name, base=base, ext=ext)
+    else:
+        result = normpath(in_file)
+        if isabs(result):
+            result = relpath(result)
+        if result.split(os.sep)[0] == os.pardir:
+            result = basename(result)
+
+    if output_dir is not None:
+        result = join(output_dir, result)
+
+    return result
+
+
+def run_standalone():
+    import os
+    from optparse import OptionParser
+
+    parser = OptionParser("usage: %prog [options] source.c...")
+    parser.add_option("-o", "--output",
+            help="write output to FILE (default stdout)", metavar="FILE")
+    parser.add_option("-d", "--output-dir", metavar="DIR",
+            help="write output for each source file to DIR, under the "
+            "source file's path relative to the current directory")
+    parser.add_option("--output-pattern", metavar="PATTERN",
+            help="write output for each source file to PATTERN, in which "
+            "%(dir)s, %(name)s, %(base)s and %(ext)s stand for the source "
+            "file's directory, name, name without extension and extension "
+            "(relative to --output-dir, if given)")
+    parser.add_option("-j", "--jobs", type="int", metavar="N",
+            help="translate up to N source files concurrently "
+            "(default: CND_JOBS or the number of CPUs)")
+    parser.add_option("-E", "--preprocess", action="store_true")
+    parser.add_option("-I", "--include", action="append",
+            help="include path, passed on to C preprocessor", metavar="PATH")
+    parser.add_option("-D", "--define", action="append",
+            help="C macro definition, passed on to C preprocessor",
+            metavar="NAME[=VALUE]")
+    parser.add_option("--cpp",
+            help="C preprocessor to use", metavar="COMMAND")
+    parser.add_option("--ast", action="store_true", help="print syntax tree, quit")
+    parser.add_option("--stream", action="store_true",
+            help="write each top-level declaration as soon as it has been "
+            "parsed, to bound memory use on large sources")
+    parser.add_option("--hoist-strides", action="store_true",
+            help="compute axis strides once per dimension declaration")
+    parser.add_option("--strength-reduce", action="store_true",
+            help="in counted loops, advance array offsets along with the "
+            "loop variable instead of recomputing them")
+    parser.add_option("--bounds-check", action="store_const", const="hoisted",
+            dest="bounds_check",
+            help="check array indices against declared bounds, "
+            "once before each loop where possible")
+    parser.add_option("--naive-bounds-check", action="store_const",
+            const="naive", dest="bounds_check",
+            help="check array indices against declared bounds "
+            "at every access")
+    parser.add_option("--line-directives", metavar="GRANULARITY",
+            choices=LINE_DIRECTIVE_GRANULARITIES, default="minimal",
+            help="where to emit #line directives: off, function, "
+            "minimal (where needed, the default) or statement")
+    parser.add_option("--timings", action="store_true",
+            help="print time and memory use of each phase to stderr")
+    parser.add_option("--timings-file", metavar="FILE",
+            help="append time and memory use of each phase to FILE, as JSON")
+    parser.add_option("--daemon", action="store_true",
+            help="serve translation requests on the socket given by "
+            "CND_DAEMON_SOCKET, quit")
+
+    (options, args) = parser.parse_args()
+
+    if options.daemon:
+        run_daemon_from_command_line()
+        return
+
+    if not args:
+        parser.print_help()
+        sys.exit(1)
+
+    # pass on to worker processes
+    if options.timings:
+        os.environ["CND_TIMINGS"] = "1"
+    if options.timings_file:
+        os.environ["CND_TIMINGS_FILE"] = options.timings_file
+
+    cpp_options = []
+    #cpp_options = ["-P"]
+    if options.include:
+        for inc_dir in options.include:
+            cpp_options.extend(["-I", inc_dir])
+
+    if options.define:
+        for define in options.define:
+            cpp_options.extend(["-D", define])
+
+    generator_settings = dict(
+            hoist_strides=bool(options.hoist_strides),
+            strength_reduce=bool(options.strength_reduce),
+            bounds_check=options.bounds_check,
+            line_directives=get_line_directives_setting(options.line_directives),
+            )
+
+    if (len(args) > 1 or options.output_dir is not None
+            or options.output_pattern is not None):
+        if options.output is not None or options.ast:
+            parser.error("-o and --ast take a single source file "
+                    "and no --output-dir or --output-pattern")
+
+        sys.exit(_run_standalone_batch(args, options, cpp_options,
+            generator_settings))
+
+    in_file = args[0]
+    timings = make_phase_timings("cnd", in_file)
+
+    if options.ast:
+        src = _read_source_file(in_file, options.preprocess, options.cpp,
+                cpp_options, timings)
+        ast = get_parser(GnuCndParser).parse(src, filename=in_file)
+        ast.show()
+        return
+
+    if options.output is not None:
+        _write_translated_file(options.output,
+                (in_file, options.preprocess, options.cpp, cpp_options,
+                    generator_settings),
+                bool(options.stream), timings)
+    else:
+        translate_file(in_file, options.preprocess, options.cpp,
+                cpp_options, generator_settings, outf=sys.stdout,
+                stream=bool(options.stream), timings=timings)
+
+    report_phase_timings(timings.as_dict())
+
+
+def _run_standalone_batch(in_files, options, cpp_options, generator_settings):
+    """Translate *in_files* for :func:`run_standalone`, write the results
+    to the files given by :func:`get_output_filename`, and return the exit
+    status.
+    """
+    import os
+    from os.path import abspath, dirname, isdir
+
+    out_files = [
+            get_output_filename(in_file, options.output_dir,
+                options.output_pattern)
+            for in_file in in_files]
+
+    in_file_set = set(abspath(in_file) for in_file in in_files)
+    seen_out_files = set()
+    for in_file, out_file in zip(in_files, out_files):
+        out_file = abspath(out_file)
+        if out_file in in_file_set:
+            print("%s: refusing to overwrite source file '%s'"
+                    % (sys.argv[0], out_file), file=sys.stderr)
+            return 1
+        if out_file in seen_out_files:
+            print("%s: more than one source file would be written to '%s'"
+                    % (sys.argv[0], out_file), file=sys.stderr)
+            return 1
+        seen_out_files.add(out_file)
+
+    for out_file in out_files:
+        out_dir = dirname(out_file)
+        if out_dir and not isdir(out_dir):
+            os.makedirs(out_dir)
+
+    results = translate_many(in_files, options.preprocess, options.cpp,
+            cpp_options, generator_settings, output_filenames=out_files,
+            stream=bool(options.stream), nworkers=options.jobs)
+
+    status = 0
+    for in_file, (result, error, timings) in zip(in_files, results):
+        report_phase_timings(timings)
+
+        if error is not None:
+            print("%s: translating '%s' failed: %s"
+                    % (sys.argv[0], in_file, error), file=sys.stderr)
+            status = 1
+
+    return status
+
+
+def parse_size(s):
+    """Parse a size in bytes with an optional suffix ``K``, ``M`` or ``G``
+    (powers of 1024), such as ``512M``.
+    """
+    s = s.strip().upper()
+    for suffix, factor in [("K", 1024), ("M", 1024**2), ("G", 1024**3)]:
+        if s.endswith(suffix):
+            return int(float(s[:-1]) * factor)
+
+    return int(s)
+
+
+_CC_TRANSLATION_CACHE = None
+
+
+def get_cc_translation_cache():
+    """Return the :class:`TranslationCache` used by
+    :func:`translate_source_file` (and hence by :program:`cndcc`), or *None*
+    if on-disk caching is disabled (see :func:`get_cache_dir`).
+
+    Its disk tier is limited to the size given by the environment variable
+    :envvar:`CND_CACHE_MAX_SIZE` (see :func:`parse_size`), 1G by default.
+    """
+    global _CC_TRANSLATION_CACHE
+
+    if _CC_TRANSLATION_CACHE is None:
+        cache_dir = get_cache_dir("cc")
+        if cache_dir is None:
+            return None
+
+        import os
+        _CC_TRANSLATION_CACHE = TranslationCache(
+                max_memory_entries=16,
+                disk_dir=cache_dir,
+                max_disk_bytes=parse_size(
+                    os.environ.get("CND_CACHE_MAX_SIZE", "1G")))
+
+    return _CC_TRANSLATION_CACHE
+
+
+def print_cc_cache_stats():
+    cache = get_cc_translation_cache()
+    if cache is None:
+        print("cache disabled")
+        return
+
+    stats = cache.get_disk_stats()
+    lookups = stats["disk_hits"] + stats["misses"]
+    if lookups:
+        hit_rate = "%.1f %%" % (100*stats["disk_hits"]/lookups)
+    else:
+        hit_rate = "n/a"
+
+    print("cache directory     %s" % cache.disk_dir)
+    print("cache hits          %d" % stats["disk_hits"])
+    print("cache misses        %d" % stats["misses"])
+    print("cache hit rate      %s" % hit_rate)
+    print("evicted files       %d" % stats["disk_evictions"])
+    print("pass-through files  %d" % stats.get("passthrough", 0))
+    print("files in cache      %d" % stats["files"])
+    print("cache size          %.1f MB" % (stats["bytes"]/1024**2))
+    print("max cache size      %.1f MB" % (cache.max_disk_bytes/1024**2))
+
+
+# {{{ header snapshots
+
+_LINE_MARKER_RE = None
+_NON_BLANK_RE = None
+
+
+def _compile_line_marker_res():
+    global _LINE_MARKER_RE
+    global _NON_BLANK_RE
+
+    if _LINE_MARKER_RE is None:
+        import re
+        _LINE_MARKER_RE = re.compile(
+                r'^\#[ \t]*(?:line[ \t]+)?(?P<line>[0-9]+)[ \t]+'
+                r'"(?P<file>(?:[^"\\\n]|\\.)*)"(?P<flags>[^\n]*)\n?',
+                re.MULTILINE)
+        _NON_BLANK_RE = re.compile(r"\S")
+
+
+def split_header_prefix(src, filename):
+    """Find the code from included files at the start of the preprocessed
+    source *src*, whose main file is *filename*.
+
+    :returns: a tuple ``(prefix_end, main_start)`` such that
+        ``src[:prefix_end]`` contains no code from *filename* and
+        ``src[main_start:]`` begins with the line marker (included in both)
+        that returns to *filename* for good. Returns *None* if there is no
+        such code.
+    """
+    _compile_line_marker_res()
+
+    current_file = None
+    segment_start = 0
+    main_start = None
+    prefix_end = None
+    had_header_code = False
+
+    for match in _LINE_MARKER_RE.finditer(src):
+        if _NON_BLANK_RE.search(src, segment_start, match.start()):
+            if current_file == filename:
+                break
+            elif current_file is not None:
+                had_header_code = True
+
+        current_file = match.group("file")
+        segment_start = match.end()
+        if current_file == filename:
+            main_start = match.start()
+            prefix_end = match.end()
+    else:
+        if not (current_file == filename
+                and _NON_BLANK_RE.search(src, segment_start)):
+            return None
+
+    if main_start is None or not had_header_code:
+        return None
+
+    return prefix_end, main_start
+
+
+def get_location_after(code):
+    """If the preprocessed code *code* ends with a line marker, return the
+    source location, as a tuple ``(file, line)``, that the marker assigns
+    to the line following *code*. Otherwise, return *None*.
+    """
+    _compile_line_marker_res()
+
+    if not code.endswith("\n"):
+        return None
+
+    match = _LINE_MARKER_RE.match(code, code.rfind("\n", 0, -1) + 1)
+    if match is None or match.end() != len(code):
+        return None
+
+    return match.group("file"), int(match.group("line"))
+
+
+_HEADER_TYPEDEF_CACHE = None
+
+
+def get_header_typedef_cache():
+    """Return the :class:`TranslationCache` holding the names of the types
+    defined by header prefixes (see :func:`split_header_prefix`), one per
+    line. Nothing reports on this cache, so it keeps no statistics.
+    """
+    global _HEADER_TYPEDEF_CACHE
+
+    if _HEADER_TYPEDEF_CACHE is None:
+        _HEADER_TYPEDEF_CACHE = TranslationCache(
+                max_memory_entries=16,
+                disk_dir=get_cache_dir("headers"),
+                max_disk_bytes=64*1024**2,
+                record_disk_stats=False)
+
+        if _HEADER_TYPEDEF_CACHE.disk_dir is not None:
+            # left behind by versions that did keep statistics
+            _HEADER_TYPEDEF_CACHE.zero_disk_stats()
+
+    return _HEADER_TYPEDEF_CACHE
+
+
+def get_header_snapshot(parser, src, filename):
+    """If *src* (see :func:`parse_with_header_snapshot`) begins with code
+    from included files that contains no CnD constructs, return a tuple
+    ``(prefix_end, main_start, typedef_names)``, where ``src[:prefix_end]``
+    is to be emitted as is, ``src[main_start:]`` remains to be parsed, and
+    *typedef_names* is the set of type names defined by the code in between.
+    Otherwise, return *None*.
+    """
+    split = split_header_prefix(src, filename)
+    if split is None:
+        return None
+
+    prefix_end, main_start = split
+    prefix = src[:main_start]
+    if needs_translation(prefix):
+        return None
+
+    cache = get_header_typedef_cache()
+    cache_key = cache.make_key("typedefs", get_translator_fingerprint(),
+            type(parser).__name__, prefix)
+
+    typedef_names = cache.get(cache_key)
+    if typedef_names is None:
+        parser.parse(prefix, filename=filename)
+        typedef_names = "\n".join(sorted(
+            name for name, is_type in parser._scope_stack[0].items()
+            if is_type))
+        cache.put(cache_key, typedef_names)
+
+    return prefix_end, main_start, set(typedef_names.split())
+
+
+def parse_with_header_snapshot(parser, src, filename):
+    """Parse the preprocessed source *src*, whose main file is *filename*.
+    If *src* begins with code from included files that contains no CnD
+    constructs, that code is only parsed the first time it is seen, to find
+    the names of the types it defines.
+
+    :returns: a tuple ``(verbatim_prefix, ast)``, where *ast* does not
+        contain the declarations in *verbatim_prefix*, which is to be
+        emitted as is, ahead of the code generated from *ast*.
+    """
+    snapshot = get_header_snapshot(parser, src, filename)
+    if snapshot is None:
+        return "", parser.parse(src, filename=filename)
+
+    prefix_end, main_start, typedef_names = snapshot
+    ast = parser.parse(src[main_start:], filename=filename,
+            initial_type_symbols=typedef_names)
+
+    return src[:prefix_end], ast
+
+
+def stream_translation(parser, generator, src, filename, outf):
+    """Parse the preprocessed source *src* (see
+    :func:`parse_with_header_snapshot`) and write the code generated from
+    it by *generator* to the file-like object *outf*. Each top-level
+    declaration is written as soon as it has been parsed, and then
+    discarded, so that the syntax tree and the generated code for the
+    whole file never need to be in memory at once.
+    """
+    snapshot = get_header_snapshot(parser, src, filename)
+    if snapshot is None:
+        main_src = src
+        typedef_names = set()
+        location = None
+    else:
+        prefix_end, main_start, typedef_names = snapshot
+        prefix = src[:prefix_end]
+        outf.write(prefix)
+        location = get_location_after(prefix)
+        main_src = src[main_start:]
+        del prefix
+
+    # may be the last reference
+    del src
+
+    outf.write(generator.get_prelude(location))
+
+    def handle_external_declaration(exts):
+        for ext in exts:
+            outf.write(generator.visit_external(ext))
+
+    parser.parse_streaming(main_src, filename, handle_external_declaration,
+            initial_type_symbols=typedef_names)
+
+# }}}
+
+
+# {{{ dependency files
+
+def get_included_files(src, filename):
+    """Find the files that were included into the preprocessed source *src*,
+    whose main file is *filename*, from its line markers.
+
+    :returns: a list of tuples ``(included_filename, is_system_header)``, in
+        the order in which the files were first included. *filename* itself
+        and the preprocessor's pseudo-files (such as ``<built-in>``) are not
+        part of the list.
+    """
+    _compile_line_marker_res()
+
+    import re
+    unescape_re = re.compile(r"\\(.)")
+
+    result = []
+    seen = set([filename])
+    for match in _LINE_MARKER_RE.finditer(src):
+        flags = match.group("flags").split()
+        if "1" not in flags:
+            # not entering an included file
+            continue
+
+        included_filename = unescape_re.sub(r"\1", match.group("file"))
+        if (included_filename in seen
+                or (included_filename.startswith("<")
+                    and included_filename.endswith(">"))):
+            continue
+
+        seen.add(included_filename)
+        result.append((included_filename, "3" in flags))
+
+    return result
+
+
+def _escape_make_name(name):
+    return (name
+            .replace("$", "$$")
+            .replace("#", "\\#")
+            .replace(" ", "\\ ")
+            .replace("\t", "\\\t"))
+
+
+def format_make_dependencies(targets, prerequisites, phony_targets=False):
+    """Return a :program:`make` rule stating that *targets* (a list of
+    strings, used as they are) depend on the files named in *prerequisites*.
+    If *phony_targets* is *True*, an empty rule is added for each
+    prerequisite but the first, as with the ``-MP`` option of :program:`gcc`,
+    so that :program:`make` does not fail when a header is removed.
+    """
+    prerequisites = [_escape_make_name(name) for name in prerequisites]
+
+    lines = ["%s: %s" % (" ".join(targets), " \\\n  ".join(prerequisites))]
+    if phony_targets:
+        lines.extend("\n%s:" % name for name in prerequisites[1:])
+
+    return "\n".join(lines) + "\n"
+
+
+class DependencyOptions(object):
+    """The dependency file options (``-M``, ``-MM``, ``-MD``, ``-MMD``,
+    ``-MF``, ``-MT``, ``-MQ`` and ``-MP``) of a :program:`gcc`-like compiler
+    command line. The compiler is not given these options by ``cndcc``,
+    since it only sees the translated sources, in which all headers have
+    already been expanded. Instead, the dependencies are found by
+    :func:`get_included_files` on the output of ``cndcc``'s own
+    preprocessor run.
+
+    .. attribute:: mode
+
+        One of *None*, ``"M"``, ``"MM"``, ``"MD"`` and ``"MMD"``.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.dep_file = None
+        self.targets = []
+        self.phony_targets = False
+
+    def parse_option(self, arg, get_option_argument):
+        """If *arg* is a dependency file option, record it and return *True*.
+        *get_option_argument* is called to obtain the option's argument if
+        it is not part of *arg*.
+        """
+        if arg in ["-M", "-MM", "-MD", "-MMD"]:
+            self.mode = arg[1:]
+        elif arg == "-MP":
+            self.phony_targets = True
+        elif arg.startswith("-MF"):
+            self.dep_file = arg[3:] or get_option_argument()
+        elif arg.startswith("-MT"):
+            self.targets.append(arg[3:] or get_option_argument())
+        elif arg.startswith("-MQ"):
+            self.targets.append(
+                    _escape_make_name(arg[3:] or get_option_argument()))
+        else:
+            return False
+
+        return True
+
+    @property
+    def only_dependencies(self):
+        """Whether the dependencies take the place of the compiler's usual
+        output, as with ``-M`` and ``-MM``.
+        """
+        return self.mode in ["M", "MM"]
+
+    @property
+    def system_headers(self):
+        return self.mode in ["M", "MD"]
+
+    def get_dep_filename(self, filename, output_file, to_object_file):
+        """Return the name of the file to which the dependencies of the
+        source file *filename* are to be written, or *None* for standard
+        output.
+        """
+        import os
+
+        if self.dep_file is not None:
+            return self.dep_file
+        elif self.only_dependencies:
+            return output_file
+        elif to_object_file and output_file is not None:
+            return os.path.splitext(output_file)[0] + ".d"
+        else:
+            return os.path.splitext(os.path.basename(filename))[0] + ".d"
+
+    def format(self, filename, included_files, output_file, to_object_file):
+        """Return the dependencies of the source file *filename*, given the
+        result of :func:`get_included_files` for it, as a :program:`make`
+        rule.
+        """
+        import os
+
+        if self.targets:
+            targets = self.targets
+        elif to_object_file and output_file is not None \
+                and not self.only_dependencies:
+            targets = [_escape_make_name(output_file)]
+        else:
+            targets = [_escape_make_name(
+                os.path.splitext(os.path.basename(filename))[0] + ".o")]
+
+        return format_make_dependencies(targets,
+                [filename] + [
+                    included_filename
+                    for included_filename, is_system_header in included_files
+                    if self.system_headers or not is_system_header],
+                self.phony_targets)
+
+
+def write_dependency_files(dep_options, sources, output_file, to_object_file):
+    """Write the dependencies of the source files given by *sources*, a list
+    of tuples ``(filename, included_files)`` (see :func:`get_included_files`),
+    as specified by the :class:`DependencyOptions` *dep_options*. Rules for
+    sources that share a dependency file are written to it in order.
+    """
+    import sys
 
-                if result is None:
-                    raise SyntaxError("no value available for '%s' at %s" % (
-                        self.generator_base_class.visit_FuncCall(self, n), n.coord))
+    dep_filenames = []
+    dep_file_contents = {}
 
-                return self.visit(result)
+    for filename, included_files in sources:
+        dep_filename = dep_options.get_dep_filename(
+                filename, output_file, to_object_file)
+        if dep_filename not in dep_file_contents:
+            dep_filenames.append(dep_filename)
+            dep_file_contents[dep_filename] = []
 
-        return self.generator_base_class.visit_FuncCall(self, n)
+        dep_file_contents[dep_filename].append(dep_options.format(
+            filename, included_files, output_file, to_object_file))
 
+    for dep_filename in dep_filenames:
+        contents = "".join(dep_file_contents[dep_filename])
 
-class GnuCGenerator(CndGeneratorMixin, GnuCGeneratorBase):
-    generator_base_class = GnuCGeneratorBase
+        if dep_filename is None:
+            sys.stdout.write(contents)
+            sys.stdout.flush()
+        else:
+            with open(dep_filename, "w") as outf:
+                outf.write(contents)
 
-    def __init__(self):
-        GnuCGeneratorBase.__init__(self)
-        CndGeneratorMixin.__init__(self)
 
+def write_dependencies_only(dep_options, jobs, output_file):
+    """Preprocess the source files given by *jobs*, a list of argument
+    tuples for :func:`translate_source_file`, and write their dependencies
+    (as with ``-M`` or ``-MM``), without translating them.
+    """
+    import sys
 
-class OpenCLCGenerator(CndGeneratorMixin, OpenCLCGeneratorBase):
-    generator_base_class = OpenCLCGeneratorBase
+    sources = []
+    for job in jobs:
+        filename, cpp_options, cpp = job[:3]
 
-    def __init__(self):
-        OpenCLCGeneratorBase.__init__(self)
-        CndGeneratorMixin.__init__(self)
+        timings = make_phase_timings("cndcc", filename)
+        try:
+            src = _read_source_file(filename, True, cpp, cpp_options, timings)
+        except Exception as e:
+            print("%s: preprocessing '%s' failed: %s: %s"
+                    % (sys.argv[0], filename, type(e).__name__, e),
+                    file=sys.stderr)
+            sys.exit(1)
 
-# }}}
+        with timings.phase("deps"):
+            sources.append((filename, get_included_files(src, filename)))
+        del src
 
+        report_phase_timings(timings.as_dict())
 
-# {{{ run helpers
+    write_dependency_files(dep_options, sources, output_file, False)
 
-class ExecError(RuntimeError):
-    pass
+# }}}
 
 
-def call_capture_output(cmdline, cwd=None, error_on_nonzero=True):
-    """
-    :returns: a tuple (return code, stdout_data, stderr_data).
+def get_cc_generator_settings():
+    """Return a dictionary of generator attributes for use by ``cndcc``,
+    as specified by environment variables. Setting
+    :envvar:`CND_HOIST_STRIDES` to a nonzero value turns on hoisting of
+    axis strides into locals, and :envvar:`CND_STRENGTH_REDUCE` turns on
+    running array offsets in counted loops. :envvar:`CND_BOUNDS_CHECK` may
+    be set to
+    ``naive`` or ``hoisted`` (or ``1``, the same) to turn on bounds
+    checking. :envvar:`CND_LINE_DIRECTIVES` may be set to one of
+    :data:`LINE_DIRECTIVE_GRANULARITIES`.
     """
-    from subprocess import Popen, PIPE
-    try:
-        popen = Popen(cmdline, cwd=cwd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdout_data, stderr_data = popen.communicate()
-        if error_on_nonzero and popen.returncode:
-            raise ExecError("status %d invoking '%s': %s"
-                    % (popen.returncode, " ".join(cmdline), stderr_data))
-        return popen.returncode, stdout_data, stderr_data
-    except OSError as e:
-        raise ExecError("error invoking '%s': %s"
-                % (" ".join(cmdline), e))
-
+    import os
 
-class CompileError(RuntimeError):
-    def __init__(self, msg, command_line, stdout=None, stderr=None):
-        self.msg = msg
-        self.command_line = command_line
-        self.stdout = stdout
-        self.stderr = stderr
+    line_directives = os.environ.get("CND_LINE_DIRECTIVES", "minimal")
+    if line_directives not in LINE_DIRECTIVE_GRANULARITIES:
+        raise ValueError("invalid value of CND_LINE_DIRECTIVES: '%s'"
+                % line_directives)
+
+    bounds_check = os.environ.get("CND_BOUNDS_CHECK", "0")
+    if bounds_check in ["", "0"]:
+        bounds_check = None
+    elif bounds_check in ["1", "hoisted"]:
+        bounds_check = "hoisted"
+    elif bounds_check != "naive":
+        raise ValueError("invalid value of CND_BOUNDS_CHECK: '%s'"
+                % bounds_check)
+
+    return dict(
+            hoist_strides=os.environ.get("CND_HOIST_STRIDES", "0") not in ["", "0"],
+            strength_reduce=os.environ.get(
+                "CND_STRENGTH_REDUCE", "0") not in ["", "0"],
+            bounds_check=bounds_check,
+            line_directives=get_line_directives_setting(line_directives),
+            )
+
+
+def translate_source_file(filename, cpp_options, cpp=None,
+        allow_passthrough=False, timings=None, outf=None, dependencies=None):
+    """Read the CnD source file *filename*, run it through the C
+    preprocessor with *cpp_options* and return the generated C source.
+
+    If *allow_passthrough* is *True* and the file contains no CnD constructs
+    (see :func:`needs_translation`), return *None* to indicate that the
+    original file may be compiled as is.
+
+    If *outf* is given, the generated source is instead written to that
+    file-like object as it is generated (see :func:`stream_translation`),
+    bypassing the translation cache, and *outf* is returned.
+
+    If *timings* is given, it should be a :class:`PhaseTimings` instance,
+    to which the phases of the translation are added.
+
+    If *dependencies* is a list, the files included by the source file are
+    appended to it, as returned by :func:`get_included_files`.
+    """
+    if timings is None:
+        timings = _NoPhaseTimings()
 
-    def __str__(self):
-        result = self.msg
-        if self.command_line:
-            try:
-                result += "\n[command: %s]" % (" ".join(self.command_line))
-            except Exception as e:
-                print(e)
-        if self.stdout:
-            result += "\n[stdout:\n%s]" % self.stdout
-        if self.stderr:
-            result += "\n[stderr:\n%s]" % self.stderr
+    with timings.phase("read"):
+        src = open(filename, "rt").read()
+        src = insert_parens_in_brackets(filename, src)
 
-        return result
+    extra_lines = PREAMBLE + [
+        "# 1 \"%s\"" % filename,
+        ]
+    src = "\n".join(extra_lines) + "\n" + src
 
+    #cpp_options.append("-P")
 
-def write_temp_file(contents, suffix):
-    from tempfile import mkstemp
-    handle, path = mkstemp(suffix='.c')
+    with timings.phase("cpp", subprocess=True):
+        src = preprocess_source(src, cpp, cpp_options)
 
-    import os
+    #print "preprocessed source in ", write_temp_file(src, ".c")
 
-    try:
-        outf = open(path, 'w')
-        try:
-            outf.write(contents)
-        finally:
-            outf.close()
-    finally:
-        os.close(handle)
+    if dependencies is not None:
+        with timings.phase("deps"):
+            dependencies.extend(get_included_files(src, filename))
 
-    return path
+    if allow_passthrough:
+        with timings.phase("scan"):
+            if not needs_translation(src):
+                timings.count("passthrough")
+                return None
 
+    generator_settings = get_cc_generator_settings()
 
-def preprocess_source(source, cpp, options):
-    import os
-    if cpp is None:
-        cpp = os.environ.get("CND_CPP")
-    if cpp is None:
-        cpp = os.environ.get("CPP")
-    if cpp is None:
-        import sys
-        if sys.platform.startswith("darwin"):
-            cpp = "gcc -E"
-        else:
-            cpp = "cpp"
+    if outf is not None:
+        with timings.phase("parser"):
+            parser = get_parser(GnuCndParser)
 
-    cpp = cpp.split()
+        generator = GnuCGenerator()
+        for name, value in generator_settings.items():
+            setattr(generator, name, value)
 
-    from tempfile import mkstemp
-    handle, source_path = mkstemp(suffix='.c')
+        # parse and generate
+        with timings.phase("stream"):
+            stream_translation(parser, generator, src, filename, outf)
 
-    source_path = write_temp_file(source, ".c")
-    try:
-        cmdline = cpp + options + [source_path]
+        return outf
 
-        result, stdout, stderr = call_capture_output(cmdline, error_on_nonzero=False)
+    cache = get_cc_translation_cache()
+    if cache is not None:
+        with timings.phase("cache"):
+            cache_key = cache.make_key(
+                    "cndcc", get_translator_fingerprint(), filename,
+                    sorted(generator_settings.items()), src)
+            result = cache.get(cache_key)
+        if result is not None:
+            return result
 
-        if result != 0:
-            raise CompileError("preprocessing of %s failed" % source_path,
-                               cmdline, stderr=stderr)
-    finally:
-        pass
-        #os.unlink(source_path)
+    with timings.phase("parser"):
+        parser = get_parser(GnuCndParser)
 
-    return stdout
+    with timings.phase("parse"):
+        verbatim_prefix, ast = parse_with_header_snapshot(parser, src, filename)
 
+    with timings.phase("generate"):
+        generator = GnuCGenerator()
+        for name, value in generator_settings.items():
+            setattr(generator, name, value)
 
-PREAMBLE = [
-        CND_HELPERS,
-        "#define __extension__ /*empty*/",  # FIXME
-        ]
+        result = verbatim_prefix + "".join(generator.iter_file_ast(
+            ast, get_location_after(verbatim_prefix)))
 
+    if cache is not None:
+        cache.put(cache_key, result)
 
-def run_standalone():
-    from optparse import OptionParser
+    return result
 
-    parser = OptionParser("usage: %prog [options] source.c")
-    parser.add_option("-o", "--output",
-            help="write output to FILE (default stdout)", metavar="FILE")
-    parser.add_option("-E", "--preprocess", action="store_true")
-    parser.add_option("-I", "--include", action="append",
-            help="include path, passed on to C preprocessor", metavar="PATH")
-    parser.add_option("-D", "--define", action="append",
-            help="C macro definition, passed on to C preprocessor",
-            metavar="NAME[=VALUE]")
-    parser.add_option("--cpp",
-            help="C preprocessor to use", metavar="COMMAND")
-    parser.add_option("--ast", action="store_true", help="print syntax tree, quit")
 
-    (options, args) = parser.parse_args()
+def _translate_source_file_noraise(args, dependencies=False):
+    timings = make_phase_timings("cndcc", args[0])
+    included_files = [] if dependencies else None
+    try:
+        result = translate_source_file(*args, timings=timings,
+                dependencies=included_files), None
+    except Exception as e:
+        result = None, "%s: %s" % (type(e).__name__, e)
 
-    if not args:
-        parser.print_help()
-        sys.exit(1)
+    return result + (timings.as_dict(), included_files)
 
-    in_file = args[0]
 
-    src = open(in_file, "rt").read()
-    src = insert_parens_in_brackets(in_file, src)
+def _stream_source_file_noraise(args, dependencies=False):
+    import os
+    from tempfile import mkstemp
 
-    if options.preprocess:
-        extra_lines = PREAMBLE + [
-            "# 1 \"%s\"" % in_file,
-            ]
-        src = "\n".join(extra_lines) + "\n" + src
+    timings = make_phase_timings("cndcc", args[0])
+    included_files = [] if dependencies else None
 
-    if options.preprocess:
-        cpp_options = []
-        #cpp_options = ["-P"]
-        if options.include:
-            for inc_dir in options.include:
-                cpp_options.extend(["-I", inc_dir])
+    handle, path = mkstemp(suffix=".c")
+    try:
+        outf = os.fdopen(handle, "w")
+        try:
+            result = translate_source_file(*args, timings=timings, outf=outf,
+                    dependencies=included_files)
+        finally:
+            outf.close()
+    except Exception as e:
+        os.unlink(path)
+        return (None, "%s: %s" % (type(e).__name__, e), timings.as_dict(),
+                included_files)
+
+    if result is None:
+        os.unlink(path)
+        return None, None, timings.as_dict(), included_files
+    else:
+        return path, None, timings.as_dict(), included_files
 
-        if options.define:
-            for define in options.define:
-                cpp_options.extend(["-D", define])
 
-        src = preprocess_source(src, options.cpp, cpp_options)
+def get_worker_count():
+    """Return the number of worker processes to use for translating
+    multiple files, as given by the environment variable :envvar:`CND_JOBS`,
+    defaulting to the number of CPUs.
+    """
+    import os
+    jobs = os.environ.get("CND_JOBS")
+    if jobs:
+        return max(1, int(jobs))
 
-    #print "preprocessed source in ", write_temp_file(src, ".c")
+    try:
+        from multiprocessing import cpu_count
+        return cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def translate_source_files(jobs, nworkers=None, dependencies=False):
+    """Translate multiple source files concurrently.
+
+    :arg jobs: a list of argument tuples for :func:`translate_source_file`.
+    :arg nworkers: the number of worker processes, defaulting to
+        :func:`get_worker_count`.
+    :arg dependencies: whether to find the files included by each source
+        file.
+    :returns: a list of tuples *(generated_source, error_message,
+        timings, included_files)*, in the order of *jobs*. At least one of
+        the first two entries of each tuple is *None*. Both are *None* for
+        files that need no translation. *timings* is a dictionary as
+        returned by :meth:`PhaseTimings.as_dict`, or *None* if timings are
+        not requested (see :func:`make_phase_timings`). *included_files* is
+        as returned by :func:`get_included_files`, or *None* if
+        *dependencies* is *False*.
+    """
+    from functools import partial
+    return _run_translation_jobs(
+            partial(_translate_source_file_noraise, dependencies=dependencies),
+            jobs, nworkers)
 
-    parser = GnuCndParser()
-    ast = parser.parse(src, filename=in_file)
-    if options.ast:
-        ast.show()
-        return
 
-    generator = GnuCGenerator()
+def _run_translation_jobs(func, jobs, nworkers):
+    if nworkers is None:
+        nworkers = get_worker_count()
+    nworkers = min(nworkers, len(jobs))
 
-    if options.output is not None:
-        outf = open(options.output, "wt")
-    else:
-        outf = sys.stdout
+    if nworkers <= 1:
+        return [func(job) for job in jobs]
 
+    from multiprocessing import Pool
+    pool = Pool(nworkers)
     try:
-        outf.write(generator.visit(ast))
+        return pool.map(func, jobs, chunksize=1)
     finally:
-        if options.output is not None:
-            outf.close()
+        pool.terminate()
+        pool.join()
 
 
 def run_as_compiler_frontend():
     import sys
     import os
 
-    argv = sys.argv[2:]
-    compiler = sys.argv[1]
+    if len(sys.argv) == 2 and sys.argv[1] == "--stats":
+        print_cc_cache_stats()
+        return
+
+    if len(sys.argv) == 2 and sys.argv[1] == "--zero-stats":
+        cache = get_cc_translation_cache()
+        if cache is not None:
+            cache.zero_disk_stats()
+        return
+
+    if len(sys.argv) == 2 and sys.argv[1] == "--daemon":
+        run_daemon_from_command_line()
+        return
+
+    argv = sys.argv[1:]
+    while argv and argv[0].startswith("--timings"):
+        # pass on to worker processes
+        if argv[0] == "--timings":
+            os.environ["CND_TIMINGS"] = "1"
+        elif argv[0].startswith("--timings-file="):
+            os.environ["CND_TIMINGS_FILE"] = argv[0][len("--timings-file="):]
+        else:
+            print("%s: invalid option '%s'" % (sys.argv[0], argv[0]),
+                    file=sys.stderr)
+            sys.exit(1)
+        argv.pop(0)
+
+    if not argv:
+        print("usage: %s [--timings] [--timings-file=FILE] COMPILER ARGS..."
+                % sys.argv[0], file=sys.stderr)
+        sys.exit(1)
+
+    compiler = argv.pop(0)
 
     cpp_options = []
 
@@ -719,34 +4580,29 @@ def run_as_compiler_frontend():
 
     temp_files = []
 
+    # (index in new_argv, translate_source_file arguments)
+    translation_jobs = []
+
     to_object_file = False
     seen_dash_o = False
+    output_file = None
 
-    try:
-        for arg in argv:
-            if arg.endswith(".c") and not arg.startswith("-"):
-                src = open(arg, "rt").read()
-                src = insert_parens_in_brackets(arg, src)
-
-                extra_lines = PREAMBLE + [
-                    "# 1 \"%s\"" % arg,
-                    ]
-                src = "\n".join(extra_lines) + "\n" + src
-
-                #cpp_options.append("-P")
-
-                src = preprocess_source(src, None, cpp_options)
-
-                #print "preprocessed source in ", write_temp_file(src, ".c")
+    dep_options = DependencyOptions()
 
-                parser = GnuCndParser()
-                ast = parser.parse(src, filename=arg)
+    try:
+        argv_iter = iter(argv)
 
-                generator = GnuCGenerator()
+        def get_option_argument():
+            try:
+                return next(argv_iter)
+            except StopIteration:
+                raise RuntimeError("missing argument to '%s'" % arg)
 
-                gen_src_file = write_temp_file(generator.visit(ast), ".c")
-                new_argv.append(gen_src_file)
-                temp_files.append(gen_src_file)
+        for arg in argv_iter:
+            if arg.endswith(".c") and not arg.startswith("-"):
+                translation_jobs.append(
+                        (len(new_argv), (arg, list(cpp_options), None, True)))
+                new_argv.append(None)
 
             elif (arg.startswith("-I")
                     or arg.startswith("-D")
@@ -759,20 +4615,104 @@ def run_as_compiler_frontend():
             elif arg.startswith("-o"):
                 seen_dash_o = True
                 new_argv.append(arg)
+
+                output_file = arg[2:]
+                if not output_file:
+                    output_file = get_option_argument()
+                    new_argv.append(output_file)
+            elif dep_options.parse_option(arg, get_option_argument):
+                # The compiler only sees translated, i.e. already
+                # preprocessed, sources. We write the dependencies instead.
+                pass
             else:
                 new_argv.append(arg)
 
+        if dep_options.only_dependencies:
+            write_dependencies_only(dep_options,
+                    [job for _, job in translation_jobs], output_file)
+            return
+
         if to_object_file and not seen_dash_o:
             raise RuntimeError("-o<NAME> is required with -c")
 
+        want_dependencies = dep_options.mode is not None
+
+        stream = os.environ.get("CND_STREAM", "0") not in ["", "0"]
+        if stream:
+            # results are names of temporary files
+            from functools import partial
+            results = _run_translation_jobs(
+                    partial(_stream_source_file_noraise,
+                        dependencies=want_dependencies),
+                    [job for _, job in translation_jobs], None)
+            temp_files.extend(
+                    gen_src for gen_src, error, timings, included_files
+                    in results
+                    if gen_src is not None)
+        else:
+            results = translate_source_files(
+                    [job for _, job in translation_jobs],
+                    dependencies=want_dependencies)
+
+        for gen_src, error, timings, included_files in results:
+            report_phase_timings(timings)
+
+        # report errors in argument order, independently of scheduling
+        for (argv_index, job), (gen_src, error, timings, included_files) in zip(
+                translation_jobs, results):
+            if error is not None:
+                print("%s: translating '%s' failed: %s"
+                        % (sys.argv[0], job[0], error), file=sys.stderr)
+                sys.exit(1)
+
+        if want_dependencies:
+            write_dependency_files(dep_options, [
+                (job[0], included_files)
+                for (argv_index, job), (gen_src, error, timings, included_files)
+                in zip(translation_jobs, results)],
+                output_file, to_object_file)
+
+        passthrough_count = 0
+        for (argv_index, job), (gen_src, error, timings, included_files) in zip(
+                translation_jobs, results):
+            if gen_src is None:
+                # no CnD constructs, compile the original file
+                new_argv[argv_index] = job[0]
+                passthrough_count += 1
+                continue
+
+            if stream:
+                new_argv[argv_index] = gen_src
+            else:
+                gen_src_file = write_temp_file(gen_src, ".c")
+                new_argv[argv_index] = gen_src_file
+                temp_files.append(gen_src_file)
+
+        if passthrough_count:
+            # These are defined by the preamble for translated files.
+            new_argv[:0] = [
+                    "-DCND_VERSION_MAJOR=%d" % cnd.version.VERSION[0],
+                    "-DCND_VERSION_MINOR=%d" % cnd.version.VERSION[1],
+                    "-DCND_VERSION_TEXT=%s" % cnd.version.VERSION_TEXT,
+                    ]
+
+            # The timing records of these files count them as well, which
+            # also works with the cache disabled.
+            cache = get_cc_translation_cache()
+            if cache is not None:
+                cache.record_disk_stats(passthrough=passthrough_count)
+
         from subprocess import call
+        timings = make_phase_timings("cndcc", None)
         try:
-            retcode = call([compiler] + new_argv)
+            with timings.phase("compile", subprocess=True):
+                retcode = call([compiler] + new_argv)
         except:
             print("%s: compiler execution failed. (Note: compiler " \
                     "command must be the first argument--used '%s')" % (sys.argv[0], compiler), file=sys.stderr)
             sys.exit(1)
         else:
+            report_phase_timings(timings.as_dict())
             sys.exit(retcode)
 
     finally:
@@ -780,14 +4720,262 @@ def run_as_compiler_frontend():
             os.unlink(tempf)
 
 
-def transform_cl(src, filename=None):
-    parser = OpenCLCndParser()
-    ast = parser.parse(src, filename=filename)
+_CL_TRANSLATION_CACHE = TranslationCache()
+
+
+def get_cl_translation_cache():
+    """Return the :class:`TranslationCache` used by :func:`transform_cl`,
+    e.g. to query its statistics.
+    """
+    return _CL_TRANSLATION_CACHE
+
+
+def set_cl_translation_cache(cache):
+    """Replace the :class:`TranslationCache` used by :func:`transform_cl`.
+    To enable the on-disk tier, pass e.g.
+    ``TranslationCache(disk_dir=get_cache_dir("cl"))``. Pass *None* to
+    disable caching.
+    """
+    global _CL_TRANSLATION_CACHE
+    _CL_TRANSLATION_CACHE = cache
+
+
+def transform_cl(src, filename=None, use_cache=True, hoist_strides=False,
+        strength_reduce=False, index_type=None, use_mad24=False):
+    """Translate the (preprocessed) OpenCL source *src*.
+
+    *index_type*, one of :data:`INDEX_TYPES`, selects the integer type in
+    which array offsets are computed; by default, it follows from the
+    types of the indices and axis bounds. With *use_mad24*, offsets are
+    computed with ``mad24`` and ``mul24``, which requires *index_type* to
+    be ``int`` or ``unsigned`` and all indices and axis lengths (and
+    their products) to fit in 24 bits.
+
+    To obtain timings of the translation, see :func:`add_timing_hook`.
+    """
+    generator_settings = dict(
+            line_directives=None,
+            hoist_strides=hoist_strides,
+            strength_reduce=strength_reduce,
+            index_type=index_type,
+            use_mad24=use_mad24,
+            )
+
+    if index_type is not None and index_type not in INDEX_TYPES:
+        raise ValueError("invalid index type: '%s'" % index_type)
+    if use_mad24 and index_type not in _INT24_INDEX_TYPES:
+        raise ValueError("use_mad24 requires an index type of %s"
+                % " or ".join(_INT24_INDEX_TYPES))
+
+    timings = make_phase_timings("transform_cl", filename)
+
+    cache = _CL_TRANSLATION_CACHE
+    if not use_cache:
+        cache = None
+
+    if cache is not None:
+        with timings.phase("cache"):
+            cache_key = cache.make_key(
+                    "transform_cl", get_translator_fingerprint(), filename,
+                    sorted(generator_settings.items()), src)
+            result = cache.get(cache_key)
+        if result is not None:
+            report_phase_timings(timings.as_dict())
+            return result
+
+    with timings.phase("parser"):
+        parser = get_parser(OpenCLCndParser)
+
+    with timings.phase("parse"):
+        ast = parser.parse(src, filename=filename)
+
+    with timings.phase("generate"):
+        generator = OpenCLCGenerator()
+        for name, value in generator_settings.items():
+            setattr(generator, name, value)
+
+        result = generator.visit(ast)
+
+    if cache is not None:
+        cache.put(cache_key, result)
+
+    report_phase_timings(timings.as_dict())
+
+    return result
+
+
+# }}}
+
+
+# {{{ translation daemon
+
+# the file descriptors passed along with a request: stdin, stdout, stderr
+_DAEMON_FDS = 3
+
+# largest request read in one piece, including the client's environment
+_DAEMON_REQUEST_CHUNK = 1 << 16
+
+
+def get_daemon_socket_path():
+    """Return the path of the Unix domain socket on which the translation
+    daemon listens, as given by the environment variable
+    :envvar:`CND_DAEMON_SOCKET`, or *None* if not set.
+    """
+    import os
+    return os.environ.get("CND_DAEMON_SOCKET") or None
+
+
+def _run_daemon_request(sock):
+    """Serve a request from the client connected to *sock*. This runs in
+    a process forked from the daemon, which takes on the client's standard
+    file descriptors, working directory, environment and command line,
+    and then runs the requested tool as if it had been started by the
+    client.
+    """
+    import os
+    import json
+    import socket
+    import array
+
+    fds = array.array("i")
+    msg, ancdata, flags, addr = sock.recvmsg(_DAEMON_REQUEST_CHUNK,
+            socket.CMSG_LEN(_DAEMON_FDS * fds.itemsize))
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if (cmsg_level == socket.SOL_SOCKET
+                and cmsg_type == socket.SCM_RIGHTS):
+            fds.frombytes(cmsg_data[
+                :len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+
+    if not msg and not fds:
+        # a connection just checking whether the daemon is running
+        return
+
+    chunks = [msg]
+    while True:
+        chunk = sock.recv(_DAEMON_REQUEST_CHUNK)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+    if len(fds) != _DAEMON_FDS:
+        raise RuntimeError("daemon request without standard file descriptors")
+
+    request = json.loads(b"".join(chunks).decode("utf-8"))
+
+    for target_fd, fd in enumerate(fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["environ"])
+    sys.argv = request["argv"]
+
+    try:
+        try:
+            _DAEMON_TOOLS[request["tool"]]()
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                status = 1
+        except Exception:
+            from traceback import print_exc
+            print_exc()
+            status = 1
+        else:
+            status = 0
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    sock.sendall(("%d\n" % status).encode("ascii"))
+
+
+def run_daemon(socket_path):
+    """Listen on the Unix domain socket *socket_path* and serve translation
+    requests from the clients in ``bin/cnd`` and ``bin/cndcc`` until
+    interrupted.
+
+    Parsers are constructed before the first request, and each request is
+    served in a process forked from the daemon, so that requests are
+    isolated from each other and may be served concurrently.
+    """
+    import os
+    import socket
+    import signal
+    from six.moves import socketserver
+
+    if not hasattr(socket.socket, "recvmsg"):
+        raise RuntimeError("the translation daemon requires Python 3.3 "
+                "or newer")
+
+    # check for a running daemon, and remove stale sockets
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except socket.error:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    else:
+        raise RuntimeError("a daemon is already listening on '%s'"
+                % socket_path)
+    finally:
+        probe.close()
+
+    # warm up
+    get_parser(GnuCndParser)
+    get_parser(OpenCLCndParser)
+
+    class RequestHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            _run_daemon_request(self.request)
+
+    class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    # only accessible to the current user
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(socket_path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def run_daemon_from_command_line():
+    socket_path = get_daemon_socket_path()
+    if socket_path is None:
+        print("%s: CND_DAEMON_SOCKET must be set to the path of the daemon's "
+                "socket" % sys.argv[0], file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        run_daemon(socket_path)
+    except RuntimeError as e:
+        print("%s: %s" % (sys.argv[0], e), file=sys.stderr)
+        sys.exit(1)
 
-    generator = OpenCLCGenerator()
-    generator.generate_line_directives = False
-    return generator.visit(ast)
 
+_DAEMON_TOOLS = {
+        "cnd": run_standalone,
+        "cndcc": run_as_compiler_frontend,
+        }
 
 # }}}
 
@@ -0,0 +1,285 @@
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import tempfile
+from subprocess import Popen, PIPE
+
+import pytest
+
+import cnd
+
+
+# {{{ helpers
+
+def parse(src, filename="test.c"):
+    src = cnd.insert_parens_in_brackets(filename, src)
+    return cnd.get_parser(cnd.GnuCndParser).parse(src, filename=filename)
+
+
+def generate(src, **settings):
+    generator = cnd.GnuCGenerator()
+    for name, value in settings.items():
+        setattr(generator, name, value)
+
+    return generator.visit(parse(src))
+
+
+def run(code):
+    """Compile the C source *code* with ``$CC`` (default ``cc``) and run
+    it, returning a tuple ``(status, output)``. Skip the test if there is
+    no C compiler.
+    """
+    cc = os.environ.get("CC", "cc")
+    tmpdir = tempfile.mkdtemp(prefix="cnd-test-")
+    try:
+        source = os.path.join(tmpdir, "test.c")
+        executable = os.path.join(tmpdir, "test")
+        with open(source, "w") as outf:
+            outf.write(code)
+
+        try:
+            compiler = Popen([cc, "-std=gnu99", "-o", executable, source],
+                    stdout=PIPE, stderr=PIPE)
+        except OSError:
+            pytest.skip("C compiler '%s' not found" % cc)
+        _, stderr = compiler.communicate()
+        assert compiler.returncode == 0, stderr.decode()
+
+        program = Popen([executable], stdout=PIPE)
+        stdout, _ = program.communicate()
+        return program.returncode, stdout.decode()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+# *g* is a global that bump() changes, *k* a local that bump_ptr(kp)
+# changes through a pointer, and *m* a local whose address is never taken.
+PROGRAM = """
+int printf(const char *format, ...);
+
+int g;
+void bump(void) { ++g; }
+void bump_ptr(int *p) { ++*p; }
+
+int main(void)
+{
+  double storage[10] = { 0 };
+  int n = 10, k = 0, m = 0;
+  int *kp = &k;
+  double s = 0;
+  dimension a[n];
+  dimension b[n - g];
+  double *a = storage, *b = storage;
+
+  %s
+
+  for (int i = 0; i < n; ++i)
+    printf("%%g ", a[i]);
+  printf("%%g\\n", s);
+  return 0;
+}
+"""
+
+# }}}
+
+
+@pytest.mark.parametrize(("body", "reduced"), [
+    # global, changed by a call
+    ("for (int i = 0; i < 5; ++i) { a[i + g] = i; bump(); }", False),
+    # global, which the store to *a* might change
+    ("for (int i = 0; i < 5; ++i) a[i + g] = i;", False),
+    # local, changed through a pointer by a call
+    ("for (int i = 0; i < 5; ++i) { a[i + k] = i; bump_ptr(kp); }", False),
+    # local whose address is never taken
+    ("for (int i = 0; i < 5; ++i) { a[i + m] = i; bump(); }", True),
+    # global, in a loop without calls or stores through pointers
+    ("for (int i = 0; i < 5; ++i) s += a[i + g];", True),
+    ])
+def test_strength_reduction_aliasing(body, reduced):
+    def count_offsets(code):
+        return len(re.findall(r"long _cnd_offset\d+ =", code))
+
+    src = PROGRAM % body
+    code = generate(src, strength_reduce=True)
+
+    assert (count_offsets(code)
+            > count_offsets(generate(PROGRAM % "", strength_reduce=True))
+            ) == reduced
+    assert run(code) == run(generate(src))
+
+
+@pytest.mark.parametrize(("body", "caught"), [
+    ("for (int i = 0; i < n; ++i) a[i] = i;", False),
+    ("for (int i = 0; i <= n; ++i) a[i] = i;", True),
+    ("for (int i = 0; i < 7; ++i) { a[i + g] = i; bump(); }", True),
+    ("for (int i = 0; i < 7; ++i) { a[i + k] = i; bump_ptr(kp); }", True),
+    ("for (int i = 0; i < 7; ++i) { a[i + m] = i; bump(); }", False),
+    ("m = 4; for (int i = 0; i < 7; ++i) { a[i + m] = i; bump(); }", True),
+    # the upper bound of *b* shrinks as *g* grows
+    ("for (int i = 0; i < 8; ++i) { b[i] = i; bump(); }", True),
+    ("for (int i = 0; i < 5; ++i) { b[i] = i; bump(); }", False),
+    ])
+def test_bounds_check_modes_agree(body, caught):
+    src = PROGRAM % body
+
+    results = []
+    for mode in ["naive", "hoisted"]:
+        status, output = run(generate(src, bounds_check=mode))
+        assert status == (1 if caught else 0), (mode, output)
+        results.append(re.findall(r"of array '(\w+)'", output))
+
+    # hoisted checks may report a different index, but the same array
+    naive, hoisted = results
+    assert naive == hoisted
+
+
+# *m* is a long, and *i* is cast to int already in the second reference.
+KERNEL = """
+__kernel void f(__global float *a, long n, long m)
+{
+  dimension a[n, m, 4];
+  int i = get_global_id(0);
+  for (int j = 0; j < m; ++j)
+    a[i, j, 3] = a[(int) i, j, 1];
+}
+"""
+
+
+@pytest.mark.parametrize(("settings", "expected"), [
+    (dict(), [
+        "a[(((i * m) + j) * 4) + 3] = a[(((((int) i) * m) + j) * 4) + 1];",
+        ]),
+    (dict(index_type="int"), [
+        "a[(((((int) i) * ((int) m)) + ((int) j)) * 4) + 3]",
+        "a[(((((int) i) * ((int) m)) + ((int) j)) * 4) + 1]",
+        ]),
+    (dict(index_type="long", hoist_strides=True), [
+        "const long _cnd_a_stride0 = 4 * ((long) m);",
+        "a[((((long) i) * _cnd_a_stride0) + (4 * ((long) j))) + 3]",
+        ]),
+    (dict(index_type="int", use_mad24=True), [
+        "a[mad24(mad24((int) i, (int) m, (int) j), 4, 3)]",
+        "a[mad24(mad24((int) i, (int) m, (int) j), 4, 1)]",
+        ]),
+    (dict(index_type="unsigned", use_mad24=True), [
+        "a[mad24(mad24((unsigned) i, (unsigned) m, (unsigned) j), "
+        "(unsigned) 4, (unsigned) 3)]",
+        ]),
+    (dict(index_type="int", use_mad24=True, hoist_strides=True), [
+        "const int _cnd_a_stride0 = mul24(4, (int) m);",
+        "a[mad24((int) i, _cnd_a_stride0, mul24(4, (int) j)) + 3]",
+        ]),
+    (dict(index_type="int", use_mad24=True, strength_reduce=True), [
+        "int _cnd_offset0 = mad24(mul24(4, (int) i), (int) m, "
+        "mul24(4, (int) j));",
+        "a[_cnd_offset1 + 3] = a[_cnd_offset0 + 1];",
+        ]),
+    ])
+def test_index_type(settings, expected):
+    code = cnd.transform_cl(KERNEL, use_cache=False, **settings)
+
+    for line in expected:
+        assert line in code, (line, code)
+
+    # Operands already of the index type are not converted again.
+    index_type = settings.get("index_type")
+    if index_type is not None:
+        assert "(%s) (%s)" % (index_type, index_type) not in code
+        assert "(%s) ((%s)" % (index_type, index_type) not in code
+        assert "(%s) _cnd_" % index_type not in code
+
+
+LINES_SOURCE = """\
+#include "lines.h"
+
+myint f(int n)
+{
+  myint x1 = 0;
+  dimension a[n];
+
+  x1 += 2;
+  x1 *= 3;
+
+
+
+  for (myint i = 0; i < n; ++i)
+    x1 += i;
+
+
+  return x1;
+}
+"""
+
+# LINES_SOURCE, as the C preprocessor makes of it
+LINES_PREPROCESSED = """\
+# 1 "%(file)s"
+# 1 "lines.h" 1
+typedef int myint;
+# 2 "%(file)s" 2
+""" + LINES_SOURCE.split("\n", 1)[1]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("line_directives", ["minimal", "statement"])
+def test_line_mapping(line_directives, stream):
+    tmpdir = tempfile.mkdtemp(prefix="cnd-test-")
+    try:
+        source = os.path.join(tmpdir, "lines.c")
+        with open(source, "w") as outf:
+            outf.write(LINES_PREPROCESSED % dict(file=source))
+
+        if stream:
+            from io import StringIO
+            outf = StringIO()
+            cnd.translate_file(source, outf=outf, stream=True,
+                    generator_settings=dict(line_directives=line_directives))
+            code = outf.getvalue()
+        else:
+            code = cnd.translate_file(source,
+                    generator_settings=dict(line_directives=line_directives))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # The header prefix is passed through, and establishes the location
+    # of the line following it, from which on the source lines are only
+    # a few lines apart.
+    prefix = '# 2 "%s" 2\n' % source
+    assert prefix in code
+    if line_directives == "minimal":
+        rest = code[code.index(prefix) + len(prefix):]
+        assert not rest.startswith("# ") and "\n# " not in rest
+
+    marker_re = re.compile(r'^\# ([0-9]+) "([^"]*)".*$')
+    source_lines = LINES_SOURCE.split("\n")
+
+    location = None
+    for line in code.split("\n"):
+        match = marker_re.match(line)
+        if match is not None:
+            location = match.group(2), int(match.group(1))
+            continue
+
+        if location is not None and location[0] == source and line.strip():
+            # (the generator adds spaces in places)
+            source_line = source_lines[location[1] - 1]
+            if line.strip() not in ["{", "}"]:
+                assert (line.replace(" ", "")
+                        == source_line.replace(" ", "")), (line, location)
+
+        if location is not None:
+            location = location[0], location[1] + 1
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        exec(sys.argv[1])
+    else:
+        from pytest import main
+        main([__file__])
+
+# vim: foldmethod=marker
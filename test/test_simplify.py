@@ -0,0 +1,305 @@
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import itertools
+import random
+
+import pytest
+from pycparser import c_ast
+
+import cnd
+
+
+# {{{ helpers
+
+def evaluate(node, env):
+    """Evaluate the integer expression *node* with C semantics (but without
+    overflow), looking up identifiers in *env*.
+    """
+    if isinstance(node, c_ast.Constant):
+        if isinstance(node.value, int):
+            return node.value
+        return int(node.value.rstrip("uUlL"), 0)
+
+    elif isinstance(node, c_ast.ID):
+        return env[node.name]
+
+    elif isinstance(node, c_ast.FuncCall):
+        # helpers of "morton" arrays, see cnd._MORTON_SPREAD_BODIES
+        for rank, func_name in cnd._MORTON_SPREAD_FUNCTIONS.items():
+            if node.name.name == func_name:
+                arg, = node.args.exprs
+                return spread_bits(evaluate(arg, env), rank)
+
+    elif isinstance(node, c_ast.UnaryOp):
+        value = evaluate(node.expr, env)
+        if node.op == "-":
+            return -value
+        elif node.op == "+":
+            return value
+
+    elif isinstance(node, c_ast.BinaryOp):
+        left = evaluate(node.left, env)
+        right = evaluate(node.right, env)
+
+        if node.op == "+":
+            return left + right
+        elif node.op == "-":
+            return left - right
+        elif node.op == "*":
+            return left * right
+        elif node.op in ["/", "%"]:
+            # C division truncates towards zero
+            quotient = abs(left) // abs(right)
+            if (left < 0) != (right < 0):
+                quotient = -quotient
+            if node.op == "/":
+                return quotient
+            else:
+                return left - quotient*right
+
+    raise ValueError("cannot evaluate %s" % type(node).__name__)
+
+
+def parse(src):
+    src = cnd.insert_parens_in_brackets("test.c", src)
+    return cnd.get_parser(cnd.GnuCndParser).parse(src, filename="test.c")
+
+
+def get_array_refs(ast):
+    """Return a list of tuples ``(dim_decl, indices)`` for the array
+    references in *ast*, where *dim_decl* is *None* for arrays that are not
+    dimensioned.
+    """
+    dim_decls = {}
+    refs = []
+
+    class Visitor(c_ast.NodeVisitor):
+        def visit_DimensionDecl(self, node):
+            dim_decls[node.name] = node
+
+        def visit_ArrayRef(self, node):
+            if isinstance(node.subscript, c_ast.ExprList):
+                indices = node.subscript.exprs
+            else:
+                indices = [node.subscript]
+            refs.append((dim_decls.get(node.name.name), indices))
+
+    Visitor().visit(ast)
+    return refs
+
+
+def spread_bits(value, rank):
+    """Return *value* (as an unsigned 64-bit integer) with *rank* - 1 zero
+    bits inserted after each of its bits, as far as they fit.
+    """
+    value %= 2**64
+
+    result = 0
+    for bit in range(64 // rank + 1):
+        if value & (1 << bit):
+            result |= 1 << (rank*bit)
+
+    return result % 2**64
+
+
+VARIABLES = ["i", "j", "k", "n", "m"]
+
+
+def random_env(rng):
+    return dict((name, rng.randint(-50, 50)) for name in VARIABLES)
+
+
+def random_expression(rng, depth):
+    if depth == 0 or rng.random() < 0.3:
+        if rng.random() < 0.6:
+            return c_ast.ID(rng.choice(VARIABLES))
+        else:
+            return c_ast.Constant("int", str(rng.randint(0, 5)))
+
+    if rng.random() < 0.1:
+        return c_ast.UnaryOp("-", random_expression(rng, depth - 1))
+
+    return c_ast.BinaryOp(rng.choice(["+", "-", "*"]),
+            random_expression(rng, depth - 1),
+            random_expression(rng, depth - 1))
+
+# }}}
+
+
+def test_random_expressions():
+    rng = random.Random(17)
+
+    for i in range(500):
+        expr = random_expression(rng, 4)
+        simplified = cnd.simplify_index_expression(expr)
+
+        for j in range(5):
+            env = random_env(rng)
+            assert evaluate(simplified, env) == evaluate(expr, env)
+
+
+def test_simplification_shrinks():
+    expr = c_ast.BinaryOp("*",
+            c_ast.BinaryOp("-", c_ast.ID("k"), c_ast.Constant("int", "1")),
+            c_ast.BinaryOp("+",
+                c_ast.BinaryOp("-", c_ast.ID("n"), c_ast.Constant("int", "1")),
+                c_ast.Constant("int", "1")))
+
+    simplified = cnd.simplify_index_expression(expr)
+    assert cnd._count_nodes(simplified) < cnd._count_nodes(expr)
+
+
+@pytest.mark.parametrize(("dimension", "rank"), [
+    ("a[n, m]", 2),
+    ("a[-3:n, -5:m]", 2),
+    ("a[-3:n:2, 1:m:3, k]", 3),
+    ("\"fortran\" a[n, m]", 2),
+    ("\"fortran\" a[-3:n, -2:m]", 2),
+    ("\"fortran\" a[-4:n:2, m, 0:k]", 3),
+    ("\"col-major\" a[-1:n, m:2*m]", 2),
+    ("\"c\" a[:n:2:n+1, -7:m]", 2),
+    ("\"tiled(4, 3)\" a[-2:n, 1:m]", 2),
+    ("\"morton\" a[-2:n, m]", 2),
+    ])
+def test_array_access(dimension, rank):
+    index_choices = ["i", "j+1", "k-1", "2*i-j", "(i+1)*(j-2)", "n-1", "3"]
+
+    rng = random.Random(dimension)
+    refs = ", ".join(
+            "a[%s]" % ", ".join(rng.choice(index_choices) for axis in range(rank))
+            for i in range(20))
+
+    for dim_decl, indices in get_array_refs(parse("""
+            void f(float *a, int i, int j, int k, int n, int m)
+            {
+              dimension %s;
+              %s;
+            }
+            """ % (dimension, refs))):
+        template = cnd._IndexTemplate(dim_decl)
+
+        access = template.build_access(indices)
+        simplified = cnd.simplify_index_expression(template.build_access(
+            indices, simplify=cnd.simplify_index_expression))
+
+        for i in range(10):
+            env = random_env(rng)
+            # keep lengths positive, as is required by the tiled layout
+            env["n"] = abs(env["n"]) + 1
+            env["m"] = abs(env["m"]) + 1
+            env["k"] = abs(env["k"]) + 1
+
+            assert evaluate(simplified, env) == evaluate(access, env), (
+                    dimension, env)
+
+
+@pytest.mark.parametrize(("dimension", "rank"), [
+    ("\"tiled(1, 1)\" a[n0, n1]", 2),
+    ("\"tiled(2, 2)\" a[n0, n1]", 2),
+    ("\"tiled(3, 2)\" a[-2:n0, n1]", 2),
+    ("\"tiled(4, 1)\" a[n0, 1:n1]", 2),
+    ("\"tiled(1, 3)\" a[n0, n1]", 2),
+    ("\"tiled(2, 1, 3)\" a[n0, -1:n1, n2]", 3),
+    ("\"morton\" a[n0, n1]", 2),
+    ("\"morton\" a[-3:n0, 2:n1]", 2),
+    ("\"z-order\" a[n0, n1, n2]", 3),
+    ])
+def test_layout_offsets(dimension, rank):
+    # For all small axis lengths, the offsets of the entries must be
+    # distinct and fall within the storage whose size nitemsof gives. They
+    # must fill it if there is no padding, i.e. if each tile size divides
+    # the length of its axis, or if all axes of a "morton" array have the
+    # same power-of-two length.
+    (dim_decl, _), = get_array_refs(parse("""
+            void f(float *a, int n0, int n1, int n2)
+            {
+              dimension %s;
+              a[%s];
+            }
+            """ % (dimension, ", ".join(["0"] * rank))))
+    template = cnd._IndexTemplate(dim_decl)
+
+    index_names = ["i%d" % axis for axis in range(rank)]
+    access = template.build_access([c_ast.ID(name) for name in index_names])
+    storage_size = template.get_storage_size()
+
+    for lengths in itertools.product(range(1, 7), repeat=rank):
+        env = dict(("n%d" % axis, length)
+                for axis, length in enumerate(lengths))
+
+        ranges = []
+        for dim in dim_decl.dims:
+            start = 0 if dim.start is None else evaluate(dim.start, env)
+            ranges.append(range(start, start + evaluate(dim.leading_dim, env)))
+
+        nitems = evaluate(storage_size, env)
+        offsets = set()
+        for indices in itertools.product(*ranges):
+            env.update(zip(index_names, indices))
+            offset = evaluate(access, env)
+
+            assert 0 <= offset < nitems, (dimension, env)
+            assert offset not in offsets, (dimension, env)
+            offsets.add(offset)
+
+        axis_lengths = [len(axis_range) for axis_range in ranges]
+        if dim_decl.layout == "tiled":
+            padded = any(length % tile_size
+                    for length, tile_size in zip(
+                        axis_lengths, dim_decl.tile_sizes))
+        else:
+            padded = (len(set(axis_lengths)) != 1
+                    or axis_lengths[0] & (axis_lengths[0] - 1))
+
+        if not padded:
+            assert len(offsets) == nitems, (dimension, env)
+
+
+def test_generated_code():
+    # Parse the code generated with and without simplification and compare
+    # the subscripts, which now refer to plain C arrays.
+    ast = parse("""
+        void f(float *a, float *b, int n, int m)
+        {
+          dimension "fortran" a[-3:n, m];
+          dimension b[1:n+1, -2:m:2];
+          for (int i = 1; i <= n; ++i)
+            for (int j = 1; j <= m; ++j)
+              a[i, j] = b[i+1, j-1] + a[n, 2*j-1] + b[(i+1)*(j-2), 0]
+                + nitemsof(a);
+        }
+        """)
+
+    subscripts = []
+    for simplify in [False, True]:
+        generator = cnd.GnuCGenerator()
+        generator.line_directives = None
+        generator.simplify_index_expressions = simplify
+
+        subscripts.append([indices
+                for dim_decl, indices in get_array_refs(
+                    parse(generator.visit(ast)))])
+
+    unsimplified, simplified = subscripts
+    assert len(unsimplified) == len(simplified) == 4
+
+    rng = random.Random(5)
+    for i in range(20):
+        env = random_env(rng)
+        for old_indices, new_indices in zip(unsimplified, simplified):
+            old_index, = old_indices
+            new_index, = new_indices
+            assert evaluate(new_index, env) == evaluate(old_index, env)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        exec(sys.argv[1])
+    else:
+        from pytest import main
+        main([__file__])
+
+# vim: foldmethod=marker